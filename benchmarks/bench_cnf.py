@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""Time the conversion of a programming language grammar to CNF.
+
+    python benchmarks/bench_cnf.py [--copies 10] [--identifiers 200]
+
+The grammar is a C-like language with statements, declarations and a chain of
+fourteen expression precedence levels, written with empty productions for
+optional parts and unit productions between the levels, which is the kind of
+grammar that makes the empty and unit production steps of the conversion
+work. `--copies` renamed copies of it are joined under one start symbol to
+make it bigger, and `--identifiers` sets the size of the lexicon of names.
+"""
+
+from __future__ import division
+
+from optparse import OptionParser
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import cfgparse
+import cnf
+
+
+# The productions of one copy of the language. Every nonterminal gets the
+# suffix of its copy, and Name and TypeName get a lexicon.
+LANGUAGE = """
+Program -> Decls
+Decls -> Decl Decls |
+Decl -> FuncDecl | VarDecl ';' | StructDecl | TypedefDecl
+FuncDecl -> Specs Declarator '(' Params ')' Block
+VarDecl -> Specs InitDeclarators
+InitDeclarators -> InitDeclarator | InitDeclarator ',' InitDeclarators
+InitDeclarator -> Declarator | Declarator '=' Initializer
+Initializer -> AssignExpr | '{' InitList OptComma '}'
+InitList -> Initializer | Initializer ',' InitList
+OptComma -> ',' |
+StructDecl -> 'struct' Name '{' Fields '}' ';'
+Fields -> VarDecl ';' Fields |
+TypedefDecl -> 'typedef' Specs Declarator ';'
+Specs -> Storage Qualifiers TypeSpec
+Storage -> 'static' | 'extern' | 'register' |
+Qualifiers -> Qualifier Qualifiers |
+Qualifier -> 'const' | 'volatile'
+TypeSpec -> 'void' | 'char' | 'short' | 'int' | 'long' | 'float' | 'double'
+TypeSpec -> 'unsigned' TypeSpec | 'signed' TypeSpec | 'struct' Name | TypeName
+Declarator -> Pointer DirectDeclarator
+Pointer -> '*' Qualifiers Pointer |
+DirectDeclarator -> Name | '(' Declarator ')' | DirectDeclarator '[' OptExpr ']'
+Params -> ParamList | 'void' |
+ParamList -> Param | Param ',' ParamList
+Param -> Specs Declarator | Specs Pointer
+Block -> '{' Items '}'
+Items -> Item Items |
+Item -> VarDecl ';' | Stmt
+Stmt -> Block | OptExpr ';' | IfStmt | LoopStmt | JumpStmt | LabeledStmt
+IfStmt -> 'if' '(' Expr ')' Stmt | 'if' '(' Expr ')' Stmt 'else' Stmt
+IfStmt -> 'switch' '(' Expr ')' Stmt
+LoopStmt -> 'while' '(' Expr ')' Stmt | 'do' Stmt 'while' '(' Expr ')' ';'
+LoopStmt -> 'for' '(' OptExpr ';' OptExpr ';' OptExpr ')' Stmt
+JumpStmt -> 'return' OptExpr ';' | 'break' ';' | 'continue' ';'
+JumpStmt -> 'goto' Name ';'
+LabeledStmt -> Name ':' Stmt | 'case' CondExpr ':' Stmt | 'default' ':' Stmt
+OptExpr -> Expr |
+Expr -> AssignExpr | Expr ',' AssignExpr
+AssignExpr -> CondExpr | UnaryExpr AssignOp AssignExpr
+AssignOp -> '=' | '*=' | '/=' | '%=' | '+=' | '-=' | '<<=' | '>>=' | '&=' | '^='
+AssignOp -> '|='
+CondExpr -> OrExpr | OrExpr '?' Expr ':' CondExpr
+OrExpr -> AndExpr | OrExpr '||' AndExpr
+AndExpr -> BitOrExpr | AndExpr '&&' BitOrExpr
+BitOrExpr -> XorExpr | BitOrExpr '|' XorExpr
+XorExpr -> BitAndExpr | XorExpr '^' BitAndExpr
+BitAndExpr -> EqExpr | BitAndExpr '&' EqExpr
+EqExpr -> RelExpr | EqExpr '==' RelExpr | EqExpr '!=' RelExpr
+RelExpr -> ShiftExpr | RelExpr RelOp ShiftExpr
+RelOp -> '<' | '>' | '<=' | '>='
+ShiftExpr -> AddExpr | ShiftExpr '<<' AddExpr | ShiftExpr '>>' AddExpr
+AddExpr -> MulExpr | AddExpr '+' MulExpr | AddExpr '-' MulExpr
+MulExpr -> CastExpr | MulExpr MulOp CastExpr
+MulOp -> '*' | '/' | '%'
+CastExpr -> UnaryExpr | '(' TypeSpec Pointer ')' CastExpr
+UnaryExpr -> PostfixExpr | '++' UnaryExpr | '--' UnaryExpr
+UnaryExpr -> UnaryOp CastExpr | 'sizeof' UnaryExpr | 'sizeof' '(' TypeSpec ')'
+UnaryOp -> '&' | '*' | '+' | '-' | '~' | '!'
+PostfixExpr -> Primary | PostfixExpr '[' Expr ']' | PostfixExpr '(' Args ')'
+PostfixExpr -> PostfixExpr '.' Name | PostfixExpr '->' Name
+PostfixExpr -> PostfixExpr '++' | PostfixExpr '--'
+Args -> ArgList |
+ArgList -> AssignExpr | AssignExpr ',' ArgList
+Primary -> Name | Constant | '(' Expr ')'
+Constant -> '0' | '1' | '42' | '3.14' | "'c'" | '"string"'
+"""
+
+
+def make_grammar(copies, identifiers):
+    """Return the text of `copies` renamed copies of LANGUAGE with a lexicon
+    of `identifiers` names, and the number of productions in it."""
+    lines = ['Start -> ' + ' | '.join('Program%d' % copy
+                                      for copy in range(copies))]
+    nonterminals = set(line.split('->')[0].strip()
+                       for line in LANGUAGE.strip().split('\n'))
+    nonterminals.update(['Name', 'TypeName'])
+    for copy in range(copies):
+        for line in LANGUAGE.strip().split('\n'):
+            lines.append(' '.join(token + str(copy)
+                                  if token in nonterminals else token
+                                  for token in line.split()))
+        lines.append('Name%d -> ' % copy + ' | '.join(
+            "'name%d'" % i for i in range(identifiers)))
+        lines.append('TypeName%d -> ' % copy + ' | '.join(
+            "'type%d_t'" % i for i in range(identifiers // 10 + 1)))
+    text = '\n'.join(lines)
+    return text, len(cfgparse.parse_grammar(text)[1])
+
+
+def main(argv):
+    parser = OptionParser()
+    parser.add_option('--copies', type='int', default=10,
+                      help='Number of copies of the language.')
+    parser.add_option('--identifiers', type='int', default=200,
+                      help='Number of names in the lexicon of each copy.')
+    options, args = parser.parse_args(argv)
+
+    text, size = make_grammar(options.copies, options.identifiers)
+    start = time.time()
+    start_symbol, productions = cfgparse.parse_grammar(text)
+    parsed = time.time()
+    converted = cnf.convert_productions(start_symbol, productions,
+                                        cfgparse.Nonterminal)
+    done = time.time()
+    print '%d productions in, %d CNF productions out' % (size, len(converted))
+    print 'parse   %.3fs' % (parsed - start)
+    print 'convert %.3fs' % (done - parsed)
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+"""Compare the split point search methods of CFLGenerator.generate.
+
+    python benchmarks/bench_generate.py [--number 20] [LENGTH ...]
+
+For each length, prints the preprocessing time and the mean time per string of
+every method in cfl.GENERATION_METHODS.
+"""
+
+from __future__ import division
+
+from optparse import OptionParser
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import cfl
+
+
+# Arithmetic expressions over x and y with unary minus, already in CNF.
+EXPRESSIONS = """
+E -> E T | L F | M E | 'x' | 'y'
+T -> O E
+O -> '+' | '*'
+F -> E R
+L -> '('
+M -> '-'
+R -> ')'
+"""
+
+
+def time_method(generator, length, method, number):
+    """Return the mean time in seconds to generate a string."""
+    start = time.time()
+    for i in range(number):
+        generator.generate(length, method)
+    return (time.time() - start) / number
+
+
+def main(argv):
+    parser = OptionParser(usage='%prog [options] [LENGTH ...]')
+    parser.add_option('-n', '--number', dest='number', action='store',
+                      default=20, metavar='<NUMBER>', type='int',
+                      help='Strings to generate per length and method.')
+    options, args = parser.parse_args(argv)
+    lengths = [int(arg) for arg in args] or [25, 50, 100, 200, 400]
+
+    print '%8s %12s' % ('length', 'preprocess'),
+    print ' '.join(['%14s' % method for method in cfl.GENERATION_METHODS])
+    for length in lengths:
+        start = time.time()
+        generator = cfl.CFLGenerator(EXPRESSIONS, length)
+        preprocess = time.time() - start
+        print '%8d %11.4fs' % (length, preprocess),
+        print ' '.join(['%13.6fs' % time_method(generator, length, method,
+                                                options.number)
+                        for method in cfl.GENERATION_METHODS])
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
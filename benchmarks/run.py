@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+"""Run the benchmark suite and write the results as JSON.
+
+    python benchmarks/run.py [--quick] [--repeat 3] [-o results.json]
+                             [--compare baseline.json [--tolerance 1.25]]
+
+Every grammar of CORPUS is put through three benchmarks:
+
+    cnf         -- converting the grammar to CNF (cnf.convert_productions)
+    preprocess  -- counting the strings up to the longest length of the
+                   grammar (CFLGenerator._update_counts)
+    generate    -- generating a string of each length (the time is the mean
+                   over --number strings)
+
+Each benchmark runs in a process of its own, so that its peak memory can be
+measured: peak_rss_kb is the largest resident set size of the process and
+memory_kb the part of it that was added during the benchmark. numpy is
+imported, the grammar parsed and the generator made before that, so
+memory_kb only counts what the timed part adds, e.g. the count table. With
+--repeat, the fastest time and the largest memory of the runs are kept.
+
+With --compare, the results are compared with an earlier output file and the
+exit status is 1 if any benchmark got slower than --tolerance times its
+earlier time, by more than NOISE_SECONDS, or took more than --tolerance
+times its earlier memory, by more than NOISE_KB.
+"""
+
+from __future__ import division
+
+from multiprocessing import Pipe, Process
+from optparse import OptionParser
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import bench_cnf
+import bench_generate
+import cfgparse
+import cfl
+import cnf
+import counttable
+import generatewords
+
+
+# Differences in time smaller than this are never counted as regressions.
+NOISE_SECONDS = 0.001
+
+# Differences in memory smaller than this are never counted as regressions.
+NOISE_KB = 1024
+
+# Balanced strings of two kinds of brackets.
+DYCK = """
+S -> '(' S ')' S | '[' S ']' S |
+"""
+
+# (name, grammar text, lengths generated, lengths generated with --quick).
+# The synthetic grammar is two copies of the C-like language of bench_cnf.py.
+CORPUS = [
+    ('dyck', DYCK, [20, 100, 400], [20, 100]),
+    ('expressions', bench_generate.EXPRESSIONS, [25, 101, 401], [25, 101]),
+    ('phonology', generatewords.GRAMMAR, [10, 50, 200], [10, 50]),
+    ('synthetic', bench_cnf.make_grammar(2, 50)[0], [20, 40, 80], [20, 40]),
+]
+
+
+# Each benchmark function does the setup that isn't measured and returns a
+# function that does the rest and returns its time in seconds.
+
+def bench_conversion(text):
+    """Return a function that converts `text` to CNF."""
+    start_symbol, productions = cfgparse.parse_grammar(text)
+
+    def run():
+        start = time.time()
+        cnf.convert_productions(start_symbol, productions,
+                                cfgparse.Nonterminal)
+        return time.time() - start
+    return run
+
+
+def bench_preprocess(text, length):
+    """Return a function that counts the strings of `text` up to
+    `length`."""
+    generator = cfl.CFLGenerator(text, 1, cache_dir=None)
+
+    def run():
+        start = time.time()
+        generator._update_counts(length)
+        return time.time() - start
+    return run
+
+
+def bench_generation(text, length, number):
+    """Return a function that generates `number` strings of length `length`
+    and returns the mean time, or None if there are no strings of that
+    length."""
+    generator = cfl.CFLGenerator(text, length, seed=0, cache_dir=None)
+
+    def run():
+        start = time.time()
+        try:
+            for i in range(number):
+                generator.generate(length)
+        except cfl.GenerationFailure:
+            return None
+        return (time.time() - start) / number
+    return run
+
+
+def _run_in_child(connection, function, args):
+    # The count tables import numpy when they need it, which takes more
+    # memory than most of them. Import it first, so it isn't counted.
+    counttable.have_numpy()
+    run = function(*args)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    seconds = run()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    connection.send((seconds, peak, peak - before))
+    connection.close()
+
+
+def measure(function, *args):
+    """Return (seconds, peak_rss_kb, memory_kb) of the benchmark
+    `function(*args)` (see bench_conversion), run in a new process."""
+    receiver, sender = Pipe(duplex=False)
+    process = Process(target=_run_in_child, args=(sender, function, args))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        raise RuntimeError('benchmark %s%r failed' % (function.__name__, args))
+    finally:
+        process.join()
+    return result
+
+
+def run_suite(quick=False, repeat=1, number=20, log=None):
+    """Run every benchmark `repeat` times and return the list of results.
+
+    Each result is a dict with the keys grammar, benchmark, length (None for
+    cnf), seconds, peak_rss_kb and memory_kb. If `log` is a file, a line is
+    written to it as each benchmark finishes.
+    """
+    results = []
+    for name, text, lengths, quick_lengths in CORPUS:
+        if quick:
+            lengths = quick_lengths
+        cases = [('cnf', None, bench_conversion, (text,)),
+                 ('preprocess', max(lengths), bench_preprocess,
+                  (text, max(lengths)))]
+        cases.extend(('generate', length, bench_generation,
+                      (text, length, number)) for length in lengths)
+        for benchmark, length, function, args in cases:
+            runs = [measure(function, *args) for i in range(repeat)]
+            seconds = [run[0] for run in runs]
+            result = {'grammar': name,
+                      'benchmark': benchmark,
+                      'length': length,
+                      'seconds': None if None in seconds else min(seconds),
+                      'peak_rss_kb': max(run[1] for run in runs),
+                      'memory_kb': max(run[2] for run in runs)}
+            results.append(result)
+            if log is not None:
+                print >> log, '%-12s %-10s %6s %12s %10d kB' % (
+                    name, benchmark, '-' if length is None else length,
+                    '-' if result['seconds'] is None
+                    else '%.6fs' % result['seconds'],
+                    result['memory_kb'])
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of (result, key, earlier value) for the results whose
+    'seconds' or 'memory_kb' is more than `tolerance` times (and NOISE_SECONDS
+    or NOISE_KB) larger than for the same benchmark in the list `baseline`."""
+    earlier = dict(((result['grammar'], result['benchmark'], result['length']),
+                    result) for result in baseline)
+    worse = []
+    for result in results:
+        old = earlier.get((result['grammar'], result['benchmark'],
+                           result['length']))
+        if old is None:
+            continue
+        for key, noise in (('seconds', NOISE_SECONDS),
+                           ('memory_kb', NOISE_KB)):
+            before = old.get(key)
+            if before is not None and result[key] is not None and \
+                    result[key] > before * tolerance and \
+                    result[key] > before + noise:
+                worse.append((result, key, before))
+    return worse
+
+
+def main(argv):
+    parser = OptionParser()
+    parser.add_option('--quick', action='store_true', default=False,
+                      help='Only the shorter lengths of each grammar.')
+    parser.add_option('-r', '--repeat', type='int', default=1,
+                      metavar='<NUMBER>',
+                      help='Runs of each benchmark. The fastest is kept.')
+    parser.add_option('-n', '--number', type='int', default=20,
+                      metavar='<NUMBER>',
+                      help='Strings generated per length.')
+    parser.add_option('-o', '--output', default='-', metavar='<FILENAME>',
+                      help="File to write the JSON to. Defaults to stdout "
+                           "('-').")
+    parser.add_option('--compare', default=None, metavar='<FILENAME>',
+                      help='Earlier output to compare the results with.')
+    parser.add_option('--tolerance', type='float', default=1.25,
+                      metavar='<RATIO>',
+                      help='Ratio of time or memory that counts as a '
+                           'regression.')
+    options, args = parser.parse_args(argv)
+    if options.repeat < 1 or options.number < 1:
+        parser.error('--repeat and --number must be positive.')
+
+    results = run_suite(options.quick, options.repeat, options.number,
+                        log=sys.stderr)
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'numpy': counttable.have_numpy(),
+              'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'quick': options.quick,
+              'repeat': options.repeat,
+              'number': options.number,
+              'results': results}
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if options.output == '-':
+        print text
+    else:
+        with open(options.output, 'w') as out:
+            print >> out, text
+
+    if options.compare is not None:
+        with open(options.compare) as baseline:
+            worse = compare(results, json.load(baseline)['results'],
+                            options.tolerance)
+        for result, key, before in worse:
+            if key == 'seconds':
+                change = '%.6fs, was %.6fs' % (result[key], before)
+            else:
+                change = '%d kB, was %d kB' % (result[key], before)
+            print >> sys.stderr, '%s %s %s: %s' % (
+                result['grammar'], result['benchmark'], result['length'],
+                change)
+        if worse:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
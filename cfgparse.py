@@ -0,0 +1,121 @@
+"""A fast reader for grammars in NLTK's .cfg text format.
+
+parse_grammar() reads the same format as nltk.grammar.parse_cfg:
+
+    # A comment.
+    %start S
+    S -> A B | 'c'
+    A -> 'a' | "b"
+    B ->
+
+Each line has a nonterminal, '->' and alternatives separated by '|'.
+Terminals are quoted and nonterminals aren't. If there is no %start line, the
+first LHS is the start symbol.
+
+Importing nltk takes longer than generating a string from a small grammar,
+so CFLGenerator uses this module instead and only imports nltk when it needs
+nltk objects.
+"""
+
+import re
+
+_NONTERMINAL = re.compile(r'[\w/][\w/^<>-]*$')
+_TOKEN = re.compile(r"""\s*(?:'([^']+)'|"([^"]+)"|([\w/][\w/^<>-]*)|(\|))""")
+
+
+class Nonterminal(object):
+    """A nonterminal symbol, like nltk.grammar.Nonterminal.
+
+    It hashes like an nltk Nonterminal with the same symbol, and equals any
+    object whose _symbol is the same.
+    """
+
+    __slots__ = ('_symbol',)
+
+    def __init__(self, symbol):
+        self._symbol = symbol
+
+    def symbol(self):
+        return self._symbol
+
+    def __eq__(self, other):
+        try:
+            return self._symbol == other._symbol
+        except AttributeError:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._symbol)
+
+    def __reduce__(self):
+        return (Nonterminal, (self._symbol,))
+
+    def __repr__(self):
+        return '%s' % (self._symbol,)
+
+    __str__ = __repr__
+
+
+def parse_grammar(text):
+    """Return (start, productions) for the grammar in `text`.
+
+    `productions` is a list of (lhs, rhs) pairs, where lhs is a Nonterminal
+    and rhs is a tuple of Nonterminals and terminal strings. Raise ValueError
+    if a line can't be parsed.
+    """
+    start = None
+    productions = []
+    nonterminals = {}
+
+    def nonterminal(symbol):
+        try:
+            return nonterminals[symbol]
+        except KeyError:
+            nonterminals[symbol] = Nonterminal(symbol)
+            return nonterminals[symbol]
+
+    for number, line in enumerate(text.split('\n')):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('%start'):
+            symbol = line[len('%start'):].strip()
+            if not _NONTERMINAL.match(symbol):
+                raise ValueError('Unable to parse line %d: %s'
+                                 % (number + 1, line))
+            start = nonterminal(symbol)
+            continue
+
+        lhs, arrow, rhs = line.partition('->')
+        lhs = lhs.strip()
+        if not arrow or not _NONTERMINAL.match(lhs):
+            raise ValueError('Unable to parse line %d: %s' % (number + 1, line))
+        lhs = nonterminal(lhs)
+        if start is None:
+            start = lhs
+
+        alternative = []
+        position = 0
+        rhs = rhs.rstrip()
+        while position < len(rhs):
+            match = _TOKEN.match(rhs, position)
+            if match is None:
+                raise ValueError('Unable to parse line %d: %s'
+                                 % (number + 1, line))
+            single, double, symbol, bar = match.groups()
+            if bar:
+                productions.append((lhs, tuple(alternative)))
+                alternative = []
+            elif symbol:
+                alternative.append(nonterminal(symbol))
+            else:
+                alternative.append(single or double)
+            position = match.end()
+        productions.append((lhs, tuple(alternative)))
+
+    if start is None:
+        raise ValueError('The grammar has no productions.')
+    return start, productions
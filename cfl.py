@@ -4,6 +4,13 @@
 
 from __future__ import division
 
+from bisect import bisect_left, bisect_right
+from collections import deque
+import errno
+import gzip
+import hashlib
+import io
+from math import ceil, exp, floor
 from optparse import OptionParser
 import random
 try: 
@@ -11,79 +18,312 @@ try:
 except ImportError:
     import json
 import sys
+import time
 
-import nltk
-from nltk.grammar import parse_cfg, Nonterminal, ContextFreeGrammar, Production
+from boltzmann import BoltzmannSampler, SamplerFailure
+import cfgparse
+from cnf import convert_productions
+from compiledgrammar import CompiledGrammar, is_chomsky_normal_form
+from counttable import extend_count_table, make_count_table
+import diskcache
+from grammartransformations import remove_useless
+from lengthindex import LengthIndex
+from lrucache import LRUCache
+
+# Ways of choosing split points that CFLGenerator.generate accepts.
+GENERATION_METHODS = ('sequential', 'boustrophedon')
+
+# The phases that CFLGenerator.stats() times and the counters it keeps.
+PHASES = ('cache', 'parse', 'cnf', 'compile', 'count', 'generate')
+COUNTERS = ('cells', 'multiplies', 'strings', 'nodes', 'failures', 'recounts',
+            'rejected')
+
+# Default relative tolerance of the length of CFLGenerator.generate_approx.
+DEFAULT_TOLERANCE = 0.1
+
+# Default bound on the bytes of prefix sums cached by a CFLGenerator.
+DEFAULT_CACHE_SIZE = 1 << 26
+
+# Factor by which the counts grow past the disk cache before a CFLGenerator
+# writes them again (see CFLGenerator.save_cache).
+CACHE_GROWTH = 2
+
+# Bytes that _cdf_bytes counts for an entry of the cache, and for each of its
+# items besides the digits of its prefix sum: the list slots, the int or
+# tuple of the choice and the header of the prefix sum.
+ENTRY_BYTES = 200
+ITEM_BYTES = 80
+
+# Number of BoltzmannSamplers, one per range of lengths, that a CFLGenerator
+# keeps for generate_approx.
+SAMPLER_CACHE_SIZE = 8
 
-from cnf import convert_to_cnf
 
 class CFLGenerator(object):
     """Random string generation from the language generated by input grammar.
     """
 
-    def __init__(self, grammar, length=1):
+    def __init__(self, grammar, length=1, backend=None,
+                 cache_size=DEFAULT_CACHE_SIZE, seed=None, cache_dir=None):
         """Convert the grammar to Chomsky Normal Form and do preprocessing.
         
         `grammar` can be:
             (1) an instance of nltk.grammar.ContextFreeGrammar,
             (2) a string representing the path to a .cfg file, or
-            (3) a string that can be parsed into a grammar by parse_cfg
+            (3) a string in the format of nltk.grammar.parse_cfg (see
+                cfgparse.py)
+
+        Nonterminals that are unreachable from the start symbol or derive no
+        string of terminals are dropped (see grammartransformations.py), so
+        they have no counts.
+
+        Grammars given as text are read and converted to CNF without nltk.
+        nltk is only imported when the `grammar` attribute is used.
 
         `length` is the maximum string length that should be preprocessed.
+
+        `backend` names the counttable backend used to compute the counts
+        ('python', 'numpy' or 'approximate'). By default the counts are
+        computed in Python, and in numpy, if it is installed, once they are
+        extended far enough for that to pay for importing it. With 'approximate' the counts are scaled floats, which
+        are much faster for long strings but make each derivation's
+        probability only nearly uniform (see counttable.py). unrank(), rank()
+        and sample_distinct() need exact counts, and approximate counts are
+        not kept in the disk cache.
+
+        `cache_size` bounds the memory, in bytes, of the prefix sums kept for
+        choosing lengths, rules and split points. The size of an entry grows
+        with the number of its choices and the number of digits of its
+        counts (see _cdf_bytes), so at long lengths fewer entries fit. The
+        least recently used ones are evicted first and 0 disables the cache.
+
+        If `seed` is given, the generator draws from its own random.Random
+        seeded with it. Otherwise it uses the random module. Either way the
+        source of randomness is the attribute `random`, which can be replaced.
+
+        If `cache_dir` is given, the CNF grammar and the count table are kept
+        in a file in that directory (see diskcache.py), keyed by the text of
+        the grammar. Later generators for the same text start from the file
+        and only count lengths that it doesn't cover yet. The file is written
+        again when the counts reach CACHE_GROWTH times the length it has, so
+        extending the counts a length at a time doesn't rewrite it every time
+        (see save_cache).
+
+        The generator keeps counters and the time spent in each phase of its
+        work, which stats() returns. Each function in the list `hooks` is
+        called as hook(phase, seconds) whenever a phase ends.
         """
         if length < 1:
             raise ValueError('length must be greater than 0.')
 
-        # self.grammar must be instance of nltk.grammar.Grammar
-        if isinstance(grammar, ContextFreeGrammar): 
-            self.grammar = grammar
-        elif isinstance(grammar, str) and grammar.endswith('.cfg'):
-            self.grammar = nltk.data.load('file:' + grammar)
-        elif isinstance(grammar, str):
-            self.grammar = parse_cfg(grammar)
+        self.hooks = []
+        self._seconds = dict.fromkeys(PHASES, 0.0)
+        self._counters = dict.fromkeys(COUNTERS, 0)
+
+        # The text of the grammar is what the disk cache is keyed by.
+        source = _grammar_source(grammar)
+        self.cache_dir = cache_dir
+        self._source = source
+        cached = None
+        if cache_dir is not None:
+            started = time.time()
+            cached = diskcache.load(cache_dir, source)
+            self._timed('cache', started)
+
+        # self._grammar is the nltk version of the CNF grammar. Grammars given
+        # as text are read without nltk, so it is only built if it's needed.
+        self._grammar = None
+        if cached is not None:
+            self.compiled = CompiledGrammar.from_state(cached['grammar'],
+                                                       cfgparse.Nonterminal)
         else:
-            raise ValueError('Arg grammar must be nltk.grammar.Grammar or str.')
-        
-        if not self.grammar.is_chomsky_normal_form():
-            #raise ValueError('Input grammar must be in CNF '
-            #                 '(conversion method isn\'t implemented)')
-            self.grammar = convert_to_cnf(self.grammar)
-            assert self.grammar.is_chomsky_normal_form()
+            started = time.time()
+            if isinstance(grammar, basestring):
+                start, productions = cfgparse.parse_grammar(source)
+            else:
+                self._grammar = grammar
+                start = grammar.start()
+                productions = [(p.lhs(), p.rhs())
+                               for p in grammar.productions()]
+            started = self._timed('parse', started)
+
+            if not is_chomsky_normal_form(productions):
+                # New nonterminals are of the same type as the grammar's.
+                productions = convert_productions(start, productions,
+                                                  type(start))
+                self._grammar = None
+            started = self._timed('cnf', started)
 
-        self.productions = self.grammar.productions()
+            # Only count the nonterminals that can be part of a derivation.
+            useful = remove_useless(start, productions)
+            if len(useful) != len(productions):
+                productions = useful
+                self._grammar = None
 
-        # TODO: Is it ok to assume all nonterminals occur on a LHS?
-        # Technically yes, but check whether nltk's is_cnf ensures it.
-        self.nonterminals = set([p.lhs() for p in self.productions])
+            # The counts and the sampler work on this integer-indexed copy of
+            # the grammar rather than on the nltk objects. Equivalent
+            # nonterminals, which CNF conversion makes many of, share a row.
+            compiled = CompiledGrammar(start, productions)
+            self.compiled = compiled.merge_equivalent()
+            if len(self.compiled) != len(compiled):
+                self._grammar = None
+            self._timed('compile', started)
 
-        self.terminals = set([token for prod in self.productions 
-                              for token in prod.rhs()
-                              if not isinstance(token, Nonterminal)])
+        # The lengths that have strings, found without counting them, so
+        # that lengths without strings fail before the counts are extended.
+        started = time.time()
+        self.length_index = LengthIndex(self.compiled)
+        self._timed('compile', started)
 
         # Initialize self._counts then populate it in _preprocess(). 
         # self.length is the string length that has been preprocessed.
-        self._counts = {}
+        self.random = random if seed is None else random.Random(seed)
+        self.backend = backend
+        self._table = None
+        self._counts = []
+        self._rule_counts = []
+        self._cdf_cache = LRUCache(cache_size)
+        self._samplers = LRUCache(SAMPLER_CACHE_SIZE)
         self.length = 0
-        self._preprocess(length)
+        self._cached_length = 0
+        if cached is None:
+            self._preprocess(length)
+        else:
+            self._cached_length = cached['snapshot'][0]
+            self._preprocess(length, cached['snapshot'])
+        self._save_cache()
 
 
     def __repr__(self):
         return "CFLGenerator(%s)" % str(self.grammar)
+
+    def stats(self):
+        """Return a dict of what the generator has done so far:
+
+            nonterminals, rules -- the size of the compiled grammar
+            length              -- the longest length counted
+            backend             -- the class of the count table
+            cells               -- counts computed, one per nonterminal or
+                                   binary rule and length
+            multiplies          -- products of two counts computed for them
+            max_bits            -- bits of the largest count
+            strings             -- strings generated
+            nodes               -- nodes of their derivations (2n - 1 for a
+                                   string of length n)
+            failures            -- GenerationFailures raised
+            recounts            -- counts of rules that count_by_prod
+                                   computed because they weren't in the table
+            rejected            -- strings of generate_approx() rejected for
+                                   their length
+            seconds             -- a dict of the time spent in each phase:
+                                   'cache' (reading and writing the disk
+                                   cache), 'parse', 'cnf', 'compile' (removing
+                                   useless symbols and merging), 'count' and
+                                   'generate'
+
+        All of them are kept as the work is done, and take constant time per
+        count table extension or string. The strings of generate_iter() are
+        counted, but the time spent iterating over them isn't.
+        """
+        stats = dict(self._counters)
+        stats.update(
+            nonterminals=len(self.compiled),
+            rules=sum(len(rules) for rules in self.compiled.binary_rules),
+            length=self.length,
+            backend=type(self._table).__name__,
+            max_bits=self._table.max_bits,
+            seconds=dict(self._seconds))
+        return stats
+
+    def _timed(self, phase, started):
+        """Add the time since `started` to the time of `phase`, call the
+        hooks, and return the time now."""
+        now = time.time()
+        self._seconds[phase] += now - started
+        for hook in self.hooks:
+            hook(phase, now - started)
+        return now
+
+    def _add_work(self, counters, seconds):
+        """Add counters and times of phases, e.g. from a copy of the generator
+        in another process, to those of stats()."""
+        for key, value in counters.iteritems():
+            self._counters[key] += value
+        for phase, value in seconds.iteritems():
+            self._seconds[phase] += value
+
+    def _failure(self, length):
+        """Count a GenerationFailure for `length` and return it."""
+        self._counters['failures'] += 1
+        return GenerationFailure(length)
+
+    @property
+    def grammar(self):
+        """The CNF grammar as an nltk.grammar.ContextFreeGrammar.
+
+        If equivalent nonterminals were merged, this is the merged grammar,
+        where a rule that stands for several has a single production.
+        """
+        if self._grammar is None:
+            compiled = self.compiled
+            self._grammar = _nltk_grammar(
+                compiled.nonterminals[compiled.start], compiled.productions())
+        return self._grammar
+
+    @property
+    def productions(self):
+        """The nltk Productions of the CNF grammar."""
+        return self.grammar.productions()
+
+    @property
+    def nonterminals(self):
+        """The set of nonterminals that are the LHS of some production."""
+        compiled = self.compiled
+        return set([nonterm for A, nonterm in enumerate(compiled.nonterminals)
+                    if compiled.binary_rules[A] or compiled.terminal_rules[A]])
+
+    @property
+    def terminals(self):
+        """The set of terminals of the grammar."""
+        return set(self.compiled.terminals)
         
+    def feasible(self, length, nonterm=None):
+        """Return whether `nonterm` (the start symbol by default) derives a
+        string of length `length`.
+
+        This is looked up in self.length_index, in constant time for any
+        length when the index found the period of the lengths. Otherwise the
+        counts are extended to `length` if they don't cover it yet.
+        """
+        if nonterm is None:
+            ident = self.compiled.start
+        else:
+            ident = self.compiled.nonterminal_id(nonterm)
+        feasible = self.length_index.feasible(ident, length)
+        if feasible is None:
+            if length > self.length:
+                self._update_counts(length)
+            feasible = bool(self._counts[ident][length])
+        return feasible
+
     def count_by_nonterm(self, nonterm, length):
         """Return number of strings of length `length` derivable from `nonterm`.
         """
-        if isinstance(nonterm, basestring):
-            nts = [nt for nt in self.nonterminals if nt.symbol() == nonterm]
-            if not nts:
-                raise KeyError("nonterm isn't in grammar.")
-                #TODO: subclass Exception and print the missing nonterm
-            (nonterm,) = nts
-        return self._counts[nonterm][length]
+        try:
+            ident = self.compiled.nonterminal_id(nonterm)
+        except KeyError:
+            raise KeyError("nonterm isn't in grammar.")
+            #TODO: subclass Exception and print the missing nonterm
+        if self.length_index.feasible(ident, length) is False:
+            return 0
+        if length > self.length:
+            self._update_counts(length)
+        return self._exact_count(self._counts[ident][length], length)
 
     def count_by_prod(self, prod, length):
         """Return the number of strings of length `length` derivable from the
         RHS of `prod`."""
+        from nltk.grammar import Production
         assert isinstance(prod, Production)
         assert len(prod.rhs()) < 3
 
@@ -93,183 +333,953 @@ class CFLGenerator(object):
             else:
                 return 0
 
-        left, right = prod.rhs()[0], prod.rhs()[1]
-        return sum([self.count_by_nonterm(left, k) *  
-                    self.count_by_nonterm(right, length - k)
-                    for k in range(1, length)])
+        grammar = self.compiled
+        left = grammar.nonterminal_id(prod.rhs()[0])
+        right = grammar.nonterminal_id(prod.rhs()[1])
+        try:
+            rule = grammar.rule_id(grammar.nonterminal_id(prod.lhs()), left,
+                                   right)
+        except KeyError:
+            # `prod` isn't one of the grammar's rules, so its count isn't in
+            # the table.
+            return self._exact_count(self._count_by_rule(left, right, length),
+                                     length)
+        return self._exact_count(self._rule_counts[rule][length], length)
+
+    def _exact_count(self, value, length):
+        """Return the count for `length` that `value` from the count table
+        stands for: `value` itself, or the integer closest to the count that
+        an approximate table's scaled float stands for."""
+        if self._table.exact:
+            return value
+        return self._table.count(value, length)
+
+    def _below(self, total):
+        """Return a random number from 0 up to but not including `total`.
+
+        With exact counts it is an integer. With an approximate count table
+        `total` is a float and so is the number.
+        """
+        if self._table.exact:
+            return self.random.randrange(total)
+        value = self.random.random() * total
+        return value if value < total else 0.0
+
+    def _require_exact(self):
+        if not self._table.exact:
+            raise ValueError('This needs exact counts, not the %r backend.'
+                             % (self.backend,))
 
 
-    def generate(self, length):
+    def generate(self, length, method='sequential'):
         """Return a string of length `length` that is in L(self.grammar).
+
+        The string is a list of terminals. `method` is the way a split point
+        between the two children of a node is chosen:
+            'sequential'    -- look the split point up in a cached cumulative
+                               distribution over every split point (O(n^2)
+                               arithmetic per distinct node, then O(log n)).
+            'boustrophedon' -- try split points from both ends alternately,
+                               k = 1, n-1, 2, n-2, ..., and stop as soon as a
+                               random threshold is crossed (O(n log n)
+                               expected work per string, nothing cached).
+        Both choose every string with the same probability.
         
         Raise GenerationFailure if no strings of the requested length can be 
         generated.
         """
+        iterator = self.generate_iter(length, method)
+        started = time.time()
+        string_ = list(iterator)
+        self._timed('generate', started)
+        return string_
+
+    def generate_approx(self, length, tolerance=DEFAULT_TOLERANCE):
+        """Return a string with a length within `tolerance` times `length` of
+        `length`, with a Boltzmann sampler (see boltzmann.py).
+
+        Every derivation of each length is equally likely, but unlike
+        generate_in_range() the lengths aren't chosen in proportion to their
+        numbers of strings. Nothing is counted, so this works for lengths far
+        too long for the count table, after tuning the sampler for the range
+        of lengths once. Most tries miss the range, though, more of them the
+        longer the length and the smaller `tolerance` (see boltzmann.py).
+        rejected in stats() counts them.
+
+        Raise GenerationFailure if no length in the range has strings, or if
+        the sampler keeps missing the range.
+        """
+        lower = max(1, int(ceil(length * (1 - tolerance))))
+        upper = max(lower, int(floor(length * (1 + tolerance))))
+        return self._generate_boltzmann(lower, upper)
+
+    def _generate_boltzmann(self, lower, upper):
+        """Return a string with a length from `lower` to `upper` from the
+        Boltzmann sampler for that range."""
+        sampler = self._boltzmann_sampler(lower, upper)
+        started = time.time()
+        try:
+            string_, rejected = sampler.sample(self.random)
+        except SamplerFailure:
+            raise self._failure(upper)
+        self._counters['rejected'] += rejected
+        self._counters['strings'] += 1
+        self._counters['nodes'] += 2 * len(string_) - 1
+        terminals = self.compiled.terminals
+        string_ = [terminals[t] for t in string_]
+        self._timed('generate', started)
+        return string_
+
+    def _boltzmann_sampler(self, lower, upper):
+        """Return the BoltzmannSampler for lengths from `lower` to `upper`.
+
+        Raise GenerationFailure if the length index says that no length in
+        the range has strings.
+        """
+        sampler = self._samplers.get((lower, upper))
+        if sampler is None:
+            index, start = self.length_index, self.compiled.start
+            if not any(index.feasible(start, length) is not False
+                       for length in xrange(lower, upper + 1)):
+                raise self._failure(upper)
+            started = time.time()
+            sampler = BoltzmannSampler(self.compiled, lower, upper)
+            self._timed('compile', started)
+            self._samplers.put((lower, upper), sampler)
+        return sampler
+
+    def generate_in_range(self, lower, upper, method='sequential'):
+        """Return a string with a length from `lower` to `upper` (inclusive).
+
+        Every derivation of every length in the range is equally likely: the
+        length is chosen in proportion to its number of derivations, with the
+        prefix sums of those numbers, and then the string is generated as by
+        generate(). Lengths without strings are never chosen. Raise
+        GenerationFailure if no length in the range has strings.
+        """
+        lengths, cumulative = self._length_cdf(lower, upper)
+        length = lengths[bisect_right(cumulative,
+                                      self._below(cumulative[-1]))]
+        return self.generate(length, method)
+
+    def _length_cdf(self, lower, upper):
+        """Return the lengths from `lower` to `upper` that have strings and the
+        prefix sums of their numbers of derivations.
+
+        Raise GenerationFailure if there are no such lengths. The counts are
+        only extended up to the longest length that has strings.
+        """
+        key = ('lengths', lower, upper)
+        cdf = self._cdf_cache.get(key)
+        if cdf is None:
+            lengths = [length for length in range(max(lower, 1), upper + 1)
+                       if self.feasible(length)]
+            if not lengths:
+                raise self._failure(upper)
+            if lengths[-1] > self.length:
+                self._update_counts(lengths[-1])
+            start_counts = self._counts[self.compiled.start]
+            if self._table.exact:
+                weights = [start_counts[length] for length in lengths]
+            else:
+                # The counts of different lengths are scaled differently, and
+                # may not fit in a float unscaled, so compare their logs.
+                logs = [self._table.log_count(start_counts[length], length)
+                        for length in lengths]
+                weights = [exp(value - max(logs)) for value in logs]
+            cdf = (lengths, _cumulative(weights))
+            self._cdf_cache.put(key, cdf, _cdf_bytes(cdf[1]))
+        return cdf
+
+    def generate_iter(self, length, method='sequential'):
+        """Return an iterator over the terminals of a random string of length
+        `length`, from left to right.
+
+        This is generate() without building the string: the derivation is
+        expanded with an explicit stack, so its depth isn't limited by the
+        recursion limit and no intermediate lists are concatenated. Raise
+        GenerationFailure right away if no strings of the requested length can
+        be generated.
+        """
+        if method not in GENERATION_METHODS:
+            raise ValueError('method must be one of %s.'
+                             % ', '.join(GENERATION_METHODS))
+        choose_rule = getattr(self, '_choose_rule_' + method)
+        choose_split = getattr(self, '_choose_split_' + method)
+
         # Update self._counts for string lengths up to `length` if necessary.
+        if not self.feasible(length):
+            raise self._failure(length)
         if length > self.length:
             self._update_counts(length)
 
-        start = self.grammar.start()
-        return self._generate_rec(start, length)
+        start = self.compiled.start
+        self._counters['strings'] += 1
+        self._counters['nodes'] += 2 * length - 1
+        return self._iter_derivation(start, length, choose_rule, choose_split)
+
+    def _iter_derivation(self, nonterm, length, choose_rule, choose_split):
+        """Yield the terminals of a random tree of length `length` rooted at
+        the nonterminal with id `nonterm`.
+
+        `choose_rule` and `choose_split` are one of the _choose_rule_* and
+        _choose_split_* pairs of methods. The stack holds the (nonterminal,
+        length) nodes that still have to be expanded, leftmost on top.
+        """
+        grammar = self.compiled
+        terminal_rules, terminals = grammar.terminal_rules, grammar.terminals
+        stack = [(nonterm, length)]
+        while stack:
+            nonterm, length = stack.pop()
+
+            # A node of length one yields a single terminal, chosen uniformly
+            # from the terminal rules of its nonterminal.
+            if length == 1:
+                yield terminals[self.random.choice(terminal_rules[nonterm])]
+                continue
+
+            # Choose one of the binary rules with `nonterm` as the LHS
+            # randomly, with the probability of each rule being the number of
+            # strings derivable from the rule's RHS divided by the number of
+            # strings derivable from the LHS. Then split the length between
+            # the rule's two children so that their lengths add up to the
+            # parent's.
+            rule, first, second, rule_count = choose_rule(nonterm, length)
+            split = choose_split(rule, first, second, length, rule_count)
+            stack.append((second, length - split))
+            stack.append((first, split))
 
+    def generate_many(self, length, number):
+        """Return a list of `number` random strings of length `length`.
 
-    def _generate_rec(self, nonterm, length):
-        """Recursive workhorse for generate method.
+        This is the same as calling generate(length) `number` times, but the
+        decisions are made for whole groups of strings at once. The nodes of
+        all the derivations that have the same nonterminal and length are
+        expanded together, longest first: their rules and split points are
+        drawn with one multinomial draw (see _multinomial), and each group of
+        nodes that made the same choice becomes a pair of child subproblems.
 
-        Return a list of length `length`, where the `length` items are terminals
-        of a tree rooted at `nonterm`.
+        Raise GenerationFailure if no strings of the requested length can be
+        generated.
         """
-        # The recursion bottoms out when the method attempts to find subtree 
-        # that yields a single terminals. At this point, a terminal is chosen
-        # randomly and returned as the single element in a list.
-        if length == 1:
-            productions = self._prods_by_lhs(nonterm)
-            terminals = [p.rhs()[0] for p in productions if len(p.rhs()) == 1]
-            if productions and not terminals:
-                raise GenerationFailure(length)
-            choice = random.choice(terminals)
-            return [choice]
-
-        # Find all productions that have `nonterm` as the LHS. Choose one of
-        # them randomly by setting the probability of each production being 
-        # chosen as the number of strings derivable from the production's RHS
-        # divided by the number of strings derivable from the LHS.
-        productions = [prod for prod in self._prods_by_lhs(nonterm)
-                       if self.count_by_prod(prod, length) > 0]
-        if not productions:
-            raise GenerationFailure(length)
-
-        # TODO: See if listcomp version is fast enough to compensate  for its 
-        #       ugliness
-        probabilities = []
-        for prod in productions:
-            numerator = self.count_by_prod(prod, length)
-            denominator = self.count_by_nonterm(prod.lhs(), length)
-            if denominator != 0: 
-                probabilities.append(numerator / denominator)
-        production = _choose(zip(productions, probabilities))
-        
-        # For each call to _generate_rec, the input length needs to be split up
-        # into two smaller lengths so that when the method is called recursively
-        # twice, the length of the two results will equal the length of their
-        # parent. 
-        first, second = production.rhs()[0], production.rhs()[1]
-        split_probs = [(k, self.count_by_nonterm(first, k) * 
-                       self.count_by_nonterm(second, length - k) / 
-                       self.count_by_prod(production, length))
-                       for k in range(1, length)
-                      ]
-        assert split_probs
-        split = _choose(split_probs)
+        if not self.feasible(length):
+            raise self._failure(length)
+        if length > self.length:
+            self._update_counts(length)
+
+        start = self.compiled.start
+        started = time.time()
+        self._counters['strings'] += number
+        self._counters['nodes'] += number * (2 * length - 1)
+
+        grammar = self.compiled
+        terminal_rules, terminals = grammar.terminal_rules, grammar.terminals
+        strings = [[None] * length for i in range(number)]
+
+        # pending[L] maps a nonterminal to the slots that are to be filled
+        # with a subtree of length L rooted at the nonterminal. A slot is a
+        # (string index, offset of the subtree in the string) pair. Children
+        # are shorter than their parents, so every slot of a subproblem is
+        # known by the time its length comes up.
+        pending = [None] + [{} for L in range(length)]
+        pending[length][start] = [(i, 0) for i in range(number)]
+        for L in range(length, 0, -1):
+            for nonterm, slots in pending[L].iteritems():
+                if L == 1:
+                    choices = terminal_rules[nonterm]
+                    choose = self.random.choice
+                    for (i, offset) in slots:
+                        strings[i][offset] = terminals[choose(choices)]
+                    continue
+
+                # The multinomial gives the size of the group of slots that
+                # takes each choice. Shuffling the slots first makes the
+                # assignment of choices to slots uniformly random.
+                self.random.shuffle(slots)
+                rules, cumulative = self._rule_cdf(nonterm, L)
+                position = 0
+                for index, rule_size in _multinomial(cumulative, len(slots),
+                                                     self._below):
+                    rule, first, second, rule_count = rules[index]
+                    splits, split_cumulative = self._split_cdf(rule, first,
+                                                               second, L)
+                    for index, size in _multinomial(split_cumulative,
+                                                    rule_size, self._below):
+                        k = splits[index]
+                        group = slots[position:position + size]
+                        position += size
+                        pending[k].setdefault(first, []).extend(group)
+                        pending[L - k].setdefault(second, []).extend(
+                            [(i, offset + k) for (i, offset) in group])
+            pending[L] = None
+        self._timed('generate', started)
+        return strings
+
+    def sample_distinct(self, length, number):
+        """Return a list of `number` strings of length `length` from distinct
+        derivations, in random order.
+
+        Every set of `number` derivations is equally likely, so for an
+        unambiguous grammar this samples strings without replacement. The
+        indexes of the derivations are chosen with Floyd's algorithm, which
+        takes `number` random draws however many derivations there are, and
+        turned into strings with unrank(). Raise ValueError if there are fewer
+        than `number` derivations of length `length`, and ValueError if the
+        counts aren't exact.
+        """
+        self._require_exact()
+        if length > self.length:
+            self._update_counts(length)
+        total = self._counts[self.compiled.start][length] if length >= 1 else 0
+        if not 0 <= number <= total:
+            raise ValueError('There are only %d derivations of length %d.'
+                             % (total, length))
+
+        chosen = set()
+        indexes = []
+        for j in range(total - number, total):
+            index = self.random.randrange(j + 1)
+            if index in chosen:
+                index = j
+            chosen.add(index)
+            indexes.append(index)
+        self.random.shuffle(indexes)
+        return [self.unrank(length, index) for index in indexes]
+
+    def unrank(self, length, index):
+        """Return the string of derivation number `index` of the strings of
+        length `length`, as a list of terminals.
 
-        left = self._generate_rec(production.rhs()[0], split)
-        right = self._generate_rec(production.rhs()[1], length - split)
-        return left + right
+        The derivations of a length are numbered 0 .. count - 1, where count is
+        the number of derivations of the start symbol (see unrank_tree() for
+        the order), so unrank(length, i) for every i enumerates them all, and
+        disjoint ranges of indexes give disjoint sets of derivations. Raise
+        IndexError if `index` is out of range.
+        """
+        return [tree[1] for tree in self._unrank_nodes(length, index)
+                if len(tree) == 2]
+
+    def unrank_tree(self, length, index):
+        """Return derivation number `index` of the strings of length `length`
+        as a tree of nested tuples.
+
+        A node is (A, 't') for a rule A -> 't' and (A, left, right) for a
+        rule A -> B C, where A is a nonterminal of self.compiled and left and
+        right are the nodes of B and C. A rule that stands for w > 1 merged
+        rules (see CompiledGrammar.merge_equivalent) has w copies, and its
+        nodes are (A, left, right, copy) with copy in range(w).
+
+        The derivations of a nonterminal A and length L are ordered by the
+        id of the rule at the root, then by the copy, by the length of the
+        left subtree, by the number of the left subtree and last by the number
+        of the right subtree. rank() is the inverse of unrank_tree().
+        """
+        # The nodes come in preorder, so in reverse every node comes after its
+        # subtrees, which are on the stack with the left one on top.
+        stack = []
+        for node in reversed(self._unrank_nodes(length, index)):
+            if len(node) > 2:
+                left = stack.pop()
+                right = stack.pop()
+                node = (node[0], left, right) + node[3:]
+            stack.append(node)
+        return stack.pop()
+
+    def rank(self, tree):
+        """Return the index of the derivation `tree` among the derivations of
+        its length, the inverse of unrank_tree().
 
+        The nonterminals of `tree` can also be given by their symbols. Raise
+        ValueError if `tree` isn't a derivation of the start symbol, and if the
+        counts aren't exact.
+        """
+        self._require_exact()
+        grammar = self.compiled
+        try:
+            if grammar.nonterminal_id(tree[0]) != grammar.start:
+                raise ValueError('The root of the tree must be the start '
+                                 'symbol.')
+        except (KeyError, TypeError, IndexError):
+            raise ValueError('%r is not a derivation.' % (tree,))
+
+        # Number the nodes bottom up, after the subtrees (see unrank_tree()).
+        preorder = []
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            preorder.append(node)
+            if len(node) > 2:
+                stack.append(node[2])
+                stack.append(node[1])
+
+        ranks = []
+        for node in reversed(preorder):
+            try:
+                ranks.append(self._rank_node(node, ranks))
+            except (KeyError, TypeError, IndexError, ValueError):
+                raise ValueError('%r is not a derivation.' % (tree,))
+        return ranks.pop()[0]
 
+    def _rank_node(self, node, ranks):
+        """Return (index, length) of the node `node` of a tree, popping those
+        of its subtrees from the list `ranks`."""
+        grammar = self.compiled
+        nonterm = grammar.nonterminal_id(node[0])
+        if len(node) == 2:
+            return grammar.terminal_rules[nonterm].index(
+                grammar.terminal_id(node[1])), 1
 
-    def _prods_by_lhs(self, lhs):
-        assert isinstance(lhs, Nonterminal)
-        return set([p for p in self.productions if p.lhs() == lhs])
+        left_rank, split = ranks.pop()
+        right_rank, right_length = ranks.pop()
+        length = split + right_length
+        if length > self.length:
+            self._update_counts(length)
+        first = grammar.nonterminal_id(node[1][0])
+        second = grammar.nonterminal_id(node[2][0])
+        rule = grammar.rule_id(nonterm, first, second)
+        copy = node[3] if len(node) > 3 else 0
+        if not 0 <= copy < grammar.rule_weights[rule]:
+            raise ValueError('No such copy of the rule.')
+
+        rules, cumulative = self._rule_cdf(nonterm, length)
+        position = bisect_left([item[0] for item in rules], rule)
+        splits, split_cumulative = self._split_cdf(rule, first, second,
+                                                   length)
+        split_position = bisect_left(splits, split)
+        index = ((cumulative[position - 1] if position else 0) +
+                 copy * rules[position][3] +
+                 (split_cumulative[split_position - 1]
+                  if split_position else 0) +
+                 left_rank * self._counts[second][length - split] +
+                 right_rank)
+        return index, length
+
+    def _unrank_nodes(self, length, index):
+        """Return the nodes of derivation number `index` of length `length`
+        in preorder, with each binary node's subtrees left out: (A, 't') or
+        (A, None, None) or (A, None, None, copy)."""
+        self._require_exact()
+        if length < 1:
+            raise IndexError('There are no derivations of length %d.'
+                             % length)
+        if length > self.length:
+            self._update_counts(length)
+        grammar = self.compiled
+        start = grammar.start
+        if not 0 <= index < self._counts[start][length]:
+            raise IndexError('Derivation index out of range.')
+
+        terminal_rules, terminals = grammar.terminal_rules, grammar.terminals
+        nodes = []
+        stack = [(start, length, index)]
+        while stack:
+            nonterm, length, index = stack.pop()
+            symbol = grammar.nonterminals[nonterm]
+            if length == 1:
+                nodes.append((symbol,
+                              terminals[terminal_rules[nonterm][index]]))
+                continue
+
+            # Find the rule, its copy, the split point and the numbers of the
+            # two subtrees by taking the index apart in the order of
+            # unrank_tree().
+            rules, cumulative = self._rule_cdf(nonterm, length)
+            position = bisect_right(cumulative, index)
+            if position:
+                index -= cumulative[position - 1]
+            rule, first, second, rule_count = rules[position]
+            copy, index = divmod(index, rule_count)
+            splits, split_cumulative = self._split_cdf(rule, first, second,
+                                                       length)
+            position = bisect_right(split_cumulative, index)
+            if position:
+                index -= split_cumulative[position - 1]
+            split = splits[position]
+            left, right = divmod(index, self._counts[second][length - split])
+
+            if grammar.rule_weights[rule] > 1:
+                nodes.append((symbol, None, None, copy))
+            else:
+                nodes.append((symbol, None, None))
+            stack.append((second, length - split, right))
+            stack.append((first, split, left))
+        return nodes
+
+    def _choose_rule_sequential(self, nonterm, length):
+        """Return (rule id, B, C, count) for a random rule "`nonterm` -> B C"
+        of a node of length `length`, using the cached distribution."""
+        rules, cumulative = self._rule_cdf(nonterm, length)
+        if not rules:
+            raise self._failure(length)
+        return rules[bisect_right(cumulative, self._below(cumulative[-1]))]
+
+    def _choose_split_sequential(self, rule, first, second, length,
+                                 rule_count):
+        """Return a split point k for a node "A -> `first` `second`" of
+        length `length`, weighting every k by its number of derivations."""
+        splits, cumulative = self._split_cdf(rule, first, second, length)
+        return splits[bisect_right(cumulative, self._below(cumulative[-1]))]
+
+    def _rule_cdf(self, nonterm, length):
+        """Return the rules of `nonterm` with a nonzero count at `length` and
+        the prefix sums of their counts, from the cache if possible.
+
+        The rules are (rule id, B, C, count) tuples. The count is that of the
+        rule's RHS, and the prefix sums are of the counts times the weights of
+        the rules.
+        """
+        key = ('rules', nonterm, length)
+        cdf = self._cdf_cache.get(key)
+        if cdf is None:
+            grammar = self.compiled
+            weights = grammar.rule_weights
+            rules = []
+            for rule, (B, C) in enumerate(grammar.binary_rules[nonterm],
+                                          grammar.rule_offsets[nonterm]):
+                count = self._rule_counts[rule][length]
+                if count:
+                    rules.append((rule, B, C, count))
+            cdf = (rules, _cumulative([weights[rule[0]] * rule[3]
+                                       for rule in rules]))
+            self._cdf_cache.put(key, cdf, _cdf_bytes(cdf[1]))
+        return cdf
+
+    def _split_cdf(self, rule, first, second, length):
+        """Return the split points k with derivations for the rule with id
+        `rule` at `length` and the prefix sums of their numbers of
+        derivations, from the cache if possible."""
+        key = ('splits', rule, length)
+        cdf = self._cdf_cache.get(key)
+        if cdf is None:
+            first_counts = self._counts[first]
+            second_counts = self._counts[second]
+            splits, weights = [], []
+            for k in range(1, length):
+                weight = first_counts[k] * second_counts[length - k]
+                if weight:
+                    splits.append(k)
+                    weights.append(weight)
+            cdf = (splits, _cumulative(weights))
+            self._cdf_cache.put(key, cdf, _cdf_bytes(cdf[1]))
+        return cdf
+
+    def _choose_rule_boustrophedon(self, nonterm, length):
+        """Return (rule id, B, C, count) for a random rule "`nonterm` -> B C"
+        of a node of length `length`, without caching anything."""
+        total = self._counts[nonterm][length]
+        if not total:
+            raise self._failure(length)
+
+        # Walk the rule counts down from a random integer below their total.
+        grammar = self.compiled
+        weights = grammar.rule_weights
+        threshold = self._below(total)
+        last = None
+        for rule, (B, C) in enumerate(grammar.binary_rules[nonterm],
+                                      grammar.rule_offsets[nonterm]):
+            count = self._rule_counts[rule][length]
+            threshold -= weights[rule] * count
+            if threshold < 0:
+                return rule, B, C, count
+            if count:
+                last = rule, B, C, count
+        # Approximate counts can be off by a rounding error.
+        if self._table.exact or last is None:
+            raise AssertionError('rule counts do not add up to the LHS count')
+        return last
+
+    def _choose_split_boustrophedon(self, rule, first, second, length,
+                                    rule_count):
+        """Return a split point with the same distribution as
+        _choose_split_sequential, trying k = 1, n-1, 2, n-2, ....
+
+        Subtracting the weights of the split points from a random integer
+        below `rule_count` stops at the chosen k after visiting about twice the
+        size of the smaller subtree, which is what makes the whole derivation
+        O(n log n) (Flajolet, Zimmermann and Van Cutsem 1994).
+        """
+        first_counts, second_counts = self._counts[first], self._counts[second]
+        threshold = self._below(rule_count)
+        low, high = 1, length - 1
+        while low <= high:
+            threshold -= first_counts[low] * second_counts[length - low]
+            if threshold < 0:
+                return low
+            if low != high:
+                threshold -= first_counts[high] * second_counts[length - high]
+                if threshold < 0:
+                    return high
+            low += 1
+            high -= 1
+        # Approximate counts can be off by a rounding error.
+        if not self._table.exact:
+            splits, cumulative = self._split_cdf(rule, first, second, length)
+            if splits:
+                return splits[-1]
+        raise AssertionError('split weights do not add up to the rule count')
+
+
+    def _count_by_rule(self, left, right, length):
+        """Return the number of strings of length `length` derivable from the
+        RHS of the rule "A -> `left` `right`" (nonterminal ids)."""
+        self._counters['recounts'] += 1
+        left_counts, right_counts = self._counts[left], self._counts[right]
+        return sum([left_counts[k] * right_counts[length - k]
+                    for k in range(1, length)])
 
 
     def _update_counts(self, new_length):
         """Extend self._counts to cover strings of length `new_length`."""
         assert self.length <= max([new_length, 1])
 
-        # Extend the count lists with 0s
-        diff = new_length - self.length
-        for value in self._counts.itervalues():
-            value += [0 for i in range(diff)]
-
-        for L in range(self.length + 1, new_length + 1):
-            for nonterm in self.nonterminals:
-                prods = (p for p in self._prods_by_lhs(nonterm) 
-                         if len(p.rhs()) == 2)
-
-                # Handle productions of form A -> B C. Increment the count of
-                # strings of length L derivable from A by the number of ways 
-                # that B and C can combine to form a string of length L.
-                for prod in prods:
-                    B = prod.rhs()[0]
-                    C = prod.rhs()[1]
-                    for k in range(1, L):
-                        left = self._counts[B][k]
-                        right = self._counts[C][L - k]
-                        self._counts[nonterm][L] = self._counts[nonterm][L] +  \
-                                                   left * right
+        started = time.time()
+        old_length = self._table.length
+        self._table = extend_count_table(self._table, new_length,
+                                         self.backend)
 
+        # The table may have reallocated its storage or been replaced, so
+        # refetch the rows.
         # Check that the number of counts for a nonterminal is equal to
         # `new_length` (with 1 added for the None value). Then reset self.length
         # to reflect that.
-        assert len(self._counts.itervalues().next()) == new_length + 1
+        self._counts = self._table.rows
+        self._rule_counts = self._table.rule_rows
+        assert len(self._counts[0]) == new_length + 1
         self.length = new_length
+        if not self._table.exact:
+            # An approximate table may have rescaled all of its counts.
+            self._cdf_cache.clear()
+        self._count_work(old_length, new_length)
+        self._timed('count', started)
+        self._save_cache()
+
+    def _count_work(self, old_length, new_length):
+        """Add the work of extending the table from `old_length` to
+        `new_length` to the counters.
 
-    def _preprocess(self, length):
+        Every nonterminal and binary rule gets a count for each length, and the
+        count of a rule for length L takes L - 1 products.
+        """
+        lengths = range(old_length + 1, new_length + 1)
+        rules = sum(len(rules) for rules in self.compiled.binary_rules)
+        self._counters['cells'] += (len(self._counts) + rules) * len(lengths)
+        self._counters['multiplies'] += rules * sum(L - 1 for L in lengths)
+
+    def save_cache(self):
+        """Write the grammar and the counts to the disk cache if it is enabled
+        and doesn't have counts for lengths up to self.length yet.
+
+        The counts are only written by themselves when they have grown by
+        CACHE_GROWTH, which keeps the writes of a table that grows a length at
+        a time linear in its size. Call this to write the rest, e.g. before a
+        long-lived process exits.
+        """
+        self._save_cache(force=True)
+
+    def _save_cache(self, force=False):
+        if self.cache_dir is None or self.length <= self._cached_length or \
+                not self._table.exact:
+            return
+        if not force and self.length < CACHE_GROWTH * self._cached_length:
+            return
+        started = time.time()
+        if diskcache.save(self.cache_dir, self._source,
+                          self.compiled.to_state(), self._table.snapshot()):
+            self._cached_length = self.length
+        self._timed('cache', started)
+
+    def _preprocess(self, length, snapshot=None):
         """Populate self._counts.
 
-        _counts is a dict from nltk.grammar.Nonterminal to lists. Each index
-        in the list holds the number of strings of length index that can be
-        generated starting from the Nonterminal.
+        _counts holds the rows of a count table (see counttable.py), indexed
+        by the nonterminal ids of self.compiled. Each index in a nonterminal's
+        row holds the number of strings of length index that can be generated
+        starting from the nonterminal. Index 0 is never used. _rule_counts
+        holds the same numbers for the RHS of each binary rule, by rule id.
+
+        `snapshot` is a count table snapshot to start from (see counttable.py).
         """
-        # Set the 0th value of self._counts to None since these values should
-        # never be used. The lists need to be initialized so they can be used
-        # below.
-        for nonterm in self.nonterminals:
-            self._counts[nonterm] = [None, 0]
-        self.length = 1
-
-        # For each production A -> 'a', increment the number of strings of
-        # length one that can be generated from A.
-        for prod in [p for p in self.productions if len(p.rhs()) == 1]:
-            self._counts[prod.lhs()][1] += 1
+        self._table = make_count_table(self.compiled, self.backend, snapshot)
+        self._counts = self._table.rows
+        self._rule_counts = self._table.rule_rows
+        self.length = self._table.length
 
         # Recursively find and set counts for lengths up to `length`
-        self._update_counts(length)
+        if length > self.length:
+            self._update_counts(length)
 
 
 class GenerationFailure(Exception):
     """Raised when a grammar can't generate a string of the requested length."""
     def __init__(self, length):
+        # Passing `length` on lets the exception be pickled, e.g. to get it
+        # out of a worker process.
+        Exception.__init__(self, length)
         self.length = length
 
     def __str__(self):
         return "GenerationFailure: length %d" % self.length
 
 
-def _choose(pairs):
-    """Choose at random from items and their probabilities of being chosen.
+def _grammar_source(grammar):
+    """Return the text of `grammar`, given as to CFLGenerator."""
+    if isinstance(grammar, basestring) and grammar.endswith('.cfg'):
+        with open(grammar) as grammar_file:
+            return grammar_file.read()
+    elif isinstance(grammar, basestring):
+        return grammar
+    elif hasattr(grammar, 'productions'):
+        return str(grammar)
+    raise ValueError('Arg grammar must be nltk.grammar.Grammar or str.')
+
+
+def _nltk_grammar(start, productions):
+    """Return an nltk ContextFreeGrammar from a start nonterminal and (lhs,
+    rhs) pairs whose nonterminals may be cfgparse.Nonterminals."""
+    from nltk.grammar import ContextFreeGrammar, Nonterminal, Production
+
+    def convert(token):
+        if isinstance(token, basestring):
+            return token
+        return Nonterminal(token.symbol())
 
-    pairs = [(item, probability), ...]
+    return ContextFreeGrammar(convert(start), [
+        Production(convert(lhs), [convert(token) for token in rhs])
+        for (lhs, rhs) in productions])
+
+
+def _cumulative(weights):
+    """Return the running totals of `weights`."""
+    total = 0
+    cumulative = []
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return cumulative
+
+
+def _cdf_bytes(cumulative):
+    """Return about how many bytes a cached entry with the prefix sums
+    `cumulative` takes.
+
+    The prefix sums increase, so the last has the most digits. Python ints
+    are stored in 30-bit digits of 4 bytes each, and anything else (a float)
+    is counted as one digit.
+    """
+    if not cumulative:
+        return ENTRY_BYTES
+    largest = cumulative[-1]
+    if isinstance(largest, (int, long)):
+        digits = largest.bit_length() // 30 + 1
+    else:
+        digits = 1
+    return ENTRY_BYTES + len(cumulative) * (ITEM_BYTES + 4 * digits)
+
+
+def _multinomial(cumulative, number, below):
+    """Draw `number` times from the distribution with prefix sums
+    `cumulative` and yield (index, times drawn) for every index drawn.
+    `below(total)` returns a random number below `total`, like
+    CFLGenerator._below.
+
+    The draws are sorted random numbers below the total, so one sweep
+    through `cumulative` counts them all.
     """
-    assert pairs
-    the_sum = sum([pair[1] for pair in pairs])
-    if the_sum == 0:
-        return None
-
-    # Allow a range since floats aren't exact.
-    if not .99 < the_sum < 1.01:
-        raise ValueError('Probabilities must add to 1.')
-    r = random.uniform(0, the_sum)
-    current = 0
-    for (item, prob) in pairs:
-        current += prob
-        if r <= current:
-            return item
-     
+    total = cumulative[-1]
+    draws = sorted([below(total) for i in range(number)])
+    index = 0
+    size = 0
+    for draw in draws:
+        while draw >= cumulative[index]:
+            if size:
+                yield index, size
+                size = 0
+            index += 1
+        size += 1
+    if size:
+        yield index, size
+
 
 class RegexToCFG(object):
     """Conversion of basic REs to their corresponding CFGs.
     """
     
 
+# Number of strings that main() generates from each derived seed.
+CHUNK_SIZE = 10000
+
+# Chunks that main() has handed to each worker process and not yet written,
+# which bounds the memory held by chunks waiting for a slow output.
+CHUNKS_PER_JOB = 2
+
+# The CFLGenerator of a worker process of main().
+_worker_generator = None
+
+# Output formats of main(): one string per line, a JSON array of the strings,
+# one JSON string per line (JSON Lines) and strings each ended by a NUL byte.
+OUTPUT_FORMATS = ('string', 'json', 'jsonl', 'nul')
+
+# Size of the buffer that main() writes its output through.
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+
+def _chunk_seed(seed, index):
+    """Return the seed of chunk number `index` of the strings from `seed`."""
+    return int(hashlib.sha1('%d:%d' % (seed, index)).hexdigest(), 16)
+
+
+def _generate_chunk(generator, count, seed, lengths, separator,
+                    boltzmann=False):
+    """Return `count` strings from `generator` with their terminals joined by
+    `separator`, drawing with a random.Random seeded with `seed`.
+
+    `lengths` is the (lower, upper) range of lengths of the strings, which
+    are chosen as by CFLGenerator.generate_in_range: the number of strings of
+    each length is drawn from a multinomial distribution, the strings of each
+    length are generated together and the strings are shuffled. If
+    `boltzmann` is true, each string comes from the Boltzmann sampler for the
+    range instead.
+    """
+    generator.random = random.Random(seed)
+    if boltzmann:
+        return [separator.join(generator._generate_boltzmann(*lengths))
+                for i in range(count)]
+    lengths, cumulative = generator._length_cdf(*lengths)
+    if len(lengths) == 1:
+        return [separator.join(string_)
+                for string_ in generator.generate_many(lengths[0], count)]
+    strings = []
+    for index, number in _multinomial(cumulative, count, generator._below):
+        strings.extend(generator.generate_many(lengths[index], number))
+    generator.random.shuffle(strings)
+    return [separator.join(string_) for string_ in strings]
+
+
+def _init_worker(generator):
+    global _worker_generator
+    _worker_generator = generator
+
+
+def _generate_chunk_in_worker(chunk):
+    """Return the strings of `chunk` and the counters and times of the work
+    done for them, to be added to the stats of the generator in main()."""
+    generator = _worker_generator
+    counters, seconds = dict(generator._counters), dict(generator._seconds)
+    batch = _generate_chunk(generator, *chunk)
+    return batch, (dict((key, value - counters[key])
+                        for key, value in generator._counters.iteritems()),
+                   dict((phase, value - seconds[phase])
+                        for phase, value in generator._seconds.iteritems()))
+
+
+def format_stats(stats):
+    """Return a summary of the output of CFLGenerator.stats() to print."""
+    seconds = stats['seconds']
+    return '\n'.join([
+        'grammar:    %d nonterminals, %d binary rules' % (
+            stats['nonterminals'], stats['rules']),
+        'counts:     lengths up to %d with %s, %d cells, %d multiplies, '
+        'largest count %d bits' % (stats['length'], stats['backend'],
+                                   stats['cells'], stats['multiplies'],
+                                   stats['max_bits']),
+        'generation: %d strings, %d nodes, %d failures, %d recounts, '
+        '%d rejected' % (stats['strings'], stats['nodes'], stats['failures'],
+                         stats['recounts'], stats['rejected']),
+        'seconds:    ' + ', '.join('%s %.3f' % (phase, seconds[phase])
+                                   for phase in PHASES),
+    ])
+
+
+def open_output(filename, compress=False):
+    """Return a binary file with a large buffer that writes to `filename`,
+    or to stdout if it is '-', compressing with gzip if `compress`.
+
+    Closing the file doesn't close stdout.
+    """
+    if filename == '-':
+        out = io.open(sys.stdout.fileno(), 'wb', OUTPUT_BUFFER_SIZE,
+                      closefd=False)
+    else:
+        out = io.open(filename, 'wb', OUTPUT_BUFFER_SIZE)
+    if compress:
+        return _GzipOutput(out)
+    return out
+
+
+class _GzipOutput(gzip.GzipFile):
+    """A GzipFile that closes the file it writes to when it is closed."""
+
+    def __init__(self, out):
+        gzip.GzipFile.__init__(self, fileobj=out, mode='wb')
+        self._out = out
+
+    def close(self):
+        try:
+            gzip.GzipFile.close(self)
+        finally:
+            self._out.close()
+
+
+def write_strings(batches, out, the_format='string'):
+    """Write the strings of each list in `batches` to the binary file `out`
+    in the output format `the_format` (see OUTPUT_FORMATS).
+
+    Each batch is written as soon as it comes, so `batches` can be an
+    iterator that generates them and only one batch is held at a time.
+    """
+    if the_format == 'json':
+        out.write('[')
+    first = True
+    for batch in batches:
+        if not batch:
+            continue
+        if the_format in ('json', 'jsonl'):
+            batch = [json.dumps(string_) for string_ in batch]
+        else:
+            batch = [string_.encode('utf-8') if isinstance(string_, unicode)
+                     else string_ for string_ in batch]
+        if the_format == 'json':
+            out.write(('' if first else ', ') + ', '.join(batch))
+        elif the_format == 'nul':
+            out.write('\0'.join(batch) + '\0')
+        else:
+            out.write('\n'.join(batch) + '\n')
+        first = False
+    if the_format == 'json':
+        out.write(']\n')
+
+
 def main(argv):
     """
     python cfl.py gram.cfg --number 100 --length 4
     python cfl.py gram.cfg --number 47 --lowerlength 4 --upperlength 10
+    python cfl.py gram.cfg --number 1000000 --length 20 --jobs 8 --seed 1
+    python cfl.py gram.cfg --number 50000000 --format jsonl -o out.jsonl.gz
+    python cfl.py gram.cfg --number 100000 --length 200 --stats
+    python cfl.py gram.cfg --number 10 --length 1000000 --boltzmann
+    python cfl.py gram.cfg --number 10 --length 20 --server /tmp/cfl.sock
+
+    The strings are written as they are generated, so the memory used doesn't
+    grow with --number. --stats prints the counters and the times of
+    CFLGenerator.stats() to stderr at the end, with the work of all the
+    processes added up. --profile FILE writes cProfile data of the main
+    process to FILE, for python -m pstats.
+
+    With --boltzmann, the strings come from a Boltzmann sampler, which
+    doesn't count strings but rejects more of them the longer they are (see
+    boltzmann.py): with --length
+    N their lengths are within --tolerance times N of N, and otherwise in the
+    range of --lowerlength and --upperlength. Every derivation of a length is
+    equally likely, but the lengths aren't weighted by their numbers of
+    strings.
+
+    With --server, the strings come from a server started with cflserver.py,
+    which keeps the grammar preprocessed between runs. The output for a seed
+    is the same as without it. --jobs, --profile and the cache options then
+    don't apply, and --stats prints the stats of the server's generator.
     """
     # args are grammar files
-    # option for length, defaults to random number between 1 and 10
+    # option for length, defaults to the range 1 to 10
     # option for number of strings to generate, default=1
     # option for output: to string, json, ...?
     parser = OptionParser()
@@ -279,41 +1289,195 @@ def main(argv):
     parser.add_option('-l', '--length', dest='length', action='store', 
                        default=None, metavar='<STRING LENGTH>', type='int',
                        help='')
+    parser.add_option('--lowerlength', action='store', default=1, type='int',
+                      metavar='<STRING LENGTH>',
+                      help='Shortest string length if --length is not given.')
+    parser.add_option('--upperlength', action='store', default=10, type='int',
+                      metavar='<STRING LENGTH>',
+                      help='Longest string length if --length is not given. '
+                           'Every string in the range is equally likely.')
     parser.add_option('-f', '--format', action='store', default='string', 
                       metavar='<FORMAT>', dest='the_format', 
-                      help="Output format. Must be 'json' or 'string'.")
+                      help="Output format: 'string' (one per line), "
+                           "'json', 'jsonl' (JSON Lines) or 'nul' "
+                           "(NUL-terminated).")
     parser.add_option('-o', '--outfile', action='store', default='-',
                       metavar='<FILENAME>', 
                       help="Filename of output. Defaults to stdout ('-').")
+    parser.add_option('-z', '--gzip', action='store_true', default=False,
+                      help='Compress the output with gzip. Implied by an '
+                           'outfile name that ends with .gz.')
     parser.add_option('-s', '--separator', action='store', default='',
                       metavar='<SEPARATOR>', 
                       help='Separator between terminals.')
+    parser.add_option('-j', '--jobs', action='store', default=1, type='int',
+                      metavar='<JOBS>',
+                      help='Number of processes that generate strings.')
+    parser.add_option('--seed', action='store', default=None, type='int',
+                      metavar='<SEED>',
+                      help='Seed that makes the output reproducible.')
+    parser.add_option('--approximate', action='store_const', dest='backend',
+                      const='approximate', default=None,
+                      help='Count with floats instead of exact integers, for '
+                           'lengths whose counts are too big to be fast.')
+    parser.add_option('--boltzmann', action='store_true', default=False,
+                      help='Generate strings of about the length without '
+                           'counting, with a Boltzmann sampler.')
+    parser.add_option('--tolerance', action='store', type='float',
+                      default=DEFAULT_TOLERANCE, metavar='<FRACTION>',
+                      help='Relative tolerance of the length of --boltzmann '
+                           'with --length. Defaults to %s.'
+                           % DEFAULT_TOLERANCE)
+    parser.add_option('--stats', action='store_true', default=False,
+                      help='Print counters and times to stderr at the end.')
+    parser.add_option('--profile', action='store', default=None,
+                      metavar='<FILENAME>',
+                      help='Write cProfile data to FILENAME.')
+    parser.add_option('--server', action='store', default=None,
+                      metavar='<ADDRESS>',
+                      help='Generate with the server at ADDRESS, a Unix '
+                           'socket or HOST:PORT (see cflserver.py).')
+    parser.add_option('--cache-dir', action='store', dest='cache_dir',
+                      default=diskcache.DEFAULT_CACHE_DIR, metavar='<DIR>',
+                      help='Directory of cached preprocessed grammars. '
+                           'Defaults to $CFL_CACHE_DIR or ~/.cache/cfl.')
+    parser.add_option('--no-cache', action='store_const', dest='cache_dir',
+                      const=None, help="Don't use the grammar cache.")
 
     options, args = parser.parse_args(argv)
-    if options.the_format not in ('string', 'json'):
-        parser.error("Argument of option --fmrat must be 'string' or 'json'.")
-
-    if options.outfile == '-':
-        out = sys.stdout
-    else:
-        out = open(options.outfile, 'w')
+    if options.the_format not in OUTPUT_FORMATS:
+        parser.error("Argument of option --format must be one of %s."
+                     % ', '.join("'%s'" % name for name in OUTPUT_FORMATS))
 
     if len(args) != 1: 
         parser.error("Only one grammar can be used.")
-    results = []
-    if options.length:
-        length = lambda: options.length
-        generator = CFLGenerator(args[0], options.length)
+    if options.jobs < 1:
+        parser.error("Argument of option --jobs must be positive.")
+    if options.tolerance < 0:
+        parser.error("Argument of option --tolerance can't be negative.")
+    if options.length is not None and options.boltzmann:
+        lower = max(1, int(ceil(options.length * (1 - options.tolerance))))
+        lengths = (lower, max(lower, int(floor(options.length *
+                                               (1 + options.tolerance)))))
+    elif options.length is not None:
+        lengths = (options.length, options.length)
+    else:
+        lengths = (options.lowerlength, options.upperlength)
+    if not 1 <= lengths[0] <= lengths[1]:
+        parser.error("String lengths must satisfy 1 <= lower <= upper.")
+
+    # The strings are generated in chunks of CHUNK_SIZE, each from its own
+    # seed derived from the base seed, so the output only depends on the seed
+    # and not on the number of processes.
+    seed = options.seed
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    profiler = None
+    if options.profile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    chunks = ((min(CHUNK_SIZE, options.number - start), _chunk_seed(seed, i),
+               lengths, options.separator, options.boltzmann)
+              for i, start in enumerate(xrange(0, options.number, CHUNK_SIZE)))
+    pool = None
+    if options.server is not None:
+        import cflserver
+        source = _grammar_source(args[0])
+        try:
+            client = cflserver.Client(options.server)
+            # No strings, but the range is checked.
+            client.generate(source, 0, *lengths, backend=options.backend,
+                            boltzmann=options.boltzmann)
+        except cflserver.ServerError as error:
+            parser.error(str(error))
+        batches = (client.generate(source, count, *lengths, seed=chunk_seed,
+                                   separator=separator,
+                                   backend=options.backend,
+                                   boltzmann=boltzmann)
+                   for (count, chunk_seed, lengths, separator, boltzmann)
+                   in chunks)
     else:
-        length = lambda: random.randint(1, 10)
-        generator = CFLGenerator(args[0], 10)
-    results = [options.separator.join(generator.generate(length())) 
-               for i in range(options.number)]
-    if options.the_format == 'string':
-        for res in results:
-            print >> out, res
-    elif options.the_format == 'json':
-        print >> out, json.dumps(results)
+        # The range is checked against the length index before any counting,
+        # and the counts are only extended to the longest length that has
+        # strings.
+        generator = CFLGenerator(args[0], backend=options.backend,
+                                 cache_dir=options.cache_dir)
+        try:
+            if options.boltzmann:
+                generator._boltzmann_sampler(*lengths)
+            else:
+                generator._length_cdf(*lengths)
+        except GenerationFailure:
+            parser.error("The grammar has no strings of length %d to %d."
+                         % lengths)
+        if options.jobs > 1:
+            # The preprocessed generator is handed to each worker once,
+            # through fork where there is one.
+            from multiprocessing import Pool
+            pool = Pool(options.jobs, _init_worker, (generator,))
+            batches = _add_worker_work(
+                generator, _imap_bounded(pool, _generate_chunk_in_worker,
+                                         chunks,
+                                         CHUNKS_PER_JOB * options.jobs))
+        else:
+            batches = (_generate_chunk(generator, *chunk) for chunk in chunks)
+    compress = options.gzip or options.outfile.endswith('.gz')
+    out = open_output(options.outfile, compress)
+    finished = False
+    try:
+        write_strings(batches, out, options.the_format)
+        out.close()
+        finished = True
+    except IOError as error:
+        # A reader like head may stop reading before the end.
+        if error.errno != errno.EPIPE:
+            raise
+    except GenerationFailure:
+        # The Boltzmann sampler can keep missing a range that has strings.
+        parser.error("No string of length %d to %d was generated."
+                     % lengths)
+    finally:
+        if pool is not None:
+            # The chunks still in flight aren't wanted if the output ended.
+            if finished:
+                pool.close()
+            else:
+                pool.terminate()
+            pool.join()
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(options.profile)
+    if options.stats and options.server is not None:
+        print >> sys.stderr, format_stats(client.stats(source,
+                                                       options.backend))
+    elif options.stats:
+        print >> sys.stderr, format_stats(generator.stats())
+
+
+def _imap_bounded(pool, function, items, window):
+    """Yield function(item) for each of `items` in order, computed by the
+    multiprocessing Pool `pool`.
+
+    Unlike Pool.imap, at most `window` items are handed to the pool before
+    their results are taken, so the results don't pile up when they are
+    taken more slowly than they are computed.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(function, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _add_worker_work(generator, results):
+    """Yield the strings of each result of _generate_chunk_in_worker, adding
+    its work to the stats of `generator`."""
+    for batch, work in results:
+        generator._add_work(*work)
+        yield batch
 
 
 if __name__ == '__main__':
@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+
+"""A long-running server that keeps preprocessed CFLGenerators warm.
+
+    python cflserver.py [--address /tmp/cfl.sock | localhost:8123]
+    python cfl.py gram.cfg --number 10 --length 20 --server /tmp/cfl.sock
+
+Every run of cfl.py parses the grammar, converts it to CNF and counts strings
+(or reads the counts from the disk cache) before it generates anything. The
+server does that once for each grammar and keeps the generators in a
+registry keyed by the text of the grammar and the backend, evicting the least
+recently used past --max-generators. The count tables are extended as
+requests for longer lengths come in.
+
+Clients connect to a Unix socket or a TCP port and send requests as JSON
+objects, one per line. Each is answered with one line, in order, and a
+connection can carry any number of them. Every request has an 'op' and the
+text of the grammar as 'grammar', and can have a 'backend' (see CFLGenerator)
+and an 'id' that is copied to the response:
+
+    {"op": "generate", "grammar": ..., "number": 10, "lower": 5, "upper": 8,
+     "seed": 1, "separator": " ", "boltzmann": false}
+        -> {"ok": true, "strings": [...]}
+    {"op": "count", "grammar": ..., "length": 20, "nonterminal": "S"}
+        -> {"ok": true, "count": 1234}
+    {"op": "feasible", "grammar": ..., "length": 20, "nonterminal": "S"}
+        -> {"ok": true, "feasible": true}
+    {"op": "stats", "grammar": ...}
+        -> {"ok": true, "stats": {...}}
+
+'generate' takes 'length' instead of 'lower' and 'upper' for one length, and
+draws the strings like a chunk of cfl.py (_generate_chunk), so the strings
+for a seed are the ones that cfl.py writes for a chunk with that seed. The
+nonterminal defaults to the start symbol. A request that fails is answered
+with {"ok": false, "error": message}.
+
+Each connection is served by a thread of its own, and each generator is used
+by one request at a time. When the server is stopped with SIGINT or SIGTERM,
+it writes the counts of its generators to the disk cache and removes its
+Unix socket. There is no authentication: anyone who can connect
+can make the server spend memory and time, so it should only listen on a
+Unix socket or on localhost.
+"""
+
+from optparse import OptionParser
+import errno
+import os
+import random
+import signal
+import socket
+import SocketServer
+import stat
+import sys
+import tempfile
+import threading
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from cfl import CFLGenerator, GenerationFailure, _generate_chunk
+import diskcache
+from lrucache import LRUCache
+
+
+# Where the server listens and the clients connect unless told otherwise.
+DEFAULT_ADDRESS = os.environ.get(
+    'CFL_SERVER',
+    os.path.join(tempfile.gettempdir(), 'cfl-%d.sock' % os.getuid()))
+
+# Default number of generators that the registry keeps.
+DEFAULT_MAX_GENERATORS = 32
+
+
+class ServerError(Exception):
+    """Raised by Client when the server can't be reached or answers a request
+    with an error."""
+
+
+def parse_address(address):
+    """Return the socket address of `address`: a (host, port) pair for
+    'host:port' or ':port' (on localhost), and otherwise the path of a Unix
+    socket."""
+    host, colon, port = address.rpartition(':')
+    if colon and port.isdigit() and '/' not in address:
+        return (host or 'localhost', int(port))
+    return address
+
+
+class GeneratorRegistry(object):
+    """The CFLGenerators of the grammars that the server was asked about,
+    each with a lock that a request holds while it uses the generator.
+
+    At most `max_generators` are kept, and they keep their counts in
+    `cache_dir` (see CFLGenerator).
+    """
+
+    def __init__(self, max_generators=DEFAULT_MAX_GENERATORS, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._entries = LRUCache(max_generators)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, grammar, backend=None):
+        """Return (generator, lock) for the text of a grammar `grammar` and
+        the backend `backend`, making the generator if there is none yet.
+
+        The generator is made without holding up the requests for other
+        grammars, so two requests for a new grammar at once may both make
+        one. Only the first is kept.
+        """
+        if not isinstance(grammar, basestring) or grammar.endswith('.cfg'):
+            # CFLGenerator would read a file name; the server doesn't.
+            raise ValueError('grammar must be the text of a grammar.')
+        key = (grammar, backend)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            generator = CFLGenerator(grammar, backend=backend,
+                                     cache_dir=self.cache_dir)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = (generator, threading.Lock())
+                    self._entries.put(key, entry)
+        return entry
+
+    def save_caches(self):
+        """Write the counts of every generator to the disk cache (see
+        CFLGenerator.save_cache)."""
+        with self._lock:
+            entries = self._entries.values()
+        for generator, lock in entries:
+            with lock:
+                generator.save_cache()
+
+
+def _field(request, name):
+    """Return the field `name` of `request`, which must have it."""
+    try:
+        return request[name]
+    except KeyError:
+        raise ValueError('The request has no %s.' % name)
+
+
+def _generate(generator, request):
+    if 'length' in request:
+        lengths = (request['length'], request['length'])
+    else:
+        lengths = (_field(request, 'lower'), _field(request, 'upper'))
+    if not 1 <= lengths[0] <= lengths[1]:
+        raise ValueError('String lengths must satisfy 1 <= lower <= upper.')
+    number = request.get('number', 1)
+    if not isinstance(number, (int, long)) or isinstance(number, bool) or \
+            number < 0:
+        raise ValueError('number must be a non-negative integer.')
+    boltzmann = request.get('boltzmann', False)
+    try:
+        if boltzmann:
+            generator._boltzmann_sampler(*lengths)
+        else:
+            generator._length_cdf(*lengths)
+    except GenerationFailure:
+        raise ValueError('The grammar has no strings of length %d to %d.'
+                         % lengths)
+    seed = request.get('seed')
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    try:
+        strings = _generate_chunk(generator, number, seed, lengths,
+                                  request.get('separator', ''), boltzmann)
+    except GenerationFailure:
+        # The Boltzmann sampler can keep missing a range that has strings.
+        raise ValueError('No string of length %d to %d was generated.'
+                         % lengths)
+    return {'strings': strings}
+
+
+def _nonterminal(generator, request):
+    compiled = generator.compiled
+    nonterm = request.get('nonterminal')
+    if nonterm is None:
+        return compiled.nonterminals[compiled.start]
+    try:
+        compiled.nonterminal_id(nonterm)
+    except (KeyError, TypeError):
+        raise ValueError('Unknown nonterminal %s.' % json.dumps(nonterm))
+    return nonterm
+
+
+def _count(generator, request):
+    length = _field(request, 'length')
+    if length < 1:
+        raise ValueError('length must be greater than 0.')
+    return {'count': generator.count_by_nonterm(
+        _nonterminal(generator, request), length)}
+
+
+def _feasible(generator, request):
+    return {'feasible': generator.feasible(_field(request, 'length'),
+                                           _nonterminal(generator, request))}
+
+
+def _stats(generator, request):
+    return {'stats': generator.stats()}
+
+
+# The function that answers each op, with the generator of the request.
+OPERATIONS = {
+    'generate': _generate,
+    'count': _count,
+    'feasible': _feasible,
+    'stats': _stats,
+}
+
+
+def answer(registry, line):
+    """Return the response to the request in the line of JSON `line`, with
+    the generators of the GeneratorRegistry `registry`."""
+    try:
+        request = json.loads(line)
+    except ValueError as error:
+        return {'ok': False, 'error': 'Bad JSON: %s' % error}
+    if not isinstance(request, dict):
+        return {'ok': False, 'error': 'A request must be a JSON object.'}
+    response = {}
+    if 'id' in request:
+        response['id'] = request['id']
+    try:
+        operation = OPERATIONS.get(request.get('op'))
+        if operation is None:
+            raise ValueError('Unknown op %s.' % json.dumps(request.get('op')))
+        if 'grammar' not in request:
+            raise ValueError('The request has no grammar.')
+        generator, lock = registry.get(request['grammar'],
+                                       request.get('backend'))
+        with lock:
+            response.update(operation(generator, request))
+    except (KeyError, ValueError) as error:
+        # str() of a KeyError is the repr of its message.
+        response.update(ok=False, error='%s' % (error.args[0] if error.args
+                                                 else type(error).__name__))
+    except Exception as error:
+        # Anything that goes wrong with one request is reported to the
+        # client rather than ending the connection.
+        response.update(ok=False, error='%s: %s' % (type(error).__name__,
+                                                     error))
+    else:
+        response['ok'] = True
+    return response
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    """Answers the requests of a connection until the client closes it."""
+
+    def handle(self):
+        registry = self.server.registry
+        for line in iter(self.rfile.readline, ''):
+            self.wfile.write(json.dumps(answer(registry, line)) + '\n')
+
+
+class _UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def make_server(address, registry):
+    """Return a server that listens on `address` (see parse_address) and
+    answers with the generators of the GeneratorRegistry `registry`.
+
+    A Unix socket left behind by a server that is gone is replaced.
+    """
+    address = parse_address(address)
+    if isinstance(address, tuple):
+        server = _TCPServer(address, RequestHandler)
+    else:
+        _remove_stale_socket(address)
+        server = _UnixServer(address, RequestHandler)
+    server.registry = registry
+    return server
+
+
+def _remove_stale_socket(path):
+    """Remove the Unix socket at `path` if no server listens on it."""
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except OSError:
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error as error:
+        if error.errno == errno.ECONNREFUSED:
+            os.unlink(path)
+    finally:
+        probe.close()
+
+
+class Client(object):
+    """A connection to the server at `address` (see parse_address).
+
+    Each method sends a request and waits for its response, and raises
+    ServerError if the request failed.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS):
+        self.address = address
+        address = parse_address(address)
+        try:
+            if isinstance(address, tuple):
+                self._socket = socket.create_connection(address)
+            else:
+                self._socket = socket.socket(socket.AF_UNIX,
+                                             socket.SOCK_STREAM)
+                self._socket.connect(address)
+        except socket.error as error:
+            raise ServerError("Can't connect to the server at %s: %s"
+                              % (self.address, error))
+        self._responses = self._socket.makefile('rb')
+
+    def close(self):
+        self._responses.close()
+        self._socket.close()
+
+    def request(self, op, grammar, **fields):
+        """Return the response to the request with the op `op`, the grammar
+        text `grammar` and the other fields `fields`."""
+        fields.update(op=op, grammar=grammar)
+        self._socket.sendall(json.dumps(fields) + '\n')
+        line = self._responses.readline()
+        if not line:
+            raise ServerError('The server closed the connection.')
+        response = json.loads(line)
+        if not response.get('ok'):
+            raise ServerError(response.get('error'))
+        return response
+
+    def generate(self, grammar, number, lower, upper, **fields):
+        """Return a list of `number` strings with lengths from `lower` to
+        `upper`. `fields` can be seed, separator, backend and boltzmann."""
+        return self.request('generate', grammar, number=number, lower=lower,
+                            upper=upper, **fields)['strings']
+
+    def count(self, grammar, length, nonterminal=None, backend=None):
+        """Return the number of strings of length `length` of `nonterminal`
+        (the start symbol by default)."""
+        return self.request('count', grammar, length=length,
+                            nonterminal=nonterminal, backend=backend)['count']
+
+    def feasible(self, grammar, length, nonterminal=None, backend=None):
+        """Return whether `nonterminal` (the start symbol by default) derives
+        a string of length `length`."""
+        return self.request('feasible', grammar, length=length,
+                            nonterminal=nonterminal,
+                            backend=backend)['feasible']
+
+    def stats(self, grammar, backend=None):
+        """Return CFLGenerator.stats() of the generator of `grammar`."""
+        return self.request('stats', grammar, backend=backend)['stats']
+
+
+def main(argv):
+    """
+    python cflserver.py
+    python cflserver.py --address localhost:8123 --max-generators 100
+
+    Serve requests until interrupted. cfl.py --server ADDRESS is a client
+    with the options of cfl.py.
+    """
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-a', '--address', default=DEFAULT_ADDRESS,
+                      metavar='<ADDRESS>',
+                      help='Path of a Unix socket, or HOST:PORT to listen on '
+                           'TCP. Defaults to $CFL_SERVER or %s.'
+                           % DEFAULT_ADDRESS)
+    parser.add_option('--max-generators', type='int',
+                      default=DEFAULT_MAX_GENERATORS, metavar='<NUMBER>',
+                      help='Most grammars kept preprocessed at once.')
+    parser.add_option('--cache-dir', action='store', dest='cache_dir',
+                      default=diskcache.DEFAULT_CACHE_DIR, metavar='<DIR>',
+                      help='Directory of cached preprocessed grammars. '
+                           'Defaults to $CFL_CACHE_DIR or ~/.cache/cfl.')
+    parser.add_option('--no-cache', action='store_const', dest='cache_dir',
+                      const=None, help="Don't use the grammar cache.")
+    options, args = parser.parse_args(argv)
+    if args:
+        parser.error('No arguments are taken.')
+    if options.max_generators < 1:
+        parser.error('Argument of option --max-generators must be positive.')
+
+    registry = GeneratorRegistry(options.max_generators, options.cache_dir)
+    server = make_server(options.address, registry)
+    # SIGTERM ends serve_forever() like SIGINT, so that the socket is removed.
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        print >> sys.stderr, 'Listening on %s' % options.address
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if not isinstance(server.server_address, tuple):
+            os.unlink(server.server_address)
+        registry.save_caches()
+    return 0
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -1,54 +1,270 @@
 #!/usr/bin/env python
 
-"""Script for approximating whether a grammar is ambiguous."""
+"""Script for approximating whether a grammar is ambiguous.
+
+    python checkambi.py gram.cfg [--min-length 1] [--max-length 10]
+                                 [--output yesno|table|significance]
+
+CFLGenerator chooses every derivation of a length with the same probability.
+If the grammar is unambiguous, every string has one derivation, so the strings
+of each length are uniformly distributed over the count(S, length) strings of
+that length. If some string has more than one derivation, it comes up more
+often than the others. For every length, strings are drawn and counted until
+one of these happens:
+
+  * count(S, length) distinct strings were seen. The grammar is then certainly
+    unambiguous for that length, since an ambiguous length has fewer distinct
+    strings than derivations.
+  * The counts are too far from uniform for chance (see _p_value), at a
+    significance level split among all the looks at the counts (Bonferroni),
+    so that stopping at the first significant look is still a valid test.
+  * --max-samples strings were drawn without either.
+
+The counts are looked at after min_samples, 2 * min_samples, 4 * min_samples,
+... strings, so the test only draws many strings for lengths where it needs
+them. Only the counts of the distinct strings are kept.
+
+The test is of the CNF grammar that the generator uses. Converting to CNF
+keeps one copy of productions that are repeated or reachable through several
+chains of unit productions, so ambiguity that only comes from those isn't
+detected.
+"""
 
 from __future__ import division
 
-from collections import defaultdict
-import random
+from collections import namedtuple
+from math import exp, log, lgamma
+from optparse import OptionParser
 import sys
 
 from cfl import CFLGenerator, GenerationFailure
+import diskcache
 
 
-#TODO: Split most of check_ambiguity() off into a function that tests ambiguity 
-#      for strings of one length. Then call that function with different 
-#      lengths. The number of strings to generate for each length should depend
-#      on how quickly the probabilities converge.
+# Default significance level of the whole test.
+DEFAULT_ALPHA = 0.01
 
-#TODO: Add main program with options for types of output. Tables of 
-#      probabilities, significance, just 'yes'/'no', etc..
+# Default numbers of strings drawn before the first look at the counts of a
+# length and at most.
+DEFAULT_MIN_SAMPLES = 1000
+DEFAULT_MAX_SAMPLES = 256000
+
+# Largest number of strings drawn with one call to generate_many.
+BATCH_SIZE = 10000
+
+# The outcome of the test for one length:
+#     length       -- the string length
+#     derivations  -- count(S, length), the number of derivations
+#     samples      -- the number of strings drawn
+#     distinct     -- the number of distinct strings among them
+#     p_value      -- the p-value of the last look, not adjusted for the
+#                     number of looks (None if no look was needed)
+#     verdict      -- 'ambiguous', 'unambiguous' (certain) or 'no evidence'
+LengthResult = namedtuple('LengthResult', ['length', 'derivations', 'samples',
+                                           'distinct', 'p_value', 'verdict'])
+
+
+def look_schedule(min_samples, max_samples):
+    """Return the sample sizes at which the counts are tested."""
+    schedule = []
+    size = min_samples
+    while size < max_samples:
+        schedule.append(size)
+        size *= 2
+    schedule.append(max_samples)
+    return schedule
+
+
+def check_length(generator, length, alpha, schedule):
+    """Return the LengthResult of drawing strings of length `length` from
+    `generator` and testing the counts at each sample size in `schedule`,
+    each time at significance level `alpha`.
+
+    Raise GenerationFailure if there are no strings of length `length`.
+    """
+    if not generator.feasible(length):
+        raise GenerationFailure(length)
+    derivations = generator.count_by_nonterm(
+        generator.compiled.nonterminals[generator.compiled.start], length)
+    if derivations == 1:
+        return LengthResult(length, derivations, 0, derivations, None,
+                            'unambiguous')
+
+    counts = {}
+    samples = 0
+    p_value = None
+    for size in schedule:
+        while samples < size:
+            number = min(BATCH_SIZE, size - samples)
+            for string_ in generator.generate_many(length, number):
+                key = '\0'.join(string_)
+                counts[key] = counts.get(key, 0) + 1
+            samples += number
+
+        if len(counts) == derivations:
+            return LengthResult(length, derivations, samples, len(counts),
+                                p_value, 'unambiguous')
+        p_value = _p_value(counts.itervalues(), samples, derivations)
+        if p_value < alpha:
+            return LengthResult(length, derivations, samples, len(counts),
+                                p_value, 'ambiguous')
+    return LengthResult(length, derivations, samples, len(counts), p_value,
+                        'no evidence')
 
-def check_ambiguity(grammar):
-    """Print the approximated probabilities of each string in L(`grammar`)."""
-    results = defaultdict(int)
-    generator = CFLGenerator(grammar)
-    while True:
-        try:
-            length = random.randint(1, 10)
-            strings = make_strings(generator, 1000, length)
-        except GenerationFailure:
-            continue
-        else:
-            break
-    for string_ in strings:
-        results[string_] += 1
 
-    total_count = sum(results.values())
-    average_count = total_count / len(results)
-    expected_probability = average_count / total_count
-    print ("Expected probability of each string if grammar is unambiguous: "
-           "%.2f." % expected_probability)
+def check_ambiguity(grammar, lengths=range(1, 11), alpha=DEFAULT_ALPHA,
+                    min_samples=DEFAULT_MIN_SAMPLES,
+                    max_samples=DEFAULT_MAX_SAMPLES, seed=None,
+                    cache_dir=diskcache.DEFAULT_CACHE_DIR):
+    """Test the lengths `lengths` of `grammar` for ambiguity.
+
+    Return (LengthResult for each length that has strings, adjusted p-value).
+    The adjusted p-value is the smallest p-value of any look times the number
+    of looks, which is the significance of the grammar being ambiguous. The
+    test at level `alpha` says 'ambiguous' for some length with probability
+    at most `alpha` if the grammar is unambiguous.
+    """
+    generator = CFLGenerator(grammar, seed=seed, cache_dir=cache_dir)
+    # Lengths without strings are left out without counting them, and don't
+    # take a share of the significance level.
+    lengths = [length for length in lengths if generator.feasible(length)]
+    schedule = look_schedule(min_samples, max_samples)
+    looks = len(schedule) * len(lengths)
+
+    results = [check_length(generator, length, alpha / looks, schedule)
+               for length in lengths]
+
+    p_values = [result.p_value for result in results
+                if result.p_value is not None]
+    return results, min([1.0] + [p * looks for p in p_values])
 
-    for string_, count in results.iteritems():
-        actual_probability = count / total_count
-        print "'%s' occurs with probability %.2f" \
-              % (string_, actual_probability)
 
 def make_strings(generator, count, length):
     """Generate and return a list of `count` strings of length `length`."""
-    return [''.join(generator.generate(length)) for i in range(count)]
+    return [''.join(string_)
+            for string_ in generator.generate_many(length, count)]
+
+
+def _p_value(counts, samples, categories):
+    """Return the p-value of the string counts `counts` under the hypothesis
+    that `samples` strings were drawn uniformly from `categories` strings.
+
+    Both tests below use the number of pairs of equal strings, which is
+    larger when some strings are more likely than others. With at least one
+    expected draw per string it is the chi-square statistic against the
+    uniform distribution (with the strings that weren't drawn counted as 0).
+    With fewer draws most strings aren't drawn and the number of pairs is
+    about Poisson distributed.
+    """
+    pairs = sum(count * (count - 1) // 2 for count in counts)
+    if samples >= categories:
+        expected = samples / categories
+        statistic = (2 * pairs + samples) / expected - samples
+        return _gamma_q((categories - 1) / 2, statistic / 2)
+    mean = samples * (samples - 1) / 2 / categories
+    if not pairs:
+        return 1.0
+    return 1 - _gamma_q(pairs, mean)
+
+
+def _gamma_q(a, x):
+    """Return the regularized upper incomplete gamma function Q(a, x), with
+    the series for x < a + 1 and the continued fraction otherwise (Numerical
+    Recipes 6.2)."""
+    if x <= 0:
+        return 1.0
+    scale = exp(-x + a * log(x) - lgamma(a))
+    if x < a + 1:
+        term = total = 1 / a
+        denominator = a
+        while abs(term) > abs(total) * 1e-15:
+            denominator += 1
+            term *= x / denominator
+            total += term
+        return max(0.0, 1 - total * scale)
+
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    i = 0
+    while True:
+        i += 1
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        if abs(d) < tiny:
+            d = tiny
+        c = b + an / c
+        if abs(c) < tiny:
+            c = tiny
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return scale * h
+
+
+def main(argv):
+    parser = OptionParser(usage='%prog [options] GRAMMAR')
+    parser.add_option('--min-length', type='int', default=1,
+                      metavar='<LENGTH>', help='Shortest length tested.')
+    parser.add_option('--max-length', type='int', default=10,
+                      metavar='<LENGTH>', help='Longest length tested.')
+    parser.add_option('-a', '--alpha', type='float', default=DEFAULT_ALPHA,
+                      metavar='<ALPHA>', help='Significance level.')
+    parser.add_option('--min-samples', type='int', default=DEFAULT_MIN_SAMPLES,
+                      metavar='<NUMBER>',
+                      help='Strings drawn before the first test of a length.')
+    parser.add_option('--max-samples', type='int', default=DEFAULT_MAX_SAMPLES,
+                      metavar='<NUMBER>',
+                      help='Most strings drawn for a length.')
+    parser.add_option('-o', '--output', default='yesno',
+                      metavar='<OUTPUT>',
+                      help="'yesno' (the default), 'table' or 'significance'.")
+    parser.add_option('--seed', type='int', default=None, metavar='<SEED>',
+                      help='Seed that makes the output reproducible.')
+    parser.add_option('--no-cache', action='store_const', dest='cache_dir',
+                      const=None, default=diskcache.DEFAULT_CACHE_DIR,
+                      help="Don't use the grammar cache.")
+
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('Exactly one grammar must be given.')
+    if options.output not in ('yesno', 'table', 'significance'):
+        parser.error("Argument of option --output must be 'yesno', 'table' "
+                     "or 'significance'.")
+    if not 1 <= options.min_length <= options.max_length:
+        parser.error('The lengths must satisfy 1 <= min <= max.')
+    if not 1 <= options.min_samples <= options.max_samples:
+        parser.error('The sample sizes must satisfy 1 <= min <= max.')
+
+    results, p_value = check_ambiguity(
+        args[0], range(options.min_length, options.max_length + 1),
+        options.alpha, options.min_samples, options.max_samples, options.seed,
+        options.cache_dir)
+    ambiguous = any(result.verdict == 'ambiguous' for result in results)
+
+    if options.output == 'yesno':
+        print 'yes' if ambiguous else 'no'
+    elif options.output == 'significance':
+        print '%.6g' % p_value
+    else:
+        print '%6s %12s %8s %8s %10s  %s' % ('length', 'derivations',
+                                             'samples', 'distinct', 'p-value',
+                                             'verdict')
+        for result in results:
+            print '%6d %12d %8d %8d %10s  %s' % (
+                result.length, result.derivations, result.samples,
+                result.distinct,
+                '-' if result.p_value is None else '%.3g' % result.p_value,
+                result.verdict)
+        print 'Ambiguous: %s (adjusted p-value %.3g)' % (
+            'yes' if ambiguous else 'no', p_value)
+    return 0
 
 
 if __name__ == '__main__':
-    check_ambiguity(sys.argv[1])
+    exit(main(sys.argv[1:]))
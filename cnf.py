@@ -1,224 +1,241 @@
 #!/usr/bin/env python
 
-"""
-to_chomsky_normal_form()
-binarise()
+"""Conversion of context free grammars to Chomsky Normal Form.
+
+convert_to_cnf() converts an nltk ContextFreeGrammar. convert_productions()
+does the work on (lhs, rhs) pairs, where the terminals are the strings and
+anything else is a nonterminal, so it doesn't need nltk.
+
+The conversion is done in four steps, each a single pass over the
+productions or a worklist fixpoint over indexes from symbols to productions,
+so that the whole conversion takes time close to linear in the size of the
+grammar and of its output:
 
+    1. Replace the terminals on long RHSs:  A -> B 'z'   =>  A -> B Z, Z -> 'z'
+    2. Binarize:                             A -> B C D   =>  A -> B X, X -> C D
+    3. Remove empty productions, adding A -> B for A -> B C with C nullable.
+    4. Remove unit productions A -> B by copying the non-unit productions of
+       every nonterminal reachable from A through unit productions.
+
+The empty string is not in the language of the result.
 """
 
-from collections import defaultdict
-from copy import deepcopy
-import sys
 import string
-from pprint import pprint
+import sys
 
-import nltk
-from nltk.grammar import Nonterminal, parse_cfg, ContextFreeGrammar, Production
 
 def _letter_gen(avoid_strings):
-    """Yield 'A', 'B', ..., 'Z', 'AA', ..., 'ZZZ', ...."""
+    """Yield 'A', 'B', ..., 'Z', 'AA', ..., 'ZZZ', ..., skipping
+    `avoid_strings`."""
 
     i = 26
     while True:
         reps, index = divmod(i, 26)
-        if string.ascii_uppercase[index] not in avoid_strings:
-            yield string.ascii_uppercase[index] * reps
+        name = string.ascii_uppercase[index] * reps
+        if name not in avoid_strings:
+            yield name
         i += 1
 
-def _get_nonterminals(grammar):
-    """Return the Nonterminal strings in `grammar` as a set."""
-    nonterminals = [prod.lhs().symbol() for prod in grammar.productions()] + \
-                   [tok for prod in grammar.productions() for tok in prod.rhs()
-                    if isinstance(tok, Nonterminal)]
-    return set(nonterminals)
 
+def _symbol(nonterm):
+    """Return the symbol of a Nonterminal (or of anything like one)."""
+    try:
+        return nonterm.symbol()
+    except AttributeError:
+        return nonterm
 
 
-def replace_rhs_terminals(input_productions, letters):
-    """Return new productions "A -> B ... 'z'" to "A -> B ... Z ; Z -> 'z'"."""
-    productions = deepcopy(input_productions)
-    new_prods = []
-    delete_prods = []
-    # TODO: do a listcomp first then act on all the results
+def _is_terminal(token):
+    return isinstance(token, basestring)
+
+
+def _unique(productions):
+    """Return `productions` without repeats, in order of first appearance."""
+    seen = set()
+    unique = []
     for prod in productions:
+        if prod not in seen:
+            seen.add(prod)
+            unique.append(prod)
+    return unique
+
+
+#### STEP 1 ####
+def _replace_rhs_terminals(productions, new_nonterminal):
+    """Return new productions "A -> B ... 'z'" to "A -> B ... Z ; Z -> 'z'".
+
+    Every terminal gets a single new nonterminal, however often it occurs.
+    """
+    by_terminal = {}
+    new_prods = []
+    for lhs, rhs in productions:
         # We don't care about rules like "A -> B", "A -> 'b'", "A -> B C D".
-        if all([isinstance(token, Nonterminal) for token in prod.rhs()]) or  \
-                len(prod.rhs()) < 2: 
+        if len(rhs) < 2 or not any(_is_terminal(token) for token in rhs):
+            new_prods.append((lhs, rhs))
             continue
 
-        # Add rule U -> 'a' and replace rule B -> A..'a' with B -> A..U for each
-        # nonterminal 'a' on a RHS.
-        lhs = prod.lhs()
-        rhs = []
-        for token in prod.rhs():
-            if isinstance(token, str):
-                nonterm = Nonterminal(letters.next())
-                new_prod = Production(nonterm, [token])
-                new_prods.append(new_prod)
-                rhs.append(nonterm)
-            else:
-                rhs.append(token)
-        delete_prods.append(prod)
-        new_prods.append(Production(lhs, rhs))
-
-    remove_all(productions, *delete_prods)
-    productions += new_prods
-    return productions
+        # Add rule Z -> 'z' and replace rule A -> B..'z' with A -> B..Z for
+        # each terminal 'z' on the RHS.
+        new_rhs = []
+        for token in rhs:
+            if _is_terminal(token):
+                if token not in by_terminal:
+                    by_terminal[token] = new_nonterminal()
+                    new_prods.append((by_terminal[token], (token,)))
+                token = by_terminal[token]
+            new_rhs.append(token)
+        new_prods.append((lhs, tuple(new_rhs)))
+    return new_prods
+
 
 #### STEP 2 ####
-def _binarize(input_productions, letters):
-    """Convert "A -> B C D" to "A -> B X ; X -> C D
+def _binarize(productions, new_nonterminal):
+    """Convert "A -> B C D" to "A -> B X ; X -> C D".
 
-    For each production with more than two nonterminals on its rhs, replace
-    it with a set of binary rules.
+    Each production with more than two nonterminals on its RHS is replaced by
+    a chain of binary rules.
     """
-    productions = deepcopy(input_productions)
-
-    #TODO: what about duplicate productions?
     new_prods = []
-    too_long = [prod for prod in productions if len(prod.rhs()) > 2]
-    for prod in too_long:
-        lhs = prod.lhs()
-        for token in prod.rhs()[:-2]:
-            new = Nonterminal(letters.next())
-            new_prods.append(Production(lhs, [token, new]))
+    for lhs, rhs in productions:
+        for token in rhs[:-2]:
+            new = new_nonterminal()
+            new_prods.append((lhs, (token, new)))
             lhs = new
+        new_prods.append((lhs, rhs[-2:] if len(rhs) > 2 else rhs))
+    return new_prods
 
-        new_prods.append(Production(lhs, [prod.rhs()[-2], prod.rhs()[-1]]))
 
-    productions += new_prods
-    remove_all(productions, *too_long)
-    return productions
+#### STEP 3 ####
+def _nullable(productions):
+    """Return the set of nonterminals that derive the empty string.
 
+    Each production keeps the number of its RHS tokens that aren't known to
+    be nullable yet. When a nonterminal turns out to be nullable, only the
+    productions that it occurs in are updated, through an index.
+    """
+    remaining = []
+    occurrences = {}
+    nullable = set()
+    worklist = []
+    for index, (lhs, rhs) in enumerate(productions):
+        remaining.append(len(rhs))
+        for token in rhs:
+            if not _is_terminal(token):
+                occurrences.setdefault(token, []).append(index)
+        if not rhs and lhs not in nullable:
+            nullable.add(lhs)
+            worklist.append(lhs)
+
+    while worklist:
+        nonterm = worklist.pop()
+        for index in occurrences.get(nonterm, ()):
+            remaining[index] -= 1
+            lhs = productions[index][0]
+            if not remaining[index] and lhs not in nullable:
+                nullable.add(lhs)
+                worklist.append(lhs)
+    return nullable
+
+
+def _remove_empty_productions(productions):
+    """Remove productions with empty right hand sides.
+
+    The productions must have at most two tokens on their RHS. For every
+    production with a nullable nonterminal on its RHS, the production without
+    that nonterminal is added.
+    """
+    nullable = _nullable(productions)
+    new_prods = []
+    for lhs, rhs in productions:
+        if not rhs:
+            continue
+        new_prods.append((lhs, rhs))
+        if len(rhs) == 2:
+            first, second = rhs
+            if second in nullable:
+                new_prods.append((lhs, (first,)))
+            if first in nullable:
+                new_prods.append((lhs, (second,)))
+    return _unique(new_prods)
+
+
+#### STEP 4 ####
+def _remove_unit_productions(productions):
+    """Return a list of productions without unit productions "A -> B".
+
+    A gets every non-unit production of every nonterminal B that it reaches
+    through one or more unit productions (the transitive closure of the unit
+    pairs), found with a depth first search from A.
+    """
+    units = {}
+    others = {}
+    order = []
+    for lhs, rhs in productions:
+        if lhs not in units:
+            units[lhs] = []
+            others[lhs] = []
+            order.append(lhs)
+        if len(rhs) == 1 and not _is_terminal(rhs[0]):
+            units[lhs].append(rhs[0])
+        else:
+            others[lhs].append(rhs)
 
-# STEP 3 #
-def _replace_start(productions, letters):
-    """Replace start symbol S with S0 and add "S0 -> S."""
-    pass
+    new_prods = []
+    for nonterm in order:
+        reached = set([nonterm])
+        stack = [nonterm]
+        while stack:
+            current = stack.pop()
+            for rhs in others.get(current, ()):
+                new_prods.append((nonterm, rhs))
+            for target in units.get(current, ()):
+                if target not in reached:
+                    reached.add(target)
+                    stack.append(target)
+    return _unique(new_prods)
+
+
+def convert_productions(start, productions, make_nonterminal):
+    """Return the (lhs, rhs) pairs of a CNF grammar for the language of the
+    grammar with start symbol `start` and (lhs, rhs) pairs `productions`,
+    without the empty string.
+
+    `make_nonterminal` makes a new nonterminal from a symbol, e.g.
+    nltk.grammar.Nonterminal. The new nonterminals are named 'A', 'B', ...,
+    avoiding the symbols of the grammar.
+    """
+    productions = [(lhs, tuple(rhs)) for (lhs, rhs) in productions]
+    symbols = set([_symbol(start)])
+    for lhs, rhs in productions:
+        symbols.add(_symbol(lhs))
+        symbols.update(_symbol(token) for token in rhs
+                       if not _is_terminal(token))
+    letters = _letter_gen(symbols)
 
-# STEP 4 #
-def _remove_empty_productions(input_productions, letters):
-    """Remove productions with empty right hand sides."""
-    copied_prods = deepcopy(input_productions)
-    
+    def new_nonterminal():
+        return make_nonterminal(letters.next())
 
-    #
-    # Find all nonterminals that generate the emptry string.
-    #
-    # Basis: A nonterminal generates the empty string if it is the LHS of a
-    # production thats RHS is empty.
-    gen_empty = [prod.lhs() for prod in copied_prods
-                 if len(prod.rhs()) == 0]
-    N = len(gen_empty)
+    productions = _replace_rhs_terminals(productions, new_nonterminal)
+    productions = _binarize(productions, new_nonterminal)
+    productions = _remove_empty_productions(productions)
+    return _remove_unit_productions(productions)
 
-    # Induction:
-    while True:
-        for nonterm in gen_empty:
-            for prod in copied_prods:
-                if nonterm in prod.rhs():
-                    better = list(prod.rhs())
-                    better.remove(nonterm)
-                    prod._rhs = tuple(better)
-
-        gen_empty[:] = [prod.lhs() for prod in copied_prods 
-                     if len(prod.rhs()) == 0]
-        new_len = len(gen_empty)
-        if new_len == N:
-            break
-        N = new_len
-
-    print 'gen_empty', gen_empty
-    # ADD NEW RULES
-    new_prods = []
-    productions = deepcopy(input_productions)
-    for nonterm in gen_empty: 
-        prods = [prod for prod in productions
-                 if len(prod.rhs()) == 2 and nonterm in prod.rhs()]
-        for prod in prods:
-            rhs = list(prod.rhs())
-            while nonterm in rhs:
-                lhs = prod.lhs()
-                rhs.remove(nonterm)
-                p = Production(lhs, tuple(rhs))
-                new_prods.append(p)
-            
-        
-    productions += new_prods
-    productions[:] = [p for p in productions if p.rhs()]
-    return productions
-
-
-def _get_unit_productions(productions):
-    return [p for p in productions if len(p.rhs()) == 1 and isinstance(p.rhs()[0], Nonterminal)]
-
-
-# STEP 5 #
-def _remove_unit_productions(input_productions, letters):
-    """Return a list of Productions without unit productions. TODO"""
-    # Basis step. Add (A, A) for all nonterminals A
-    #TODO: is it ok to ignore NTs on RHS?
-    productions = deepcopy(input_productions)
-    unit_pairs = defaultdict(set)
-    nonterminals = [p.lhs() for p in productions]
-    for nt in nonterminals:
-        unit_pairs[nt].add(nt)
-
-    # Induction
-    #TODO: keep doing this until no more are added?
-    for prod in _get_unit_productions(productions):
-        first = prod.lhs()
-        (second,) = prod.rhs()
-        As = unit_pairs[first]
-        for A in As:
-            unit_pairs[second].add(A)
-
-    NEW = set()
-    for (RHS, LHSides) in unit_pairs.iteritems():
-        for LHS in LHSides:
-            for prod in productions:
-                if prod.lhs() == RHS:
-                    if isinstance(prod.rhs()[0], basestring) or len(prod.rhs()) > 1:
-                        P = Production(LHS, prod.rhs())
-                        NEW.add(P)
-    return NEW
 
 def convert_to_cnf(input_grammar):
     """Return a new CNF grammar that accepts the same language as `grammar`."""
+    from nltk.grammar import ContextFreeGrammar, Nonterminal, Production
 
-    if input_grammar.is_chomsky_normal_form():
-        print >> sys.stderr, "Already CNF"
-        return deepcopy(input_grammar)
-
-    productions = deepcopy(input_grammar.productions())
-    letters = _letter_gen(_get_nonterminals(input_grammar)) 
-
-    # Replace RHS Terminals
-    productions = replace_rhs_terminals(productions, letters)
-    for prod in productions:
-        assert all([isinstance(token, Nonterminal) for token in prod.rhs() 
-                    if len(prod.rhs()) > 1])
-
-    # Binarize rules
-    productions = _binarize(productions, letters)
-    for prod in productions:
-        assert len(prod.rhs()) <= 2
-
-    # Remove empty productions
-    productions = _remove_empty_productions(productions, letters)
-    print "POST EMPTY"
-    print productions
-    print
-
-    # Remove unit productions
-    new_prods = _remove_unit_productions(productions, letters)
-
-    gram = ContextFreeGrammar(input_grammar.start(), new_prods)
-    return gram
-
-
+    start = input_grammar.start()
+    productions = convert_productions(
+        start, [(prod.lhs(), prod.rhs()) for prod in input_grammar.productions()],
+        Nonterminal)
+    return ContextFreeGrammar(start, [Production(lhs, rhs)
+                                      for (lhs, rhs) in productions])
 
 
 def convert(filename):
+    import nltk
+
     grammar = nltk.data.load('file:%s' % filename)
     print '*' * 10,
     print 'INITIALLY'
@@ -230,10 +247,5 @@ def convert(filename):
     print "CNF:", converted.is_chomsky_normal_form()
 
 
-def remove_all(the_list, *args):
-    for arg in args:
-        while arg in the_list:
-            the_list.remove(arg)
-
 if __name__ == '__main__':
     convert(sys.argv[1])
@@ -0,0 +1,286 @@
+"""Compact, integer-indexed form of a Chomsky Normal Form grammar.
+
+CFLGenerator compiles its grammar once into a CompiledGrammar so that the
+count table and the sampler work on small integers and flat lists instead of
+hashing nltk Nonterminal and Production objects in their inner loops.
+"""
+
+
+class CompiledGrammar(object):
+    """A CNF grammar whose symbols are interned to small integers.
+
+    Nonterminals are numbered 0 .. len(nonterminals) - 1 and terminals
+    0 .. len(terminals) - 1, in order of first appearance. Rules are grouped by
+    their LHS:
+
+        binary_rules[A]   == [(B, C), ...]  for each rule A -> B C
+        terminal_rules[A] == [t, ...]       for each rule A -> 't'
+
+    The binary rules are also numbered 0 .. num_rules - 1, grouped by LHS: the
+    rule binary_rules[A][j] has id rule_offsets[A] + j.
+
+    rule_weights[r] is the number of times the binary rule with id r occurs in
+    the grammar. It is 1 for every rule of a grammar built from productions,
+    whose duplicates are dropped, and can be larger after merge_equivalent()
+    turns several rules into one.
+    """
+
+    __slots__ = ('start', 'nonterminals', 'terminals', 'binary_rules',
+                 'terminal_rules', 'rule_offsets', 'num_rules', 'rule_weights',
+                 '_nonterminal_ids', '_terminal_ids', '_ids_by_symbol',
+                 '_rule_ids')
+
+    def __init__(self, start, productions):
+        """Intern the symbols of `productions` and group the rules by LHS.
+
+        `start` is the start nonterminal and `productions` is an iterable of
+        (lhs, rhs) pairs, e.g. [(p.lhs(), p.rhs()) for p in
+        grammar.productions()]. Every production must be in CNF. Terminals are
+        the strings on a RHS; anything else is treated as a nonterminal.
+        Duplicate productions are only counted once.
+        """
+        self.nonterminals = []
+        self.terminals = []
+        self.binary_rules = []
+        self.terminal_rules = []
+        self._nonterminal_ids = {}
+        self._terminal_ids = {}
+        self._ids_by_symbol = {}
+
+        self.start = self._intern_nonterminal(start)
+        seen = set()
+        for lhs, rhs in productions:
+            rhs = tuple(rhs)
+            if (lhs, rhs) in seen:
+                continue
+            seen.add((lhs, rhs))
+
+            A = self._intern_nonterminal(lhs)
+            if len(rhs) == 1 and isinstance(rhs[0], basestring):
+                self.terminal_rules[A].append(self._intern_terminal(rhs[0]))
+            elif len(rhs) == 2 and not any(isinstance(token, basestring)
+                                           for token in rhs):
+                B = self._intern_nonterminal(rhs[0])
+                C = self._intern_nonterminal(rhs[1])
+                self.binary_rules[A].append((B, C))
+            else:
+                raise ValueError('Production %s -> %s is not in CNF.'
+                                 % (lhs, ' '.join(map(repr, rhs))))
+        self._number_rules()
+        self.rule_weights = [1] * self.num_rules
+
+    def _number_rules(self):
+        """Give the binary rules their ids."""
+        self.rule_offsets = []
+        self._rule_ids = {}
+        offset = 0
+        for A, rules in enumerate(self.binary_rules):
+            self.rule_offsets.append(offset)
+            for j, (B, C) in enumerate(rules):
+                self._rule_ids[(A, B, C)] = offset + j
+            offset += len(rules)
+        self.num_rules = offset
+
+    @classmethod
+    def from_state(cls, state, make_nonterminal):
+        """Return a CompiledGrammar from the output of to_state().
+
+        `make_nonterminal` turns the symbol of a nonterminal back into a
+        nonterminal, e.g. nltk.grammar.Nonterminal.
+        """
+        self = cls.__new__(cls)
+        self.nonterminals = []
+        self.terminals = []
+        self.binary_rules = []
+        self.terminal_rules = []
+        self._nonterminal_ids = {}
+        self._terminal_ids = {}
+        self._ids_by_symbol = {}
+        for symbol in state['nonterminals']:
+            self._intern_nonterminal(make_nonterminal(symbol))
+        for terminal in state['terminals']:
+            self._intern_terminal(terminal)
+        self.start = state['start']
+        self.binary_rules = [[tuple(rule) for rule in rules]
+                             for rules in state['binary_rules']]
+        self.terminal_rules = [list(rules) for rules in state['terminal_rules']]
+        self._number_rules()
+        self.rule_weights = list(state['rule_weights'])
+        for symbol, ident in state['aliases'].iteritems():
+            self._nonterminal_ids[make_nonterminal(symbol)] = ident
+            self._ids_by_symbol[symbol] = ident
+        return self
+
+    def to_state(self):
+        """Return the grammar as a dict of ints, strings, lists and tuples.
+
+        Nonterminals are replaced by their symbols, so the dict can be stored
+        with marshal and turned back into a CompiledGrammar by from_state().
+        """
+        return {
+            'start': self.start,
+            'nonterminals': [_symbol(nonterm) for nonterm in self.nonterminals],
+            'terminals': list(self.terminals),
+            'binary_rules': [list(rules) for rules in self.binary_rules],
+            'terminal_rules': [list(rules) for rules in self.terminal_rules],
+            'rule_weights': list(self.rule_weights),
+            'aliases': dict((symbol, ident) for (symbol, ident)
+                            in self._ids_by_symbol.iteritems()
+                            if _symbol(self.nonterminals[ident]) != symbol),
+        }
+
+    def productions(self):
+        """Return the rules as a list of (lhs, rhs) pairs of the original
+        nonterminals and terminals, each rule once whatever its weight."""
+        productions = []
+        for A, nonterm in enumerate(self.nonterminals):
+            for t in self.terminal_rules[A]:
+                productions.append((nonterm, (self.terminals[t],)))
+            for (B, C) in self.binary_rules[A]:
+                productions.append((nonterm, (self.nonterminals[B],
+                                              self.nonterminals[C])))
+        return productions
+
+    def __len__(self):
+        """Return the number of nonterminals."""
+        return len(self.nonterminals)
+
+    def nonterminal_id(self, nonterm):
+        """Return the integer id of `nonterm`, a Nonterminal or its symbol.
+
+        Raise KeyError if `nonterm` isn't in the grammar.
+        """
+        if isinstance(nonterm, basestring):
+            return self._ids_by_symbol[nonterm]
+        return self._ids_by_symbol[_symbol(nonterm)]
+
+    def merge_equivalent(self):
+        """Return a copy of the grammar with its equivalent nonterminals
+        merged into one.
+
+        Two nonterminals are equivalent if they have the same terminal rules
+        and, once equivalent nonterminals are identified, the same binary
+        rules. They then derive every string in the same number of ways, so
+        merging them changes no counts. The equivalence is found like the
+        states of a minimal DFA (Moore's algorithm): start from the classes of
+        nonterminals with the same terminal rules and split classes by the
+        rules of their members over the current classes until nothing changes.
+
+        The binary rules that become duplicates are kept once, with their
+        weights added. The merged nonterminals stay known to nonterminal_id()
+        by their symbols, as aliases of the one that is kept.
+        """
+        size = len(self.nonterminals)
+        classes = _numbering([tuple(sorted(rules))
+                              for rules in self.terminal_rules])
+        while True:
+            signatures = []
+            for A in range(size):
+                weights = {}
+                for rule, (B, C) in enumerate(self.binary_rules[A],
+                                              self.rule_offsets[A]):
+                    key = (classes[B], classes[C])
+                    weights[key] = weights.get(key, 0) + self.rule_weights[rule]
+                signatures.append((classes[A], tuple(sorted(weights.items()))))
+            refined = _numbering(signatures)
+            if max(refined + [-1]) == max(classes + [-1]):
+                break
+            classes = refined
+
+        # The first member of each class stands for it. Classes are numbered
+        # in order of their first member, so the start symbol's class is
+        # numbered like the start symbol if nothing before it was merged.
+        merged = CompiledGrammar.__new__(CompiledGrammar)
+        merged.terminals = list(self.terminals)
+        merged._terminal_ids = dict(self._terminal_ids)
+        merged.nonterminals = []
+        merged.binary_rules = []
+        merged.terminal_rules = []
+        merged.rule_weights = []
+        merged._nonterminal_ids = {}
+        merged._ids_by_symbol = {}
+        for A, nonterm in enumerate(self.nonterminals):
+            ident = classes[A]
+            if ident == len(merged.nonterminals):
+                merged.nonterminals.append(nonterm)
+                merged.terminal_rules.append(list(self.terminal_rules[A]))
+                rules, weights, positions = [], [], {}
+                for rule, (B, C) in enumerate(self.binary_rules[A],
+                                              self.rule_offsets[A]):
+                    key = (classes[B], classes[C])
+                    if key in positions:
+                        weights[positions[key]] += self.rule_weights[rule]
+                    else:
+                        positions[key] = len(rules)
+                        rules.append(key)
+                        weights.append(self.rule_weights[rule])
+                merged.binary_rules.append(rules)
+                merged.rule_weights.extend(weights)
+            merged._nonterminal_ids[nonterm] = ident
+        for symbol, A in self._ids_by_symbol.iteritems():
+            merged._ids_by_symbol[symbol] = classes[A]
+        merged.start = classes[self.start]
+        merged._number_rules()
+        return merged
+
+    def terminal_id(self, terminal):
+        """Return the integer id of `terminal`.
+
+        Raise KeyError if `terminal` isn't in the grammar.
+        """
+        return self._terminal_ids[terminal]
+
+    def rule_id(self, A, B, C):
+        """Return the id of the binary rule A -> B C (nonterminal ids).
+
+        Raise KeyError if the grammar has no such rule.
+        """
+        return self._rule_ids[(A, B, C)]
+
+    def _intern_nonterminal(self, nonterm):
+        try:
+            return self._nonterminal_ids[nonterm]
+        except KeyError:
+            ident = len(self.nonterminals)
+            self._nonterminal_ids[nonterm] = ident
+            self._ids_by_symbol[_symbol(nonterm)] = ident
+            self.nonterminals.append(nonterm)
+            self.binary_rules.append([])
+            self.terminal_rules.append([])
+            return ident
+
+    def _intern_terminal(self, terminal):
+        try:
+            return self._terminal_ids[terminal]
+        except KeyError:
+            ident = len(self.terminals)
+            self._terminal_ids[terminal] = ident
+            self.terminals.append(terminal)
+            return ident
+
+
+def is_chomsky_normal_form(productions):
+    """Return whether every (lhs, rhs) pair in `productions` is in CNF."""
+    for lhs, rhs in productions:
+        if len(rhs) == 1 and isinstance(rhs[0], basestring):
+            continue
+        if len(rhs) == 2 and not any(isinstance(token, basestring)
+                                     for token in rhs):
+            continue
+        return False
+    return True
+
+
+def _numbering(keys):
+    """Return a list that numbers the distinct `keys` 0, 1, ... in order of
+    first appearance."""
+    numbers = {}
+    return [numbers.setdefault(key, len(numbers)) for key in keys]
+
+
+def _symbol(nonterm):
+    """Return the symbol of an nltk Nonterminal (or of anything like one)."""
+    try:
+        return nonterm.symbol()
+    except AttributeError:
+        return nonterm
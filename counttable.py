@@ -0,0 +1,529 @@
+"""Tables of derivation counts for the nonterminals of a compiled grammar.
+
+A count table holds, for every nonterminal A of a CompiledGrammar and every
+length L up to the table's length, the number of derivations of strings of
+length L from A. `rows[A][L]` is that number (`rows[A][0]` is unused).
+`rule_rows[r][L]` is the same number for the RHS of the binary rule with id r.
+A rule with weight w (see CompiledGrammar.rule_weights) adds w times its
+rule_rows count to the row of its LHS.
+
+Two backends compute the same exact counts:
+    CountTable       -- pure Python, one rule and split point at a time.
+    NumpyCountTable  -- computes the row for each new length as one batched
+                        convolution over the whole rule set with numpy. It
+                        works on int64 while the counts are small enough and
+                        on object arrays of Python ints once they aren't.
+
+A third one approximates them with floats, for lengths where exact counts
+have tens of thousands of bits:
+    ApproximateCountTable -- see its docstring for the error bound.
+
+The tables have an attribute `exact` that tells them apart, and one
+`max_bits` with the number of bits of their largest count, which they keep
+up to date a row at a time.
+
+numpy is only imported when a table that can use it is made, since importing
+it takes longer than a whole short run without it. The default backend (see
+make_count_table and extend_count_table) starts with a CountTable and moves
+to numpy only for an extension that is long enough to pay for the import.
+"""
+
+from array import array
+from math import frexp, ldexp, log
+from operator import mul
+
+# The numpy module once _import_numpy() has found it, and None before that or
+# if it isn't installed.
+numpy = None
+_numpy_tried = False
+
+# The default backend moves a table to numpy for an extension that takes at
+# least this many products, if they start out small enough for int64. numpy
+# is about 8 times as fast as Python on int64, and no faster on big counts,
+# so below this the time saved doesn't make up for the import (about 0.1 s).
+NUMPY_MIN_MULTIPLIES = 2 * 10 ** 6
+
+
+def _import_numpy():
+    """Import numpy the first time this is called and return it, or None if
+    it isn't installed."""
+    global numpy, _numpy_tried
+    if not _numpy_tried:
+        _numpy_tried = True
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+    return numpy
+
+
+def have_numpy():
+    """Return whether numpy is installed, importing it if it is."""
+    return _import_numpy() is not None
+
+
+class CountTable(object):
+    """Derivation counts computed with plain Python lists."""
+
+    exact = True
+
+    def __init__(self, compiled):
+        """Initialize the table for `compiled` with the counts for length 1."""
+        self.compiled = compiled
+        self.length = 1
+        self.rows = [[None, len(terminals)]
+                     for terminals in compiled.terminal_rules]
+        self.rule_rows = [[None, 0] for i in range(compiled.num_rules)]
+        self.max_bits = max([0] + [row[1] for row in self.rows]).bit_length()
+
+    @classmethod
+    def restore(cls, compiled, length, rows, rule_rows):
+        """Return a table for `compiled` holding the output of snapshot()."""
+        self = cls(compiled)
+        self.length = length
+        self.rows = [list(row) for row in rows]
+        self.rule_rows = [list(row) for row in rule_rows]
+        self.max_bits = _max_bits(rows)
+        return self
+
+    def snapshot(self):
+        """Return (length, rows, rule rows) with the rows as lists of ints."""
+        return self.length, self.rows, self.rule_rows
+
+    def extend(self, new_length):
+        """Extend the table to cover strings of length `new_length`."""
+        counts = self.rows
+        diff = new_length - self.length
+        if diff <= 0:
+            return
+        rule_counts = self.rule_rows
+        for row in counts:
+            row.extend([0] * diff)
+        for row in rule_counts:
+            row.extend([0] * diff)
+
+        binary_rules = self.compiled.binary_rules
+        rule_offsets = self.compiled.rule_offsets
+        weights = self.compiled.rule_weights
+        for L in range(self.length + 1, new_length + 1):
+            top = 0
+            for nonterm, rules in enumerate(binary_rules):
+                # Handle rules of form A -> B C. Increment the count of strings
+                # of length L derivable from A by the number of ways that B and
+                # C can combine to form a string of length L.
+                total = 0
+                for rule, (B, C) in enumerate(rules, rule_offsets[nonterm]):
+                    left = counts[B]
+                    right = counts[C]
+                    by_rule = 0
+                    for k in range(1, L):
+                        by_rule += left[k] * right[L - k]
+                    rule_counts[rule][L] = by_rule
+                    total += weights[rule] * by_rule
+                counts[nonterm][L] = total
+                if total > top:
+                    top = total
+            self.max_bits = max(self.max_bits, top.bit_length())
+        self.length = new_length
+
+
+class NumpyCountTable(object):
+    """Derivation counts computed with batched numpy convolutions.
+
+    For a new length L the contribution of every rule A -> B C is the dot
+    product of the row of B over lengths 1 .. L-1 with the reversed row of C.
+    All rules are done at once by gathering those slices into two
+    (rules x L-1) blocks, multiplying them elementwise and summing each row.
+    The rule totals, times the rule weights, are then summed per LHS with
+    numpy.add.reduceat.
+    """
+
+    exact = True
+
+    def __init__(self, compiled):
+        """Initialize the table for `compiled` with the counts for length 1."""
+        if _import_numpy() is None:
+            raise ImportError('NumpyCountTable requires numpy.')
+        self.compiled = compiled
+        self.length = 1
+
+        # Flatten the rules, which are already grouped by LHS. `_starts` holds
+        # the index of the first rule of each nonterminal in `_lhs` that has
+        # any rules, for reduceat.
+        lhs, left, right = [], [], []
+        for nonterm, rules in enumerate(compiled.binary_rules):
+            for (B, C) in rules:
+                lhs.append(nonterm)
+                left.append(B)
+                right.append(C)
+        self._lhs = numpy.array(lhs, dtype=numpy.intp)
+        self._left = numpy.array(left, dtype=numpy.intp)
+        self._right = numpy.array(right, dtype=numpy.intp)
+        self._starts = numpy.flatnonzero(numpy.r_[True, self._lhs[1:] !=
+                                                  self._lhs[:-1]]) \
+            if lhs else numpy.array([], dtype=numpy.intp)
+        self._targets = self._lhs[self._starts]
+        self._weights = numpy.array(compiled.rule_weights, dtype=object)
+        self._fast_weights = numpy.array(compiled.rule_weights,
+                                         dtype=numpy.int64)
+
+        # `_exact` always holds the counts as Python ints. `_fast` mirrors it
+        # as int64 for as long as every product and sum is guaranteed to fit,
+        # and is dropped for good after that.
+        size = len(compiled)
+        terminal_counts = [len(terminals)
+                           for terminals in compiled.terminal_rules]
+        self._exact = numpy.zeros((size, 2), dtype=object)
+        self._exact[:, 0] = None
+        self._exact[:, 1] = terminal_counts
+        self._fast = numpy.zeros((size, 2), dtype=numpy.int64)
+        self._fast[:, 1] = terminal_counts
+        self._rule_exact = numpy.zeros((compiled.num_rules, 2), dtype=object)
+        self._rule_exact[:, 0] = None
+        self.max_bits = max(terminal_counts + [0]).bit_length()
+
+    @classmethod
+    def restore(cls, compiled, length, rows, rule_rows):
+        """Return a table for `compiled` holding the output of snapshot()."""
+        self = cls(compiled)
+        self._exact = numpy.array(rows, dtype=object).reshape(
+            (len(compiled), length + 1))
+        self._rule_exact = numpy.array(rule_rows, dtype=object).reshape(
+            (compiled.num_rules, length + 1))
+        self.max_bits = _max_bits(rows)
+        self.length = length
+        if self._fits(length + 1):
+            self._fast = numpy.zeros(self._exact.shape, dtype=numpy.int64)
+            self._fast[:, 1:] = self._exact[:, 1:]
+        else:
+            self._fast = None
+        return self
+
+    def snapshot(self):
+        """Return (length, rows, rule rows) with the rows as lists of ints."""
+        return self.length, self.rows.tolist(), self.rule_rows.tolist()
+
+    @property
+    def rows(self):
+        """Return the counts as a (nonterminals x length + 1) object array."""
+        return self._exact[:, :self.length + 1]
+
+    @property
+    def rule_rows(self):
+        """Return the rule counts as a (rules x length + 1) object array."""
+        return self._rule_exact[:, :self.length + 1]
+
+    def extend(self, new_length):
+        """Extend the table to cover strings of length `new_length`."""
+        if new_length <= self.length:
+            return
+        self._reserve(new_length + 1)
+        for L in range(self.length + 1, new_length + 1):
+            if self._fast is not None and not self._fits(L):
+                self._fast = None
+            if self._fast is not None:
+                row, by_rule = self._convolve(self._fast, L)
+                self._fast[:, L] = row
+                self._exact[:, L] = row.tolist()
+                self._rule_exact[:, L] = by_rule.tolist()
+            else:
+                row, by_rule = self._convolve(self._exact, L)
+                self._exact[:, L] = row
+                self._rule_exact[:, L] = by_rule
+            self.max_bits = max(self.max_bits,
+                                 int(max(row.max(), 0)).bit_length())
+            self.length = L
+
+    def _convolve(self, matrix, L):
+        """Return the counts for length L of every nonterminal and of every
+        rule as a pair of arrays."""
+        row = numpy.zeros(matrix.shape[0], dtype=matrix.dtype)
+        if not len(self._lhs):
+            return row, numpy.zeros(0, dtype=matrix.dtype)
+        left = matrix[self._left, 1:L]
+        right = matrix[self._right, L - 1:0:-1]
+        by_rule = (left * right).sum(axis=1)
+        if matrix.dtype == object:
+            weighted = by_rule * self._weights
+        else:
+            weighted = by_rule * self._fast_weights
+        row[self._targets] = numpy.add.reduceat(weighted, self._starts)
+        return row, by_rule
+
+    def _fits(self, L):
+        """Return whether the row for length L can be computed in int64."""
+        return _fits_int64(self.compiled, self.max_bits, L)
+
+    def _reserve(self, columns):
+        """Grow the storage so that it holds at least `columns` columns."""
+        capacity = self._exact.shape[1]
+        if columns <= capacity:
+            return
+        columns = max(columns, 2 * capacity)
+        extra = columns - capacity
+        self._exact = numpy.hstack([self._exact, numpy.zeros(
+            (self._exact.shape[0], extra), dtype=object)])
+        self._rule_exact = numpy.hstack([self._rule_exact, numpy.zeros(
+            (self._rule_exact.shape[0], extra), dtype=object)])
+        if self._fast is not None:
+            self._fast = numpy.hstack([self._fast, numpy.zeros(
+                (self._fast.shape[0], extra), dtype=numpy.int64)])
+
+
+class ApproximateCountTable(object):
+    """Derivation counts kept as float64 numbers scaled by a power of two.
+
+    rows[A][L] is count(A, L) / 2 ** (scale * L) for a real number `scale`
+    that is the same for every length, so the product of the rows of B at k
+    and of C at L - k is scaled like the row of A at L, and the sampler can
+    use the rows as it uses exact counts. `scale` follows the growth rate of
+    the counts: when a new row gets further than 2 ** +-SCALE_LIMIT from 1,
+    it is changed so that the row is close to 1 again and the table is
+    rescaled. count() gives back an approximate integer count.
+
+    Memory is one float per nonterminal (and rule) and length. The rows are
+    numpy arrays if numpy can be imported and arrays of doubles otherwise.
+    Each new row takes a dot product per rule, so the time is still
+    quadratic in the length, but without any big integer arithmetic.
+
+    Error bound: with u = 2 ** -53 and R the largest number of binary rules of
+    a nonterminal, each row entry for length L is within a relative error of
+    about R * L**2 * u of the scaled exact count (by induction on L:
+    delta(L) <= max_k (delta(k) + delta(L - k)) + (R * (L - 1) + 2) * u),
+    plus u per rescaling. The sampler's choice at each node of a derivation
+    divides terms by their recomputed sum, so the rows of the children cancel
+    as they do with exact counts, and every derivation of length n is drawn
+    with a probability within a factor of about 1 +- 2 * R * n**2 * u of
+    1 / count(S, n). That is 6e-6 for R = 10 and n = 50000. Counts smaller
+    than about 2 ** -700 times the largest count of the same length become
+    0, and their derivations are never drawn.
+    """
+
+    exact = False
+
+    # The rows are kept between 2 ** -SCALE_LIMIT and 2 ** SCALE_LIMIT, so
+    # that products of two of them, summed, stay far from overflow.
+    SCALE_LIMIT = 256
+
+    def __init__(self, compiled):
+        """Initialize the table for `compiled` with the counts for length 1."""
+        self.compiled = compiled
+        self.length = 1
+        self.scale = 0.0
+        self._weights = [float(weight) for weight in compiled.rule_weights]
+        self._rules = []
+        for nonterm, rules in enumerate(compiled.binary_rules):
+            for rule, (B, C) in enumerate(rules,
+                                          compiled.rule_offsets[nonterm]):
+                self._rules.append((rule, nonterm, B, C))
+
+        terminal_counts = [float(len(terminals))
+                           for terminals in compiled.terminal_rules]
+        self.max_bits = int(max(terminal_counts + [0.0])).bit_length()
+        if _import_numpy() is not None:
+            self._matrix = numpy.zeros((len(compiled), 2))
+            self._matrix[:, 1] = terminal_counts
+            self._rule_matrix = numpy.zeros((compiled.num_rules, 2))
+            # The rows reversed, so that the dot product for a new length
+            # reads contiguous memory (see _extend_numpy).
+            self._reversed = self._matrix[:, ::-1].copy()
+        else:
+            self._rows = [array('d', [0.0, count])
+                          for count in terminal_counts]
+            self._rule_rows = [array('d', [0.0, 0.0])
+                               for i in range(compiled.num_rules)]
+
+    @property
+    def rows(self):
+        if numpy is not None:
+            return self._matrix[:, :self.length + 1]
+        return self._rows
+
+    @property
+    def rule_rows(self):
+        if numpy is not None:
+            return self._rule_matrix[:, :self.length + 1]
+        return self._rule_rows
+
+    def count(self, value, length):
+        """Return the integer closest to the count whose scaled value at
+        length `length` is `value`, e.g. count(rows[A][L], L)."""
+        if not value:
+            return 0
+        mantissa, exponent = frexp(value * 2 ** (self.scale * length % 1))
+        exponent += int(self.scale * length // 1) - 53
+        mantissa = int(ldexp(mantissa, 53))
+        if exponent >= 0:
+            return mantissa << exponent
+        return (mantissa + (1 << (-exponent - 1))) >> -exponent
+
+    def log_count(self, value, length):
+        """Return the natural log of the count whose scaled value at length
+        `length` is `value` (-inf for 0)."""
+        if not value:
+            return float('-inf')
+        return log(value) + self.scale * length * log(2)
+
+    def extend(self, new_length):
+        """Extend the table to cover strings of length `new_length`."""
+        if new_length <= self.length:
+            return
+        if numpy is not None:
+            self._extend_numpy(new_length)
+        else:
+            self._extend_python(new_length)
+
+    def _extend_python(self, new_length):
+        diff = new_length - self.length
+        for row in self._rows:
+            row.extend([0.0] * diff)
+        for row in self._rule_rows:
+            row.extend([0.0] * diff)
+
+        rows, rule_rows, weights = self._rows, self._rule_rows, self._weights
+        for L in range(self.length + 1, new_length + 1):
+            for (rule, nonterm, B, C) in self._rules:
+                by_rule = sum(map(mul, rows[B][1:L], rows[C][L - 1:0:-1]))
+                rule_rows[rule][L] = by_rule
+                rows[nonterm][L] += weights[rule] * by_rule
+            self.length = L
+            self._add_row(max(row[L] for row in rows), L)
+
+    def _extend_numpy(self, new_length):
+        self._reserve(new_length + 1)
+        matrix, rule_matrix = self._matrix, self._rule_matrix
+        capacity = matrix.shape[1]
+        weights = self._weights
+        for L in range(self.length + 1, new_length + 1):
+            # Column c of _reversed holds column capacity - 1 - c of
+            # _matrix, so the counts of C for lengths L - 1 .. 1 are the
+            # columns capacity - L .. capacity - 2 of it.
+            reversed_ = self._reversed
+            row = numpy.zeros(matrix.shape[0])
+            for (rule, nonterm, B, C) in self._rules:
+                by_rule = numpy.dot(matrix[B, 1:L],
+                                    reversed_[C, capacity - L:capacity - 1])
+                rule_matrix[rule, L] = by_rule
+                row[nonterm] += weights[rule] * by_rule
+            matrix[:, L] = row
+            self._reversed[:, capacity - 1 - L] = row
+            self.length = L
+            self._add_row(row.max(), L)
+
+    def _reserve(self, columns):
+        """Grow the storage so that it holds at least `columns` columns."""
+        capacity = self._matrix.shape[1]
+        if columns <= capacity:
+            return
+        columns = max(columns, 2 * capacity)
+        extra = columns - capacity
+        self._matrix = numpy.hstack([self._matrix,
+                                     numpy.zeros((len(self._matrix), extra))])
+        self._rule_matrix = numpy.hstack([
+            self._rule_matrix,
+            numpy.zeros((len(self._rule_matrix), extra))])
+        self._reversed = self._matrix[:, ::-1].copy()
+
+    def _add_row(self, top, length):
+        """Update max_bits and the scale for the new row for `length`, whose
+        largest value is `top`."""
+        if top:
+            self.max_bits = max(self.max_bits,
+                                int(self.log_count(top, length) / log(2)) + 1)
+        self._rescale(top, length)
+
+    def _rescale(self, top, length):
+        """Change the scale so that `top`, the largest value of the row for
+        `length`, becomes about 1, if it is too far from 1."""
+        if not top:
+            return
+        exponent = frexp(top)[1]
+        if abs(exponent) <= self.SCALE_LIMIT:
+            return
+        shift = float(exponent) / length
+        self.scale += shift
+        if numpy is not None:
+            factors = numpy.exp2(-shift * numpy.arange(self._matrix.shape[1]))
+            factors[self.length + 1:] = 0
+            self._matrix *= factors
+            self._rule_matrix *= factors
+            self._reversed = self._matrix[:, ::-1].copy()
+        else:
+            factors = [2 ** (-shift * L) for L in range(self.length + 1)]
+            for row in self._rows + self._rule_rows:
+                for L in range(1, self.length + 1):
+                    row[L] *= factors[L]
+
+
+BACKENDS = {
+    'python': CountTable,
+    'numpy': NumpyCountTable,
+    'approximate': ApproximateCountTable,
+}
+
+
+def make_count_table(compiled, backend=None, snapshot=None):
+    """Return a count table for `compiled` using the named `backend`.
+
+    `backend` is a key of BACKENDS. If it is None, the table is a CountTable,
+    which extend_count_table() may replace with a NumpyCountTable later. If
+    `snapshot` is given, it is the output of the snapshot() method of a table
+    for the same grammar (from any backend) and the new table starts with its
+    counts. Tables that aren't exact can't be restored, and start from
+    scratch.
+    """
+    if backend is None:
+        backend = 'python'
+    try:
+        table_class = BACKENDS[backend]
+    except KeyError:
+        raise ValueError('Unknown count table backend %r.' % (backend,))
+    if snapshot is not None and table_class.exact:
+        return table_class.restore(compiled, *snapshot)
+    return table_class(compiled)
+
+
+def extend_count_table(table, new_length, backend=None):
+    """Extend `table`, made by make_count_table() with `backend`, to cover
+    strings of length `new_length`, and return the table that holds the
+    counts.
+
+    That is `table` itself, except with the default backend when numpy is
+    installed and the extension takes at least NUMPY_MIN_MULTIPLIES products
+    that fit in int64 at first. The counts are then moved to a new
+    NumpyCountTable, which is extended instead.
+    """
+    if backend is None and isinstance(table, CountTable) and \
+            _numpy_pays_off(table, new_length) and have_numpy():
+        table = NumpyCountTable.restore(table.compiled, *table.snapshot())
+    table.extend(new_length)
+    return table
+
+
+def _numpy_pays_off(table, new_length):
+    """Return whether extending the CountTable `table` to `new_length` is
+    worth moving it to numpy (see NUMPY_MIN_MULTIPLIES)."""
+    old_length = table.length
+    rules = table.compiled.num_rules
+    multiplies = rules * (new_length * (new_length - 1) -
+                          old_length * (old_length - 1)) // 2
+    if multiplies < NUMPY_MIN_MULTIPLIES:
+        return False
+    return _fits_int64(table.compiled, table.max_bits, old_length + 1)
+
+
+def _max_bits(rows):
+    """Return the number of bits of the largest count in `rows`."""
+    return max([0] + [int(count).bit_length()
+                      for row in rows for count in row[1:]])
+
+
+def _fits_int64(compiled, max_bits, L):
+    """Return whether NumpyCountTable can compute the row for length L of
+    `compiled` in int64 when no count has more than `max_bits` bits."""
+    max_rules = max([len(rules) for rules in compiled.binary_rules] + [1])
+    weight_bits = max(compiled.rule_weights + [1]).bit_length()
+    bits = (2 * max_bits + (L - 1).bit_length() + max_rules.bit_length() +
+            weight_bits)
+    return bits < 63
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+"""CYK recognition of strings with the CNF grammar of a CFLGenerator.
+
+    recognizer = Recognizer(generator.compiled)
+    recognizer.recognize(['a', 'b'])
+    recognizer.recognize_many(strings)
+
+recognize() keeps each cell of the chart as an integer whose bit A is set if
+the nonterminal with id A derives the substring of the cell. The binary rules
+are grouped by their right child C and then by their left child B, with the
+LHSs of the rules "A -> B C" for each pair as one bitmask, so combining two
+cells takes a few bitwise operations for every nonterminal in the right cell.
+
+recognize_many() works on many strings of the same length at once, sliced the
+other way: a cell maps each nonterminal to an integer whose bit j is set if
+the nonterminal derives the substring of the cell in string j. Then the
+bitwise operations for a rule do the work for all of the strings together.
+"""
+
+from optparse import OptionParser
+import sys
+
+
+class Recognizer(object):
+    """Membership test for the language of a CompiledGrammar."""
+
+    def __init__(self, compiled):
+        self.compiled = compiled
+        self.start = compiled.start
+
+        # by_terminal[t] is the mask of the nonterminals with a rule A -> t
+        # and by_terminal_ids[t] the list of their ids.
+        self.by_terminal = {}
+        self.by_terminal_ids = {}
+        for A, terminals in enumerate(compiled.terminal_rules):
+            for t in terminals:
+                terminal = compiled.terminals[t]
+                self.by_terminal[terminal] = \
+                    self.by_terminal.get(terminal, 0) | (1 << A)
+                self.by_terminal_ids.setdefault(terminal, []).append(A)
+
+        # by_right[C] is a list of (mask of B, mask of every A with a rule
+        # A -> B C) pairs, one for each left child B. by_right_ids[C] is the
+        # same with the ids of B and A, for recognize_many().
+        by_right = {}
+        self.by_right_ids = {}
+        for A, rules in enumerate(compiled.binary_rules):
+            for (B, C) in rules:
+                lhs = by_right.setdefault(C, {})
+                lhs[B] = lhs.get(B, 0) | (1 << A)
+                self.by_right_ids.setdefault(C, []).append((B, A))
+        self.by_right = dict((C, [(1 << B, mask)
+                                  for (B, mask) in sorted(lhs.items())])
+                             for (C, lhs) in by_right.items())
+
+    def recognize(self, string):
+        """Return whether the sequence of terminals `string` is in the
+        language of the grammar."""
+        length = len(string)
+        if not length:
+            return False
+
+        # chart[l][i] is the set of nonterminals that derive the substring of
+        # length l starting at i.
+        chart = [None, []]
+        for terminal in string:
+            cell = self.by_terminal.get(terminal, 0)
+            if not cell:
+                return False
+            chart[1].append(cell)
+
+        by_right = self.by_right
+        for l in range(2, length + 1):
+            row = []
+            for i in range(length - l + 1):
+                cell = 0
+                for k in range(1, l):
+                    left = chart[k][i]
+                    right = chart[l - k][i + k]
+                    if not left or not right:
+                        continue
+                    # Go through the nonterminals C in the right cell.
+                    while right:
+                        low = right & -right
+                        right ^= low
+                        for (left_mask, lhs) in by_right.get(
+                                low.bit_length() - 1, ()):
+                            if left & left_mask:
+                                cell |= lhs
+                row.append(cell)
+            chart.append(row)
+        return bool(chart[length][0] >> self.start & 1)
+
+    def recognize_many(self, strings):
+        """Return a list of whether each of the sequences of terminals
+        `strings` is in the language of the grammar.
+
+        The strings are recognized together, a group of the same length at a
+        time.
+        """
+        strings = list(strings)
+        by_length = {}
+        for index, string_ in enumerate(strings):
+            by_length.setdefault(len(string_), []).append(index)
+
+        results = [False] * len(strings)
+        for length, indexes in by_length.iteritems():
+            if not length:
+                continue
+            accepted = self._recognize_batch([strings[index]
+                                              for index in indexes])
+            for j, index in enumerate(indexes):
+                results[index] = bool(accepted >> j & 1)
+        return results
+
+    def _recognize_batch(self, strings):
+        """Return the mask of the strings, all of the same length, that are
+        in the language: bit j is set if strings[j] is."""
+        length = len(strings[0])
+
+        # chart[l][i] maps each nonterminal to the mask of the strings in
+        # which it derives the substring of length l starting at i.
+        chart = [None, []]
+        for i in range(length):
+            cell = {}
+            for j, string_ in enumerate(strings):
+                for A in self.by_terminal_ids.get(string_[i], ()):
+                    cell[A] = cell.get(A, 0) | (1 << j)
+            chart[1].append(cell)
+
+        by_right_ids = self.by_right_ids
+        for l in range(2, length + 1):
+            row = []
+            for i in range(length - l + 1):
+                cell = {}
+                for k in range(1, l):
+                    left = chart[k][i]
+                    right = chart[l - k][i + k]
+                    if not left:
+                        continue
+                    for C, right_mask in right.iteritems():
+                        for (B, A) in by_right_ids.get(C, ()):
+                            both = left.get(B, 0) & right_mask
+                            if both:
+                                cell[A] = cell.get(A, 0) | both
+                row.append(cell)
+            chart.append(row)
+        return chart[length][0].get(self.start, 0)
+
+
+def main(argv):
+    """
+    python cyk.py gram.cfg < strings.txt
+
+    Print each line of the input with 'yes' or 'no' before it, depending on
+    whether it is in the language of the grammar.
+    """
+    from cfl import CFLGenerator
+    import diskcache
+
+    parser = OptionParser(usage='%prog [options] GRAMMAR')
+    parser.add_option('-s', '--separator', action='store', default=None,
+                      metavar='<SEPARATOR>',
+                      help='Separator between terminals. Without one, every '
+                           'character is a terminal.')
+    parser.add_option('--no-cache', action='store_const', dest='cache_dir',
+                      const=None, default=diskcache.DEFAULT_CACHE_DIR,
+                      help="Don't use the grammar cache.")
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('Exactly one grammar must be given.')
+
+    recognizer = Recognizer(CFLGenerator(args[0],
+                                         cache_dir=options.cache_dir).compiled)
+    lines = [line.rstrip('\n') for line in sys.stdin]
+    if options.separator is None:
+        strings = [list(line) for line in lines]
+    else:
+        strings = [line.split(options.separator) if line else []
+                   for line in lines]
+    for line, accepted in zip(lines, recognizer.recognize_many(strings)):
+        print '%s %s' % ('yes' if accepted else 'no', line)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
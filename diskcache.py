@@ -0,0 +1,76 @@
+"""On-disk cache of compiled CNF grammars and their count tables.
+
+Parsing a grammar, converting it to CNF and filling its count table are
+repeated by every short-lived process that uses the same grammar. The cache
+keeps the result for each grammar text in a file named after a hash of the
+text, holding a marshalled dict:
+
+    'grammar'  -- CompiledGrammar.to_state() of the CNF grammar
+    'snapshot' -- (length, rows, rule rows) from the count table's snapshot()
+
+Files are replaced atomically, so concurrent readers never see a partial
+file. A file that can't be read is treated as missing.
+"""
+
+import hashlib
+import marshal
+import os
+import tempfile
+
+# Bump when the layout of the files or the CNF conversion changes, so that
+# old files are no longer used.
+CACHE_FORMAT = 4
+
+# Where CFLGenerator's callers keep their cache unless told otherwise.
+DEFAULT_CACHE_DIR = os.environ.get(
+    'CFL_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'cfl'))
+
+
+def cache_path(cache_dir, source):
+    """Return the path of the cache file for the grammar text `source`."""
+    if isinstance(source, unicode):
+        source = source.encode('utf-8')
+    digest = hashlib.sha1('%d\n%s' % (CACHE_FORMAT, source)).hexdigest()
+    return os.path.join(cache_dir, digest + '.cfgcache')
+
+
+def load(cache_dir, source):
+    """Return the cached dict for the grammar text `source`, or None."""
+    try:
+        with open(cache_path(cache_dir, source), 'rb') as cache_file:
+            state = marshal.load(cache_file)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(state, dict) or state.get('format') != CACHE_FORMAT:
+        return None
+    return state
+
+
+def save(cache_dir, source, grammar_state, snapshot):
+    """Store the compiled grammar and count table snapshot for `source`.
+
+    Failing to write the cache isn't an error; the cache is only an
+    optimization.
+    """
+    state = {
+        'format': CACHE_FORMAT,
+        'grammar': grammar_state,
+        'snapshot': snapshot,
+    }
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    except (IOError, OSError):
+        return False
+    try:
+        with os.fdopen(fd, 'wb') as cache_file:
+            marshal.dump(state, cache_file)
+        os.rename(temp_path, cache_path(cache_dir, source))
+    except (IOError, OSError, ValueError):
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return False
+    return True
@@ -3,11 +3,11 @@
 
 import sys
 import cfl
-import cnf
+import diskcache
 
 
 
-non_cnf_grammar = cfl.parse_cfg("""
+GRAMMAR = """
 WORD -> SYLLABLE | WORD SYLL_BOUNDARY SYLLABLE
 SYLL_BOUNDARY -> ' '
 
@@ -36,12 +36,7 @@ FRICATIVE -> 'f' | 'v' | 'θ' | 'ð' | 's' | 'z' | 'ʃ' | 'ʒ'
 STOP -> 'p' | 'b' | 't' | 'd' | 'k' | 'g'
 AFFRICATE -> 'tʃ' | 'dʒ'
 
-""")
-
-grammar = cnf.convert_to_cnf(non_cnf_grammar)
-assert grammar.is_chomsky_normal_form()
-
-generator = cfl.CFLGenerator(grammar)
+"""
 
 def main(args):
     if args:
@@ -49,6 +44,9 @@ def main(args):
     else:
         num_phones = 50
 
+    # The CNF conversion and the counts are cached between runs.
+    generator = cfl.CFLGenerator(GRAMMAR, num_phones,
+                                 cache_dir=diskcache.DEFAULT_CACHE_DIR)
     print ''.join(generator.generate(num_phones))
 
 if __name__ == '__main__':
@@ -1,82 +1,185 @@
 
 """A collection of functions for transforming grammars.
 
+The functions work on (lhs, rhs) pairs, where the terminals are the strings
+and anything else is a nonterminal, so they work on nltk Productions as well
+as on the output of cfgparse.parse_grammar without importing nltk:
+
+    generating_symbols(productions)       -- nonterminals that derive a string
+    reachable_symbols(start, productions) -- nonterminals reachable from start
+    remove_nongenerating(productions)
+    remove_unreachable(start, productions)
+    remove_useless(start, productions)
+
+Each takes time linear in the total size of the productions.
+
 TODO:
   Is there a way to modify the grammar in place if I need to change the start
   state? I could access grammar._start. Ask StackOverflow question about refs.
 
   Maybe I should just return a new grammar. The class could keep track of the
-  Start symbol and the productions and then when get_grammar() is called, a 
+  Start symbol and the productions and then when get_grammar() is called, a
   grammar can be created at that point.
 """
 
-from copy import deepcopy
+from cnf import convert_productions
+
+
+def _is_terminal(token):
+    return isinstance(token, basestring)
+
+
+def generating_symbols(productions):
+    """Return the set of nonterminals that derive some string of terminals.
+
+    A nonterminal is generating if it is the LHS of a production whose RHS
+    nonterminals are all generating. Each production keeps the number of its
+    RHS nonterminals that aren't known to be generating yet, and only the
+    productions that a new generating nonterminal occurs in are updated.
+    """
+    productions = list(productions)
+    remaining = []
+    occurrences = {}
+    generating = set()
+    worklist = []
+    for index, (lhs, rhs) in enumerate(productions):
+        nonterminals = [token for token in rhs if not _is_terminal(token)]
+        remaining.append(len(nonterminals))
+        for token in nonterminals:
+            occurrences.setdefault(token, []).append(index)
+        if not nonterminals and lhs not in generating:
+            generating.add(lhs)
+            worklist.append(lhs)
+
+    while worklist:
+        nonterm = worklist.pop()
+        for index in occurrences.get(nonterm, ()):
+            remaining[index] -= 1
+            lhs = productions[index][0]
+            if not remaining[index] and lhs not in generating:
+                generating.add(lhs)
+                worklist.append(lhs)
+    return generating
+
+
+def reachable_symbols(start, productions):
+    """Return the set of nonterminals that occur in some sentential form
+    derived from `start`, including `start`."""
+    by_lhs = {}
+    for lhs, rhs in productions:
+        by_lhs.setdefault(lhs, []).append(rhs)
+
+    reachable = set([start])
+    stack = [start]
+    while stack:
+        for rhs in by_lhs.get(stack.pop(), ()):
+            for token in rhs:
+                if not _is_terminal(token) and token not in reachable:
+                    reachable.add(token)
+                    stack.append(token)
+    return reachable
+
+
+def remove_nongenerating(productions):
+    """Return the productions that only use generating nonterminals."""
+    productions = list(productions)
+    generating = generating_symbols(productions)
+    return [(lhs, rhs) for (lhs, rhs) in productions
+            if lhs in generating and
+            all(_is_terminal(token) or token in generating for token in rhs)]
+
+
+def remove_unreachable(start, productions):
+    """Return the productions whose LHS is reachable from `start`."""
+    productions = list(productions)
+    reachable = reachable_symbols(start, productions)
+    return [(lhs, rhs) for (lhs, rhs) in productions if lhs in reachable]
+
+
+def remove_useless(start, productions):
+    """Return the productions that occur in some derivation of a string of
+    terminals from `start`.
+
+    The nongenerating nonterminals have to be removed first: removing them can
+    make other nonterminals unreachable, but not the other way around. If
+    `start` itself is nongenerating, there are no productions left.
+    """
+    return remove_unreachable(start, remove_nongenerating(productions))
 
-from nltk.grammar import ContextFreeGrammar, Nonterminal
 
 def convert_to_chomsky_normal_form(grammar):
     grammar_trans = GrammarTransformations(grammar)
     grammar_trans.convert_to_cnf()
     return grammar_trans.get_grammar()
 
+
 class GrammarTransformations(object):
+    """The start symbol and productions of an nltk grammar, transformed in
+    place by the methods and turned back into a grammar by get_grammar()."""
+
     def __init__(self, grammar):
-        self.start = deepcopy(grammar.start())
-        self.productions = deepcopy(grammar.productions())
-        self._all_symbols = _get_all_symbols(self.productions)
-        self._letter_generator = _letter_generator(self.all_symbols)
+        self.start = grammar.start()
+        self.productions = list(grammar.productions())
 
     @property
     def all_symbols(self):
         """Return all symbols in `self.productions`."""
+        return self.nonterminals | self.terminals
+
     @property
     def nonterminals(self):
-        pass
+        return set([prod.lhs() for prod in self.productions] +
+                   [tok for prod in self.productions for tok in prod.rhs()
+                    if not _is_terminal(tok)])
 
     @property
     def terminals(self):
-        return [[tok for tok in prod] for prod in self.productions
-                 if isinstance(tok, Nonterminal)]
+        return set([tok for prod in self.productions for tok in prod.rhs()
+                    if _is_terminal(tok)])
 
     def get_grammar(self):
+        from nltk.grammar import ContextFreeGrammar
+
         return ContextFreeGrammar(self.start, self.productions)
 
     def convert_to_cnf(self):
-        if self.grammar.is_chomsky_normal_form():
-            return
-        self.replace_rhs_terminals()
-        self.convert_to_binary()
-        self.remove_empty_productions()
-        self.remove_unit_productions()
+        from nltk.grammar import Nonterminal, Production
 
+        if self.get_grammar().is_chomsky_normal_form():
+            return
+        self.productions = [Production(lhs, rhs) for (lhs, rhs) in
+                            convert_productions(self.start, self._pairs(),
+                                                Nonterminal)]
 
-    def replace_rhs_terminals(self): pass
-    def convert_to_binary(self): pass
-    def remove_empty_productions(self): pass
-    def remove_unit_productions(self): pass
-
+    def remove_unreachable(self):
+        self._keep(remove_unreachable(self.start, self._pairs()))
 
+    def remove_nongenerating(self):
+        self._keep(remove_nongenerating(self._pairs()))
 
-    # _symbols(self)  ???
-    def remove_unreachable(self): pass
-    def remove_nongenerating(self): pass
-    def remove_useless(self): pass
+    def remove_useless(self):
+        self._keep(remove_useless(self.start, self._pairs()))
 
     @property
-    def useless_symbols(self): pass
-    @property
-    def nongenerating_symbols(self): pass
-    @property
-    def nonreachable_symbols(self): pass
+    def useless_symbols(self):
+        useful = set(lhs for (lhs, rhs) in
+                     remove_useless(self.start, self._pairs()))
+        return self.nonterminals - useful
 
-#
-# Utility stuff
-#
-def letter_generator(letters_to_avoid=None):
-    assert False, "INCOMPLETE"
-
-def demo():
-    pass
+    @property
+    def nongenerating_symbols(self):
+        return self.nonterminals - generating_symbols(self._pairs())
 
-if __name__ == '__main__':
-    demo()
+    @property
+    def nonreachable_symbols(self):
+        return self.nonterminals - reachable_symbols(self.start,
+                                                     self._pairs())
+
+    def _pairs(self):
+        return [(prod.lhs(), prod.rhs()) for prod in self.productions]
+
+    def _keep(self, pairs):
+        """Keep the productions whose (lhs, rhs) pair is in `pairs`."""
+        pairs = set(pairs)
+        self.productions = [prod for prod in self.productions
+                            if (prod.lhs(), prod.rhs()) in pairs]
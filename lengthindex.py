@@ -0,0 +1,120 @@
+"""The lengths of the strings that each nonterminal of a CNF grammar derives.
+
+    index = LengthIndex(compiled)
+    index.feasible(A, n)        # does nonterminal id A derive a string of
+                                # length n?
+
+The set of lengths of the strings of a context free language is ultimately
+periodic (by Parikh's theorem it is semilinear): past some threshold t, n is
+in it if and only if n + p is. LengthIndex finds the sets of every
+nonterminal up to a bound as bitsets, and a threshold and period that all of
+them share, so that a length however large is looked up in constant time
+without counting any strings.
+
+The sets are the least solution of
+
+    L(A) = {1 if A has a terminal rule} | union of L(B) + L(C) for A -> B C
+
+where + adds every length of one set to every length of the other. They are
+computed up to the bound by a worklist that only adds the new lengths of a
+set to the other sets (semi-naive evaluation), with a bitset of the lengths
+shifted by each of them.
+
+A period p with threshold t that the sets show up to the bound is only used
+if 2t + 2p <= bound, which makes it certain: the sum of two sets that are
+periodic past t is periodic past 2t + p, so the periodic extensions of the
+sets satisfy the equations for every length if they do up to 2t + 2p, and
+then they are the sets, by induction on the length (the parts of a length are
+always shorter). If no period shows up, the bound is doubled, up to
+MAX_BOUND.
+"""
+
+# The first bound and the largest that LengthIndex tries.
+FIRST_BOUND = 64
+MAX_BOUND = 1 << 13
+
+
+def _add_sets(first, second):
+    """Return the bitset of the sums of a length in `first` and a length in
+    `second` (bitsets where bit n stands for length n)."""
+    total = 0
+    while first:
+        low = first & -first
+        first ^= low
+        total |= second << (low.bit_length() - 1)
+    return total
+
+
+def length_sets(compiled, bound):
+    """Return a list with the bitset of the lengths from 1 to `bound` of the
+    strings that each nonterminal of the CompiledGrammar `compiled` derives.
+    Bit n of a bitset is set if there is a string of length n."""
+    mask = (1 << (bound + 1)) - 1
+
+    # uses[B] lists an (A, C) pair for every rule A -> B C or A -> C B.
+    uses = {}
+    for A, rules in enumerate(compiled.binary_rules):
+        for (B, C) in rules:
+            uses.setdefault(B, []).append((A, C))
+            uses.setdefault(C, []).append((A, B))
+
+    sets = [2 if terminals else 0 for terminals in compiled.terminal_rules]
+    new = dict((A, lengths) for (A, lengths) in enumerate(sets) if lengths)
+    while new:
+        B, added = new.popitem()
+        for (A, C) in uses.get(B, ()):
+            lengths = _add_sets(added, sets[C]) & mask & ~sets[A]
+            if lengths:
+                sets[A] |= lengths
+                new[A] = new.get(A, 0) | lengths
+    return sets
+
+
+def find_period(sets, bound):
+    """Return the (threshold, period) with the smallest period that the
+    bitsets `sets` of lengths up to `bound` share, for which 2 * threshold +
+    2 * period <= bound, or None if there is none."""
+    for period in range(1, bound // 2 + 1):
+        # Bit n of differences is set if n and n + period differ in a set.
+        window = (1 << (bound - period + 1)) - 1
+        differences = 0
+        for lengths in sets:
+            differences |= (lengths ^ (lengths >> period)) & window
+        threshold = max(differences.bit_length(), 1)
+        if 2 * threshold + 2 * period <= bound:
+            return threshold, period
+    return None
+
+
+class LengthIndex(object):
+    """Which lengths the strings of each nonterminal of a CompiledGrammar can
+    have.
+
+    `sets` holds the bitsets of the lengths up to `bound`. `threshold` and
+    `period` are the shared period of the sets, or None if none was found up
+    to MAX_BOUND.
+    """
+
+    def __init__(self, compiled, max_bound=MAX_BOUND):
+        bound = min(FIRST_BOUND, max_bound)
+        while True:
+            sets = length_sets(compiled, bound)
+            found = find_period(sets, bound)
+            if found is not None or bound >= max_bound:
+                break
+            bound = min(2 * bound, max_bound)
+        self.bound = bound
+        self.sets = sets
+        self.threshold, self.period = found or (None, None)
+
+    def feasible(self, nonterm, length):
+        """Return whether the nonterminal with id `nonterm` derives a string
+        of length `length`, or None if that isn't known: when `length` is past
+        the bound and no period was found."""
+        if length < 1:
+            return False
+        if length > self.bound:
+            if self.period is None:
+                return None
+            length -= (length - self.threshold) // self.period * self.period
+        return bool(self.sets[nonterm] >> length & 1)
@@ -0,0 +1,53 @@
+"""A size-bounded least-recently-used cache."""
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """A mapping that evicts its least recently used entries to stay small.
+
+    Every entry is stored with a size (e.g. the length of a list it holds) and
+    the total size of the entries never exceeds `max_size`. An entry that is
+    bigger than `max_size` on its own is not stored at all.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Return the value for `key` and mark it as the most recently used."""
+        try:
+            entry = self._entries.pop(key)
+        except KeyError:
+            return default
+        self._entries[key] = entry
+        return entry[0]
+
+    def put(self, key, value, size=1):
+        """Store `value` under `key`, evicting old entries as needed."""
+        if key in self._entries:
+            self.size -= self._entries.pop(key)[1]
+        if size > self.max_size:
+            return
+        while self.size + size > self.max_size:
+            old_value, old_size = self._entries.popitem(last=False)[1]
+            self.size -= old_size
+        self._entries[key] = (value, size)
+        self.size += size
+
+    def values(self):
+        """Return a list of the values, least recently used first."""
+        return [value for (value, size) in self._entries.itervalues()]
+
+    def clear(self):
+        """Remove every entry."""
+        self._entries.clear()
+        self.size = 0
@@ -0,0 +1,118 @@
+"""
+Tests for the Boltzmann sampler.
+"""
+
+import random
+
+import nose
+
+from .. import cfl
+from ..boltzmann import BoltzmannSampler, GeneratingFunctions, \
+    SamplerFailure, _solve
+from ..counttable import CountTable
+
+
+def compile_grammar(text):
+    return cfl.CFLGenerator(text).compiled
+
+
+# Balanced strings of brackets, one derivation each.
+DYCK = """S -> '(' S ')' S | """
+
+
+def test_solve():
+    rows = [{0: 2.0, 1: -1.0}, {0: -1.0, 1: 2.0, 2: -1.0}, {1: -1.0, 2: 2.0}]
+    solution = _solve(rows, [1.0, 0.0, 1.0])
+    for value in solution:
+        assert abs(value - 1.0) < 1e-12
+
+
+def test_solve_not_m_matrix():
+    assert _solve([{0: 1.0, 1: -2.0}, {0: -2.0, 1: 1.0}], [1.0, 1.0]) is None
+
+
+def test_values_solve_system():
+    compiled = compile_grammar(DYCK)
+    functions = GeneratingFunctions(compiled)
+    x, values = functions.tune(30)
+    for new, old in zip(functions.evaluate(x, values), values):
+        assert abs(new - old) <= 1e-9 * new
+    assert abs(functions.expected_length(x, values) - 30) < 0.1
+
+
+def test_lengths_in_window():
+    sampler = BoltzmannSampler(compile_grammar(DYCK), 90, 110)
+    rng = random.Random(1)
+    for i in range(20):
+        string_, tries = sampler.sample(rng)
+        assert 90 <= len(string_) <= 110
+
+
+def test_uniform():
+    """The 14 strings of length 8 come up about equally often."""
+    compiled = compile_grammar(DYCK)
+    table = CountTable(compiled)
+    table.extend(8)
+    sampler = BoltzmannSampler(compiled, 8, 8)
+    rng = random.Random(3)
+    counts = {}
+    for i in range(2800):
+        string_ = tuple(sampler.sample(rng)[0])
+        counts[string_] = counts.get(string_, 0) + 1
+    assert len(counts) == table.rows[compiled.start][8] == 14
+    assert all(120 <= count <= 280 for count in counts.itervalues())
+
+
+def test_generate_approx():
+    generator = cfl.CFLGenerator(DYCK, seed=5)
+    for i in range(10):
+        assert 900 <= len(generator.generate_approx(1000)) <= 1100
+    stats = generator.stats()
+    assert stats['strings'] == 10 and stats['length'] == 1
+
+
+def test_samplers_are_bounded():
+    generator = cfl.CFLGenerator(DYCK, seed=1)
+    for length in range(10, 12 + 2 * cfl.SAMPLER_CACHE_SIZE, 2):
+        generator.generate_approx(length, 0)
+    assert len(generator._samplers) == cfl.SAMPLER_CACHE_SIZE
+
+
+@nose.tools.raises(cfl.GenerationFailure)
+def test_generate_approx_no_strings():
+    cfl.CFLGenerator(DYCK).generate_approx(5, 0.1)
+
+
+def check_window(text, length, tolerance, lengths):
+    generator = cfl.CFLGenerator(text, seed=1)
+    for i in range(20):
+        assert len(generator.generate_approx(length, tolerance)) in lengths
+
+
+def test_shortest_length():
+    """Windows at the shortest length of a grammar, where the expected
+    length can't be the middle of the window for any x > 0, and at the
+    longest length of a finite language."""
+    two_kinds = """S -> '(' S ')' S | '[' S ']' S | """
+    finite = """S -> A A | A A A A
+                A -> 'a' """
+    for text in (two_kinds, finite):
+        yield check_window, text, 2, 0, (2,)
+        yield check_window, text, 2, 0.5, (2,)
+    yield check_window, finite, 4, 0, (4,)
+    yield check_window, finite, 3, 0.4, (2, 4)
+
+
+def test_rejections():
+    """The rejections grow like sqrt(n) / tolerance (see boltzmann.py),
+    about 190 per string here."""
+    generator = cfl.CFLGenerator(DYCK, seed=1)
+    for i in range(20):
+        generator.generate_approx(1000, 0.1)
+    assert generator.stats()['rejected'] < 20 * 600
+
+
+@nose.tools.raises(SamplerFailure)
+def test_no_strings_in_window():
+    sampler = BoltzmannSampler(compile_grammar(DYCK), 5, 5)
+    sampler.sample(random.Random(1), max_tries=1000)
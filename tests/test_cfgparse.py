@@ -0,0 +1,50 @@
+"""
+Tests for the grammar reader that CFLGenerator uses instead of nltk.
+"""
+
+import nose
+
+from .. import cfgparse
+from ..cfgparse import Nonterminal
+
+
+def test_alternatives():
+    start, productions = cfgparse.parse_grammar("""
+        # Comments and blank lines are skipped.
+        S -> A B | 'c'
+
+        A -> 'a' | "b"
+        B ->
+    """)
+    S, A, B = Nonterminal('S'), Nonterminal('A'), Nonterminal('B')
+    assert start == S
+    assert productions == [(S, (A, B)), (S, ('c',)), (A, ('a',)),
+                           (A, ('b',)), (B, ())]
+
+
+def test_start():
+    start, productions = cfgparse.parse_grammar("%start B\nA -> B\nB -> 'b'")
+    assert start == Nonterminal('B')
+
+
+def test_same_nonterminals_as_nltk():
+    from nltk.grammar import parse_cfg
+
+    text = "S -> NP VP | 'x'\nNP -> 'the' N\nN -> 'dog'\nVP -> 'ran'"
+    grammar = parse_cfg(text)
+    start, productions = cfgparse.parse_grammar(text)
+    assert start.symbol() == grammar.start().symbol()
+    assert [(lhs.symbol(), [str(token) for token in rhs])
+            for (lhs, rhs) in productions] == \
+           [(p.lhs().symbol(), [str(token) for token in p.rhs()])
+            for p in grammar.productions()]
+
+
+@nose.tools.raises(ValueError)
+def test_bad_line():
+    cfgparse.parse_grammar("S -> 'a'\nS = 'b'")
+
+
+@nose.tools.raises(ValueError)
+def test_unterminated_quote():
+    cfgparse.parse_grammar("S -> 'a")
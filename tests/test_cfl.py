@@ -3,6 +3,13 @@
 Test various CFLGeneration methods.
 """
 
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+
 import nose
 
 from nltk.grammar import parse_cfg
@@ -31,3 +38,217 @@ class TestInit(object):
         
     def test_from_cfg(self):
         grammar = parse_cfg("""S -> 's' | A B\n A -> 'a'\n B -> 'b'""")
+
+
+class TestGenerate(object):
+    """Test the generation methods."""
+
+    def test_methods(self):
+        generator = cfl.CFLGenerator("""S -> A B\n A -> 'a'\n B -> 'b'""")
+        for method in cfl.GENERATION_METHODS:
+            assert generator.generate(2, method) == ['a', 'b']
+
+    @nose.tools.raises(ValueError)
+    def test_unknown_method(self):
+        generator = cfl.CFLGenerator("""S -> 'a'""")
+        generator.generate(1, 'no such method')
+
+    def test_without_cache(self):
+        generator = cfl.CFLGenerator("""S -> A B\n A -> 'a'\n B -> 'b'""",
+                                     cache_size=0)
+        assert generator.generate(2) == ['a', 'b']
+
+    def test_cache_size_counts_digits(self):
+        """The cache is bounded by bytes, so entries with long counts take
+        more of it."""
+        assert cfl._cdf_bytes([1, 2 ** 3000]) > 3 * cfl._cdf_bytes([1, 2])
+        generator = cfl.CFLGenerator("""S -> '(' S ')' S | """,
+                                     cache_size=50000)
+        generator.generate(600)
+        assert 0 < generator._cdf_cache.size <= 50000
+
+    def test_counts_past_float_range(self):
+        """Counts above 1e308 must not break the choice of rules and splits."""
+        generator = cfl.CFLGenerator("""S -> S S | 'a' | 'b'""", 700)
+        assert generator.count_by_nonterm('S', 700) > 10 ** 400
+        for method in cfl.GENERATION_METHODS:
+            assert len(generator.generate(700, method)) == 700
+
+    def test_deep_derivation(self):
+        """Right-recursive derivations deeper than the recursion limit."""
+        generator = cfl.CFLGenerator("""S -> A S | 'a'\n A -> 'a' | 'b'""")
+        for method in cfl.GENERATION_METHODS:
+            string_ = list(generator.generate_iter(2000, method))
+            assert len(string_) == 2000
+            assert string_[-1] == 'a'
+
+    @nose.tools.raises(cfl.GenerationFailure)
+    def test_iter_fails_early(self):
+        generator = cfl.CFLGenerator("""S -> A B\n A -> 'a'\n B -> 'b'""")
+        generator.generate_iter(3)
+
+
+class TestRank(object):
+    """Test the numbering of the derivations of each length."""
+
+    def setup(self):
+        # A and C are merged into one nonterminal, so S -> A B and S -> C B
+        # become one rule with two copies.
+        self.generator = cfl.CFLGenerator("""S -> A B | C B | S S
+                                             A -> 'a' | 'c'
+                                             C -> 'a' | 'c'
+                                             B -> 'b' """, 6)
+
+    def test_enumerates_every_derivation(self):
+        generator = cfl.CFLGenerator("""S -> '(' S ')' S | 'x' """, 9)
+        for length in range(1, 10):
+            count = generator.count_by_nonterm('S', length)
+            strings = set(''.join(generator.unrank(length, i))
+                          for i in range(count))
+            assert len(strings) == count
+
+    def test_rank_inverts_unrank(self):
+        for length in range(1, 7):
+            count = self.generator.count_by_nonterm('S', length)
+            for i in range(count):
+                tree = self.generator.unrank_tree(length, i)
+                assert self.generator.rank(tree) == i
+
+    @nose.tools.raises(ValueError)
+    def test_needs_exact_counts(self):
+        generator = cfl.CFLGenerator("""S -> S S | 'a' """, 6,
+                                     backend='approximate')
+        generator.unrank(5, 0)
+
+    def test_copies(self):
+        trees = [self.generator.unrank_tree(2, i) for i in range(4)]
+        assert len(set(trees)) == 4
+        assert set(len(tree) for tree in trees) == set([4])
+
+    @nose.tools.raises(IndexError)
+    def test_index_out_of_range(self):
+        self.generator.unrank(2, self.generator.count_by_nonterm('S', 2))
+
+    @nose.tools.raises(ValueError)
+    def test_not_a_derivation(self):
+        self.generator.rank(('S', ('B', 'b'), ('B', 'b')))
+
+
+class TestSampleDistinct(object):
+    """Test sampling strings without replacement."""
+
+    def test_distinct(self):
+        generator = cfl.CFLGenerator("""S -> '(' S ')' S | 'x' """, 9)
+        count = generator.count_by_nonterm('S', 7)
+        for number in (0, 1, count // 2, count):
+            strings = [''.join(string_)
+                       for string_ in generator.sample_distinct(7, number)]
+            assert len(set(strings)) == len(strings) == number
+
+    def test_huge_count(self):
+        generator = cfl.CFLGenerator("""S -> S S | 'a' | 'b' """, seed=1)
+        strings = generator.sample_distinct(300, 20)
+        assert len(set(map(tuple, strings))) == 20
+
+    @nose.tools.raises(ValueError)
+    def test_too_many(self):
+        generator = cfl.CFLGenerator("""S -> 'a' S | 'b' """, 3)
+        generator.sample_distinct(3, 2)
+
+
+class TestGenerateInRange(object):
+    """Test generating strings from a range of lengths."""
+
+    def test_skips_infeasible_lengths(self):
+        generator = cfl.CFLGenerator("""S -> 'a' S 'a' | 'b' """)
+        for i in range(20):
+            assert len(generator.generate_in_range(2, 6)) in (3, 5)
+
+    @nose.tools.raises(cfl.GenerationFailure)
+    def test_no_strings(self):
+        generator = cfl.CFLGenerator("""S -> 'a' S 'a' | 'b' """)
+        generator.generate_in_range(2, 2)
+
+    def test_infeasible_lengths_are_not_counted(self):
+        generator = cfl.CFLGenerator("""S -> 'a' S 'a' | 'b' """)
+        for length in (10 ** 9, 10 ** 9 + 2):
+            try:
+                generator.generate(length)
+            except cfl.GenerationFailure:
+                pass
+            else:
+                raise AssertionError('length %d has no strings' % length)
+        assert not generator.feasible(10 ** 9)
+        assert generator.feasible(10 ** 9 + 1)
+        assert len(generator.generate_in_range(20, 22)) == 21
+        assert generator.length == 21
+
+    def test_infeasible_lengths_have_no_count(self):
+        generator = cfl.CFLGenerator("""S -> '(' S ')' S | 'x' """, 10)
+        assert generator.count_by_nonterm('S', 3000) == 0
+        assert generator.length == 10
+
+
+class TestStats(object):
+    """Test the counters and timers of a generator."""
+
+    def setup(self):
+        self.generator = cfl.CFLGenerator("""S -> A S | 'b'
+                                             A -> 'a' """, 5)
+
+    def test_counts(self):
+        stats = self.generator.stats()
+        assert stats['nonterminals'] == 2 and stats['rules'] == 1
+        assert stats['cells'] == 3 * 4
+        assert stats['multiplies'] == 1 + 2 + 3 + 4
+        assert stats['max_bits'] == 1
+
+    def test_generation(self):
+        self.generator.generate(3)
+        self.generator.generate_many(4, 10)
+        try:
+            self.generator.generate(0, 'boustrophedon')
+        except cfl.GenerationFailure:
+            pass
+        stats = self.generator.stats()
+        assert stats['strings'] == 11
+        assert stats['nodes'] == 5 + 10 * 7
+        assert stats['failures'] == 1
+        assert stats['seconds']['generate'] > 0
+
+    def test_hooks(self):
+        phases = []
+        self.generator.hooks.append(lambda phase, seconds: phases.append(phase))
+        self.generator.generate(12)
+        assert phases == ['count', 'generate']
+
+    def test_format(self):
+        assert 'failures' in cfl.format_stats(self.generator.stats())
+
+
+class TestWriteStrings(object):
+    """Test the output formats of cfl.py."""
+
+    batches = [['ab', 'b'], [], ['"a"']]
+
+    def write(self, the_format):
+        out = io.BytesIO()
+        cfl.write_strings(iter(self.batches), out, the_format)
+        return out.getvalue()
+
+    def test_formats(self):
+        assert self.write('string') == 'ab\nb\n"a"\n'
+        assert self.write('nul') == 'ab\0b\0"a"\0'
+        assert self.write('jsonl') == '"ab"\n"b"\n"\\"a\\""\n'
+        assert json.loads(self.write('json')) == ['ab', 'b', '"a"']
+
+    def test_gzip(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'out.gz')
+            out = cfl.open_output(filename, compress=True)
+            cfl.write_strings(self.batches, out)
+            out.close()
+            assert gzip.open(filename).read() == 'ab\nb\n"a"\n'
+        finally:
+            shutil.rmtree(directory)
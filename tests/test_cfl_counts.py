@@ -4,7 +4,10 @@
 
 import unittest
 
+import nose
+
 from .. import cfl
+from .. import counttable
 
 
 def check_grammar(generator, answers):
@@ -44,11 +47,102 @@ def test_gen():
          }
         ),
     ]
+    backends = ['python']
+    if counttable.have_numpy():
+        backends.append('numpy')
     for grammar, answers in pairs:
         max_str_len = len(answers.itervalues().next())
-        generator = cfl.CFLGenerator(grammar, max_str_len)
-        yield (check_grammar, generator, answers)
+        for backend in backends:
+            generator = cfl.CFLGenerator(grammar, max_str_len, backend=backend)
+            yield (check_grammar, generator, answers)
+
+
+def test_backends_agree():
+    """The numpy backend must match the pure Python one past int64 range."""
+    if not counttable.have_numpy():
+        raise nose.SkipTest('numpy is not installed')
+    grammar = """S -> S S | A S | 'a' | 'b'
+                   A -> 'a' | 'c'
+                """
+    python = cfl.CFLGenerator(grammar, 80, backend='python')
+    numpy = cfl.CFLGenerator(grammar, 80, backend='numpy')
+    for nonterm in ('S', 'A'):
+        for length in range(1, 81):
+            assert python.count_by_nonterm(nonterm, length) == \
+                   numpy.count_by_nonterm(nonterm, length)
+
+
+def test_default_backend():
+    """Short tables are counted in Python. A long extension whose counts fit
+    in int64 moves to numpy if it is installed."""
+    generator = cfl.CFLGenerator("""S -> 'a' S 'b' | 'a' 'b' """, 10)
+    assert generator.stats()['backend'] == 'CountTable'
+    assert generator.count_by_nonterm('S', 1200) == 1
+    if counttable.have_numpy():
+        assert generator.stats()['backend'] == 'NumpyCountTable'
+    else:
+        assert generator.stats()['backend'] == 'CountTable'
+    assert generator.count_by_nonterm('S', 1198) == 1
+    assert generator.count_by_nonterm('S', 1199) == 0
+
+
+def test_approximate_counts():
+    """The approximate backend is within rounding error of the exact counts,
+    far past the range of a float, and it can still generate strings."""
+    grammar = """S -> S S | A S | 'a' | 'b'
+                   A -> 'a' | 'c'
+                """
+    exact = cfl.CFLGenerator(grammar, 600, backend='python')
+    approximate = cfl.CFLGenerator(grammar, 600, backend='approximate')
+    assert exact.count_by_nonterm('S', 600) > 2 ** 1100
+    for nonterm in ('S', 'A'):
+        for length in range(1, 601):
+            count = exact.count_by_nonterm(nonterm, length)
+            estimate = approximate.count_by_nonterm(nonterm, length)
+            assert abs(estimate - count) * 10 ** 9 <= count
+    assert len(approximate.generate(600)) == 600
+    assert len(approximate.generate_in_range(590, 600)) >= 590
+
 
+def test_max_bits():
+    """Every backend keeps the bits of its largest count."""
+    grammar = """S -> S S | A S | 'a' | 'b'
+                   A -> 'a' | 'c'
+                """
+    exact = cfl.CFLGenerator(grammar, 300, backend='python')
+    bits = max(exact.count_by_nonterm(nonterm, length).bit_length()
+               for nonterm in ('S', 'A') for length in range(1, 301))
+    assert exact.stats()['max_bits'] == bits > 500
+    backends = ['approximate']
+    if counttable.have_numpy():
+        backends.append('numpy')
+    for backend in backends:
+        generator = cfl.CFLGenerator(grammar, 300, backend=backend)
+        assert abs(generator.stats()['max_bits'] - bits) <= 1
 
 
+def test_merge_equivalent():
+    """S and X have the same rules, so they are merged, and merging them
+    doesn't change any count. A's rules A -> X A and A -> S A become one rule
+    of weight 2."""
+    from ..cfgparse import Nonterminal, parse_grammar
+    from ..compiledgrammar import CompiledGrammar
 
+    start, productions = parse_grammar("""S -> A X | U B | X A
+                                          X -> A X | U B | X A
+                                          A -> 'b' | A X | U B | X A | S A
+                                          B -> 'b'
+                                          U -> 'a'""")
+    compiled = CompiledGrammar(start, productions)
+    merged = compiled.merge_equivalent()
+    assert len(merged) == len(compiled) - 1
+    assert merged.nonterminal_id(Nonterminal('S')) == \
+           merged.nonterminal_id(Nonterminal('X'))
+    assert sorted(merged.rule_weights) == [1] * 5 + [2]
+    table = counttable.CountTable(compiled)
+    merged_table = counttable.CountTable(merged)
+    table.extend(12)
+    merged_table.extend(12)
+    for A, nonterm in enumerate(compiled.nonterminals):
+        assert table.rows[A] == \
+               merged_table.rows[merged.nonterminal_id(nonterm)]
@@ -6,9 +6,10 @@ When given an unambiguous input grammar, all strings should be generated at the
 same frequency. To test this, a number of unambiguous grammars are passed
 to cfl.CFLGenera
 
-Note that a failure here doesn't necessarily mean there's a problem since 
-there's a small chance something unlikely happened.
-
+Besides the checks of each string's frequency, the counts of each check
+are tested for uniformity with a chi-square test at level ALPHA, which is the
+chance that the test fails for an exactly uniform generator. The generators
+are seeded, so the outcome doesn't change from run to run.
 """
 
 from __future__ import division
@@ -17,9 +18,36 @@ from collections import defaultdict
 import random
 
 from .. import cfl
+from ..checkambi import _gamma_q
+
+
+# Chance that the chi-square test of one check fails for a uniform generator.
+# There are fewer than 100 checks, so for any seeds the chance that one of
+# them fails by chance is below 1e-4.
+ALPHA = 1e-6
+
+
+def check_chi_square(results, categories):
+    """Assert that the counts `results` of strings drawn from `categories`
+    strings pass a chi-square test of uniformity at level ALPHA. Strings
+    that were never drawn count as 0."""
+    if categories < 2:
+        return
+    total = sum(results.values())
+    expected = total / categories
+    statistic = sum(count * count for count in results.values()) / expected \
+        - total
+    assert _gamma_q((categories - 1) / 2, statistic / 2) >= ALPHA
 
 
-def check_grammar(generator, length):
+def number_of_strings(generator, lower, upper):
+    """Return the number of strings with lengths from `lower` to `upper`."""
+    start = generator.compiled.nonterminals[generator.compiled.start]
+    return sum(int(round(generator.count_by_nonterm(start, length)))
+               for length in range(lower, upper + 1))
+
+
+def check_grammar(generator, length, method):
     """Generate a lot of strings, make sure they are roughly as likely."""
     results = defaultdict(int)
     # TODO: See when the probability converges. Use it to choose the number
@@ -30,7 +58,7 @@ def check_grammar(generator, length):
     N = 2000
     for i in range(N):
         try:
-            string_ = ''.join(generator.generate(length))
+            string_ = ''.join(generator.generate(length, method))
         except cfl.GenerationFailure:
             # Skip this grammar since it can't generate strings of the required
             # length and it can't help test randomness.
@@ -44,6 +72,24 @@ def check_grammar(generator, length):
         probability = count / total
         diff = abs(expected_probability - probability)
         assert diff < .03
+    check_chi_square(results, number_of_strings(generator, length, length))
+
+def check_grammar_many(generator, length):
+    """Like check_grammar, for strings generated in one batch."""
+    try:
+        strings = generator.generate_many(length, 10000)
+    except cfl.GenerationFailure:
+        return
+    results = defaultdict(int)
+    for string_ in strings:
+        results[''.join(string_)] += 1
+
+    expected_probability = 1 / len(results)
+    for string_, count in results.iteritems():
+        probability = count / len(strings)
+        diff = abs(expected_probability - probability)
+        assert diff < .03
+    check_chi_square(results, number_of_strings(generator, length, length))
 
 def test_gen():
     grammars = [
@@ -58,6 +104,58 @@ def test_gen():
         """,
     ]
     for gram in grammars:
-        generator = cfl.CFLGenerator(gram, 10)
+        generator = cfl.CFLGenerator(gram, 10, seed=1)
+        for method in cfl.GENERATION_METHODS:
+            for i in range(1, 11):
+                yield (check_grammar, generator, i, method)
+        for i in range(1, 11):
+            yield (check_grammar_many, generator, i)
+        for upper in range(2, 6):
+            yield (check_grammar_range, generator, 1, upper)
+
+        # Approximate counts make the probabilities nearly uniform, far closer
+        # than these checks can tell.
+        approximate = cfl.CFLGenerator(gram, 10, backend='approximate',
+                                       seed=2)
+        for method in cfl.GENERATION_METHODS:
+            for i in range(1, 11):
+                yield (check_grammar, approximate, i, method)
         for i in range(1, 11):
-            yield (check_grammar, generator, i)
+            yield (check_grammar_many, approximate, i)
+        yield (check_grammar_range, approximate, 1, 5)
+
+
+def check_grammar_range(generator, lower, upper):
+    """Strings from a range of lengths are all roughly as likely, whatever
+    their length."""
+    results = defaultdict(int)
+    N = 10000
+    for i in range(N):
+        results[''.join(generator.generate_in_range(lower, upper))] += 1
+
+    expected_probability = 1 / len(results)
+    for string_, count in results.iteritems():
+        assert abs(expected_probability - count / N) < .03
+    check_chi_square(results, number_of_strings(generator, lower, upper))
+
+def check_weighted(generator, method):
+    """'ab' has two derivations and 'db' one, so 'ab' is twice as likely."""
+    N = 3000
+    if method == 'many':
+        strings = generator.generate_many(2, N)
+    else:
+        strings = [generator.generate(2, method) for i in range(N)]
+    ab = sum(1 for string_ in strings if ''.join(string_) == 'ab')
+    assert abs(ab / N - 2 / 3) < .03
+
+def test_weighted_rules():
+    """A and C are merged into one nonterminal, so S -> A B and S -> C B
+    become a single rule of weight 2."""
+    generator = cfl.CFLGenerator("""S -> A B | C B | D B
+                                    A -> 'a'
+                                    C -> 'a'
+                                    D -> 'd'
+                                    B -> 'b'""", 2)
+    assert sorted(generator.compiled.rule_weights) == [1, 2]
+    for method in cfl.GENERATION_METHODS + ('many',):
+        yield (check_weighted, generator, method)
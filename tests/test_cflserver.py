@@ -0,0 +1,141 @@
+"""
+Tests for the generation server.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+import nose
+
+from .. import cfl
+from .. import cflserver
+
+
+GRAMMAR = """S -> 'a' S 'a' | 'b' """
+
+
+def test_parse_address():
+    assert cflserver.parse_address('localhost:8123') == ('localhost', 8123)
+    assert cflserver.parse_address(':8123') == ('localhost', 8123)
+    assert cflserver.parse_address('/tmp/cfl.sock') == '/tmp/cfl.sock'
+    assert cflserver.parse_address('/tmp/a:1') == '/tmp/a:1'
+
+
+class TestAnswer(object):
+    """Test the answers to requests, without sockets."""
+
+    def setup(self):
+        self.registry = cflserver.GeneratorRegistry()
+
+    def answer(self, **request):
+        request.setdefault('grammar', GRAMMAR)
+        return cflserver.answer(self.registry, json.dumps(request))
+
+    def test_generate_like_cfl(self):
+        response = self.answer(op='generate', number=20, lower=1, upper=9,
+                               seed=3, separator=' ', id=7)
+        generator = cfl.CFLGenerator(GRAMMAR)
+        assert response['ok'] and response['id'] == 7
+        assert response['strings'] == cfl._generate_chunk(generator, 20, 3,
+                                                          (1, 9), ' ')
+
+    def test_count_and_feasible(self):
+        assert self.answer(op='count', length=7)['count'] == 1
+        assert self.answer(op='count', length=8)['count'] == 0
+        assert self.answer(op='feasible', length=10 ** 9 + 1)['feasible']
+        assert not self.answer(op='feasible', length=10 ** 9)['feasible']
+
+    def test_generators_are_kept(self):
+        self.answer(op='generate', length=5)
+        self.answer(op='generate', length=51)
+        assert len(self.registry) == 1
+        stats = self.answer(op='stats')['stats']
+        assert stats['strings'] == 2 and stats['length'] == 51
+
+    def test_errors(self):
+        responses = [self.answer(op='generate', length=4),
+                     self.answer(op='fly'),
+                     self.answer(op='count', length=5, nonterminal='X'),
+                     self.answer(op='count', grammar='gram.cfg', length=5),
+                     cflserver.answer(self.registry, '{"op": '),
+                     cflserver.answer(self.registry, '[]')]
+        for response in responses:
+            assert not response['ok'] and response['error']
+        assert responses[2]['error'] == 'Unknown nonterminal "X".'
+        assert self.answer(op='count')['error'] == 'The request has no length.'
+
+    def test_bad_number(self):
+        for number in (-5, 2.5, '3', True, None):
+            response = self.answer(op='generate', length=5, number=number)
+            assert response['error'] == \
+                'number must be a non-negative integer.'
+        assert self.answer(op='generate', length=5, number=0)['strings'] == []
+
+
+class TestServer(object):
+    """Test a client and a server on a Unix socket."""
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.address = os.path.join(self.directory, 'cfl.sock')
+        self.server = cflserver.make_server(self.address,
+                                            cflserver.GeneratorRegistry())
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def teardown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def test_requests(self):
+        client = cflserver.Client(self.address)
+        try:
+            for i in range(10):
+                assert client.generate(GRAMMAR, 2, 3, 3) == ['aba', 'aba']
+            assert client.count(GRAMMAR, 5) == 1
+            assert not client.feasible(GRAMMAR, 2)
+        finally:
+            client.close()
+
+    @nose.tools.raises(cflserver.ServerError)
+    def test_error(self):
+        cflserver.Client(self.address).generate(GRAMMAR, 1, 2, 2)
+
+    def test_stale_socket_is_replaced(self):
+        self.server.shutdown()
+        self.server.server_close()
+        assert os.path.exists(self.address)
+        self.server = cflserver.make_server(self.address,
+                                            cflserver.GeneratorRegistry())
+        self.thread.join()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        assert cflserver.Client(self.address).feasible(GRAMMAR, 3)
+
+
+def test_sigterm_removes_socket():
+    directory = tempfile.mkdtemp()
+    address = os.path.join(directory, 'cfl.sock')
+    server = subprocess.Popen(
+        [sys.executable, cflserver.__file__.replace('.pyc', '.py'),
+         '--address', address, '--no-cache'], stderr=subprocess.PIPE)
+    try:
+        server.stderr.readline()    # Listening on ...
+        assert os.path.exists(address)
+        server.terminate()
+        assert server.wait() == 0
+        assert not os.path.exists(address)
+    finally:
+        shutil.rmtree(directory)
+
+
+@nose.tools.raises(cflserver.ServerError)
+def test_no_server():
+    cflserver.Client(os.path.join(tempfile.gettempdir(), 'no', 'cfl.sock'))
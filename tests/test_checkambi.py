@@ -0,0 +1,47 @@
+"""
+Tests for the sequential ambiguity test of checkambi.
+"""
+
+from __future__ import division
+
+from math import exp
+
+from .. import checkambi
+
+
+def test_gamma_q():
+    # Q(1, x) = exp(-x) and Q(1/2, x) = erfc(sqrt(x)).
+    for x in (0.1, 1.0, 5.0, 40.0):
+        assert abs(checkambi._gamma_q(1, x) - exp(-x)) < 1e-12
+    assert abs(checkambi._gamma_q(0.5, 2.0) - 0.0455002638963584) < 1e-12
+
+
+def test_p_value_uniform():
+    assert checkambi._p_value([10] * 100, 1000, 100) > 0.5
+    assert checkambi._p_value([20] * 50, 1000, 100) < 1e-10
+
+
+def test_p_value_sparse():
+    """With far more strings than draws, repeats are what matters."""
+    assert checkambi._p_value([1] * 1000, 1000, 10 ** 9) == 1.0
+    assert checkambi._p_value([2] * 500, 1000, 10 ** 9) < 1e-10
+
+
+def test_ambiguous():
+    results, p_value = checkambi.check_ambiguity(
+        "E -> E '+' E | 'x'", range(1, 8), seed=1, cache_dir=None)
+    verdicts = dict((result.length, result.verdict) for result in results)
+    assert sorted(verdicts) == [1, 3, 5, 7]
+    assert verdicts[1] == verdicts[3] == 'unambiguous'
+    assert verdicts[5] == verdicts[7] == 'ambiguous'
+    assert p_value < checkambi.DEFAULT_ALPHA
+
+
+def test_unambiguous():
+    """Every string of each length is seen, which proves the lengths
+    unambiguous."""
+    results, p_value = checkambi.check_ambiguity(
+        "E -> T '+' E | T \n T -> 'x' | 'y' | '(' E ')'", range(1, 8),
+        seed=1, cache_dir=None)
+    assert all(result.verdict == 'unambiguous' for result in results)
+    assert all(result.distinct == result.derivations for result in results)
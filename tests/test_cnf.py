@@ -18,6 +18,7 @@ from nltk.grammar import Nonterminal, parse_cfg
 
 from .. import cnf
 from .. import cfl
+from .. import cyk
 
 
 def check_is_cnf(grammar_str):
@@ -27,23 +28,77 @@ def check_is_cnf(grammar_str):
     assert converted.is_chomsky_normal_form()
 
 def check_generates_same(grammar_str):
-    """Checks that the original and converted grammars are the same."""
+    """Checks that the original and converted grammars are the same.
+
+    The strings are checked against derives(), which works on the original
+    grammar and shares no code with the conversion: every string generated
+    from the converted grammar must be derived by the original, and every
+    short string that the original derives must be recognized with the
+    converted one.
+    """
     grammar = nltk.grammar.parse_cfg(grammar_str)
     converted = cnf.convert_to_cnf(copy.deepcopy(grammar))
-    #TODO: Maybe generate some strings using `grammar` then try to parse them
-    # using the second grammar.
     generator = cfl.CFLGenerator(converted)
-    strings = set()
-    for length in range(15):
-        try:
-            s = generator.generate(length)
-        except cfl.GenerationFailure:
-            continue
-        finally:
-            length += 1
-            
-        strings.add(''.join(s))
-
+    for i in range(50):
+        assert derives(grammar, generator.generate_in_range(1, 14))
+
+    recognizer = cyk.Recognizer(generator.compiled)
+    terminals = sorted(set(token for prod in grammar.productions()
+                           for token in prod.rhs()
+                           if isinstance(token, basestring)))
+    for tokens in all_strings(terminals, 6):
+        assert recognizer.recognize(tokens) == derives(grammar, tokens)
+
+
+def all_strings(terminals, max_length):
+    """Return every nonempty list of `terminals` up to `max_length` long."""
+    strings = [[terminal] for terminal in terminals]
+    result = list(strings)
+    for length in range(2, max_length + 1):
+        strings = [string_ + [terminal] for string_ in strings
+                   for terminal in terminals]
+        result.extend(strings)
+    return result
+
+
+def derives(grammar, tokens):
+    """Return whether the nltk grammar `grammar` derives the list of
+    terminals `tokens`, by brute force.
+
+    `found` collects the (nonterminal, i, j) such that the nonterminal
+    derives tokens[i:j], adding them until nothing changes, so empty and
+    unit productions need no special handling.
+    """
+    n = len(tokens)
+    found = set()
+
+    def matches(rhs, i, j):
+        """Return whether the sequence `rhs` derives tokens[i:j]."""
+        if not rhs:
+            return i == j
+        first, rest = rhs[0], rhs[1:]
+        if isinstance(first, basestring):
+            return i < j and tokens[i] == first and matches(rest, i + 1, j)
+        return any((first, i, k) in found and matches(rest, k, j)
+                   for k in range(i, j + 1))
+
+    changed = True
+    while changed:
+        changed = False
+        for prod in grammar.productions():
+            for i in range(n + 1):
+                for j in range(i, n + 1):
+                    key = (prod.lhs(), i, j)
+                    if key not in found and matches(prod.rhs(), i, j):
+                        found.add(key)
+                        changed = True
+    return (grammar.start(), 0, n) in found
+
+
+def test_derives():
+    grammar = nltk.grammar.parse_cfg("""S -> A S B | \n A -> 'a' \n B -> 'b'""")
+    assert derives(grammar, ['a', 'a', 'b', 'b'])
+    assert not derives(grammar, ['a', 'b', 'b'])
 
 
 #def test_other():
@@ -70,16 +125,53 @@ def test_not_binary():
 
 def test_unit_rules():
     grammars = ["""S -> A | B | C \n A -> 'a' \n B -> 'b' \n C -> 'c' """,
+                """S -> A B \n A -> 'a' \n B -> """,
                ]
-                """S -> A B \n A -> 'a' \n B -> """
     for grammar in grammars:
         check_is_cnf(grammar)
-#        yield (check_is_cnf, grammar)
-#        yield (check_generates_same, grammar)
+        check_generates_same(grammar)
 
 def test_mixed_terminals():
     grammars = ["""S -> 'b' A \n A -> 'a' """,]
     for grammar in grammars:
         check_is_cnf(grammar)
-#        yield (check_is_cnf, grammar)
-#        yield (check_generates_same, grammar)
+        check_generates_same(grammar)
+
+
+def test_transitive_units():
+    """S reaches C only through a chain of unit productions."""
+    grammar = nltk.grammar.parse_cfg("""S -> A \n A -> B \n B -> C \n C -> 'c'""")
+    converted = cnf.convert_to_cnf(grammar)
+    assert converted.is_chomsky_normal_form()
+    assert [prod.rhs() for prod in converted.productions()
+            if prod.lhs() == grammar.start()] == [('c',)]
+
+
+def test_counts_preserved():
+    """Balanced parentheses: the unambiguous grammar S -> '(' S ')' S | ''
+    has a Catalan number of strings of each even length."""
+    generator = cfl.CFLGenerator("""S -> '(' S ')' S | """, 8)
+    assert [generator.count_by_nonterm(Nonterminal('S'), length)
+            for length in range(1, 9)] == [0, 1, 0, 2, 0, 5, 0, 14]
+
+
+def test_convert_productions():
+    """The conversion works on (lhs, rhs) pairs of any nonterminal type."""
+    S, A = Symbol('S'), Symbol('A')
+    productions = cnf.convert_productions(
+        S, [(S, (A, 'b')), (S, ()), (A, (S,))], Symbol)
+    assert all(len(rhs) == 1 and isinstance(rhs[0], basestring) or
+               len(rhs) == 2 and all(isinstance(token, Symbol)
+                                     for token in rhs)
+               for (lhs, rhs) in productions)
+    assert (S, ('b',)) in productions
+
+
+class Symbol(object):
+    """A minimal nonterminal type for test_convert_productions."""
+
+    def __init__(self, symbol):
+        self._symbol = symbol
+
+    def symbol(self):
+        return self._symbol
@@ -0,0 +1,72 @@
+"""
+Tests for the CYK recognizer.
+"""
+
+import random
+
+from .. import cfl
+from .. import cyk
+
+
+BALANCED = """S -> '(' S ')' S | """
+
+
+def is_balanced(string_):
+    depth = 0
+    for token in string_:
+        depth += 1 if token == '(' else -1
+        if depth < 0:
+            return False
+    return depth == 0
+
+
+def all_strings(length):
+    if not length:
+        return [[]]
+    return [[token] + rest for rest in all_strings(length - 1)
+            for token in '()']
+
+
+def test_balanced():
+    recognizer = cyk.Recognizer(cfl.CFLGenerator(BALANCED).compiled)
+    for length in range(9):
+        for string_ in all_strings(length):
+            assert recognizer.recognize(string_) == \
+                   (bool(string_) and is_balanced(string_))
+
+
+def test_batch_agrees():
+    recognizer = cyk.Recognizer(cfl.CFLGenerator(BALANCED).compiled)
+    strings = [string_ for length in range(11)
+               for string_ in all_strings(length)]
+    assert recognizer.recognize_many(strings) == \
+           [recognizer.recognize(string_) for string_ in strings]
+
+
+def test_generated_strings():
+    """Generated strings are in the language and most of their mutations
+    aren't."""
+    generator = cfl.CFLGenerator("""E -> T '+' E | T
+                                    T -> F '*' T | F
+                                    F -> 'x' | 'y' | '(' E ')'""", 25, seed=1)
+    recognizer = cyk.Recognizer(generator.compiled)
+    strings = generator.generate_many(25, 50)
+    assert all(recognizer.recognize_many(strings))
+
+    rng = random.Random(1)
+    mutated = []
+    for string_ in strings:
+        string_ = list(string_)
+        string_[rng.randrange(len(string_))] = '+'
+        string_[rng.randrange(len(string_))] = ')'
+        mutated.append(string_)
+    accepted = recognizer.recognize_many(mutated)
+    assert accepted == [recognizer.recognize(string_) for string_ in mutated]
+    assert not all(accepted)
+
+
+def test_unknown_terminal():
+    recognizer = cyk.Recognizer(cfl.CFLGenerator("S -> 'a' S | 'a'").compiled)
+    assert not recognizer.recognize(['a', 'b'])
+    assert recognizer.recognize_many([['a', 'b'], ['a', 'a']]) == \
+           [False, True]
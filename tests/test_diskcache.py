@@ -0,0 +1,62 @@
+"""
+Tests for the on-disk cache of CNF grammars and count tables.
+"""
+
+import os
+import shutil
+import tempfile
+
+from .. import cfl
+from .. import diskcache
+
+
+GRAMMAR = """S -> S S | A B | 'c'
+             A -> 'a'
+             B -> 'b'
+          """
+
+
+class TestDiskCache(object):
+
+    def setup(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_reload(self):
+        first = cfl.CFLGenerator(GRAMMAR, 12, cache_dir=self.cache_dir)
+        assert os.path.exists(diskcache.cache_path(self.cache_dir, GRAMMAR))
+        second = cfl.CFLGenerator(GRAMMAR, 5, cache_dir=self.cache_dir)
+        assert second.length == 12
+        for length in range(1, 13):
+            assert first.count_by_nonterm('S', length) == \
+                   second.count_by_nonterm('S', length)
+        assert len(second.generate(12)) == 12
+
+    def test_extend(self):
+        cfl.CFLGenerator(GRAMMAR, 6, cache_dir=self.cache_dir)
+        extended = cfl.CFLGenerator(GRAMMAR, 15, cache_dir=self.cache_dir)
+        uncached = cfl.CFLGenerator(GRAMMAR, 15)
+        for length in range(1, 16):
+            assert extended.count_by_nonterm('S', length) == \
+                   uncached.count_by_nonterm('S', length)
+        state = diskcache.load(self.cache_dir, GRAMMAR)
+        assert state['snapshot'][0] == 15
+
+    def test_writes_when_grown(self):
+        generator = cfl.CFLGenerator(GRAMMAR, 10, cache_dir=self.cache_dir)
+        generator.count_by_nonterm('S', 15)
+        assert diskcache.load(self.cache_dir, GRAMMAR)['snapshot'][0] == 10
+        generator.count_by_nonterm('S', 20)
+        assert diskcache.load(self.cache_dir, GRAMMAR)['snapshot'][0] == 20
+        generator.count_by_nonterm('S', 25)
+        generator.save_cache()
+        assert diskcache.load(self.cache_dir, GRAMMAR)['snapshot'][0] == 25
+
+    def test_corrupt_file(self):
+        with open(diskcache.cache_path(self.cache_dir, GRAMMAR), 'wb') as f:
+            f.write('not a cache file')
+        generator = cfl.CFLGenerator(GRAMMAR, 4, cache_dir=self.cache_dir)
+        assert generator.count_by_nonterm('S', 4) == \
+               cfl.CFLGenerator(GRAMMAR, 4).count_by_nonterm('S', 4)
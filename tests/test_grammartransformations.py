@@ -0,0 +1,54 @@
+"""
+Tests for the removal of useless symbols from grammars.
+"""
+
+from .. import cfgparse
+from .. import cfl
+from .. import grammartransformations
+from ..cfgparse import Nonterminal
+
+
+GRAMMAR = """
+S -> A B | 'x' | U
+A -> 'a' | A C
+B -> 'b' | L B
+C -> D C
+D -> 'd'
+L -> S L
+U -> 'u'
+V -> 'v' S
+"""
+
+
+def test_generating():
+    start, productions = cfgparse.parse_grammar(GRAMMAR)
+    assert grammartransformations.generating_symbols(productions) == \
+        set(map(Nonterminal, 'SABDUV'))
+
+
+def test_reachable():
+    start, productions = cfgparse.parse_grammar(GRAMMAR)
+    assert grammartransformations.reachable_symbols(start, productions) == \
+        set(map(Nonterminal, 'SABCDLU'))
+
+
+def test_remove_useless():
+    """C and L never finish a derivation, so D becomes unreachable once they
+    are gone, and nothing derives V."""
+    start, productions = cfgparse.parse_grammar(GRAMMAR)
+    useful = grammartransformations.remove_useless(start, productions)
+    assert set(lhs for (lhs, rhs) in useful) == set(map(Nonterminal, 'SABU'))
+    assert (Nonterminal('A'), (Nonterminal('A'), Nonterminal('C'))) \
+        not in useful
+
+
+def test_nongenerating_start():
+    start, productions = cfgparse.parse_grammar("S -> S 'a'")
+    assert grammartransformations.remove_useless(start, productions) == []
+
+
+def test_generator_drops_useless():
+    generator = cfl.CFLGenerator("""S -> A B \n A -> 'a' \n B -> 'b'
+                                    C -> 'c' \n D -> D D""", 4)
+    assert generator.nonterminals == set(map(Nonterminal, 'SAB'))
+    assert generator.count_by_nonterm(Nonterminal('S'), 2) == 1
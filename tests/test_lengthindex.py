@@ -0,0 +1,65 @@
+"""
+Tests for the index of the lengths that each nonterminal derives.
+"""
+
+import random
+
+from .. import cfgparse
+from ..compiledgrammar import CompiledGrammar
+from ..counttable import CountTable
+from ..lengthindex import LengthIndex
+
+
+def compile_grammar(text):
+    return CompiledGrammar(*cfgparse.parse_grammar(text))
+
+
+def check_against_counts(compiled, length):
+    """The index says a length is feasible exactly when it has strings."""
+    index = LengthIndex(compiled)
+    table = CountTable(compiled)
+    table.extend(length)
+    for A, row in enumerate(table.rows):
+        for n in range(1, length + 1):
+            assert index.feasible(A, n) == bool(row[n])
+
+
+def test_random_grammars():
+    rng = random.Random(2)
+    for trial in range(50):
+        nonterms = [cfgparse.Nonterminal('N%d' % i)
+                    for i in range(rng.randint(1, 5))]
+        productions = []
+        for lhs in nonterms:
+            if rng.random() < 0.5:
+                productions.append((lhs, ('t',)))
+            for i in range(rng.randint(0, 3)):
+                productions.append((lhs, (rng.choice(nonterms),
+                                          rng.choice(nonterms))))
+        yield (check_against_counts,
+               CompiledGrammar(nonterms[0], productions), 300)
+
+
+def test_period():
+    # The lengths are 3, 6, 9, ...
+    compiled = compile_grammar("""S -> A Y | S S
+                                  Y -> A A
+                                  A -> 'a' """)
+    index = LengthIndex(compiled)
+    assert index.period == 3
+    start = compiled.start
+    assert index.feasible(start, 3 * 10 ** 12)
+    assert not index.feasible(start, 3 * 10 ** 12 + 1)
+    assert not index.feasible(start, 3 * 10 ** 12 + 2)
+
+
+def test_no_period_found():
+    """Past the bound, a length is unknown if no period was found."""
+    compiled = compile_grammar("""S -> A Y | S S
+                                  Y -> A A
+                                  A -> 'a' """)
+    index = LengthIndex(compiled, max_bound=6)
+    assert index.period is None
+    assert index.feasible(compiled.start, 6)
+    assert not index.feasible(compiled.start, 5)
+    assert index.feasible(compiled.start, 9) is None
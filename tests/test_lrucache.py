@@ -0,0 +1,35 @@
+"""
+Tests for the size-bounded LRU cache used for CFLGenerator's prefix sums.
+"""
+
+from .. import lrucache
+
+
+def test_evicts_least_recently_used():
+    cache = lrucache.LRUCache(3)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.put('c', 3)
+    assert cache.get('a') == 1    # 'b' is now the least recently used.
+    cache.put('d', 4)
+    assert 'b' not in cache
+    assert [cache.get(key) for key in 'acd'] == [1, 3, 4]
+
+
+def test_sizes():
+    cache = lrucache.LRUCache(10)
+    cache.put('a', [0] * 4, 4)
+    cache.put('b', [0] * 4, 4)
+    cache.put('c', [0] * 4, 4)
+    assert 'a' not in cache
+    assert cache.size == 8
+    cache.put('huge', [0] * 11, 11)
+    assert 'huge' not in cache
+    assert cache.size == 8
+
+
+def test_disabled():
+    cache = lrucache.LRUCache(0)
+    cache.put('a', 1)
+    assert cache.get('a') is None
+    assert len(cache) == 0